@@ -1,64 +1,461 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory, g, abort, Response, stream_with_context
+from flask import has_request_context, before_render_template, template_rendered
 import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_ # <-- TAMBAHKAN BARIS INI
+from flask_sqlalchemy.session import Session as SesiFlaskSQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import func, tuple_, text, and_, or_, event, create_engine
+from sqlalchemy.exc import OperationalError
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
 import os
 import random
 import string
-from functools import wraps
+import threading
+import time
+import json
+import re
+import base64
+import hmac
+import hashlib
+import secrets
+import sqlite3
+import gzip
+import shutil
+import tempfile
+import fcntl
+import csv
+import io
+import click
+import sys
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import namedtuple, deque, Counter, OrderedDict
+from types import MappingProxyType
+from functools import wraps, partial, lru_cache
+from contextlib import contextmanager, redirect_stdout
+from markupsafe import Markup
+
+try:
+    import openpyxl  # tercantum di requirements.txt; tanpa paket ini impor/ekspor XLSX dimatikan, CSV tetap jalan
+except ImportError:
+    openpyxl = None
 
 base_dir = os.path.abspath(os.path.dirname(__file__))
 
+# --- MESIN DATABASE ---
+# Profil PRAGMA SQLite. 'bawaan' = pengaturan SQLite apa adanya (journal rollback). 'wal' membuat
+# pembaca tidak memblokir penulis; synchronous NORMAL aman terhadap crash aplikasi (bukan mati listrik).
+PROFIL_SQLITE = {
+    'bawaan': {},
+    'wal': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -20000,
+            'mmap_size': 128 * 1024 * 1024, 'temp_store': 'MEMORY'},
+    'wal-aman': {'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': -20000,
+                 'mmap_size': 128 * 1024 * 1024, 'temp_store': 'MEMORY'},
+}
+SQLITE_PROFIL = os.environ.get('RUMI_SQLITE_PROFIL', 'wal')
+SQLITE_BUSY_MS = int(os.environ.get('RUMI_SQLITE_BUSY_MS', '5000'))
+# Pool baca-saja terpisah: SELECT di luar transaksi tulis memakai koneksi mode=ro, sedangkan transaksi
+# tulis memakai engine utama dengan BEGIN IMMEDIATE sehingga kunci tulis diambil di awal (menunggu
+# busy_timeout) alih-alih gagal "database is locked" saat transaksi baca naik menjadi transaksi tulis.
+SQLITE_POOL_BACA = os.environ.get('RUMI_SQLITE_POOL_BACA', '1') == '1'
+SQLITE_POOL_BACA_UKURAN = int(os.environ.get('RUMI_SQLITE_POOL_BACA_UKURAN', '8'))
+# Opsional: antrekan transaksi tulis di dalam satu proses (berguna untuk worker gthread).
+SQLITE_SERIAL_TULIS = os.environ.get('RUMI_SQLITE_SERIAL_TULIS', '0') == '1'
+
+def pasang_pragma(engine, profil, baca_saja=False, begin_immediate=False):
+    pragma = dict(PROFIL_SQLITE[profil], busy_timeout=SQLITE_BUSY_MS)
+    if baca_saja:
+        pragma.pop('journal_mode', None)
+        pragma['query_only'] = 'ON'
+
+    @event.listens_for(engine, 'connect')
+    def atur_koneksi(dbapi_connection, connection_record):
+        if begin_immediate:
+            # Transaksi dikelola sendiri lewat event 'begin' di bawah (resep SQLAlchemy untuk pysqlite)
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for nama, nilai in pragma.items():
+            cursor.execute(f'PRAGMA {nama} = {nilai}')
+        cursor.close()
+
+    if begin_immediate:
+        @event.listens_for(engine, 'begin')
+        def mulai_transaksi(connection):
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+_kunci_tulis = threading.Lock()
+
+class AntreanTulisPenuh(Exception):
+    # SQLITE_SERIAL_TULIS aktif dan kunci tulis tidak didapat dalam SQLITE_BUSY_MS
+    pass
+_POLA_PERINTAH_BACA = re.compile(r'\s*(SELECT|WITH)\b(?!.*\b(INSERT|UPDATE|DELETE)\b)', re.IGNORECASE | re.DOTALL)
+
+def adalah_perintah_baca(clause):
+    if clause is None:
+        return True
+    if getattr(clause, 'is_dml', False):
+        return False
+    if getattr(clause, 'is_select', False):
+        return True
+    return bool(_POLA_PERINTAH_BACA.match(str(clause)))
+
+class SesiRute(SesiFlaskSQLAlchemy):
+    # Membaca lewat pool baca-saja sampai transaksi pertama kali menulis; sejak itu semua perintah
+    # (termasuk baca) memakai engine utama agar transaksi melihat tulisannya sendiri.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self.info.get('menulis') and (self._flushing or not adalah_perintah_baca(clause)):
+            # Tanpa kunci, tulisan tidak boleh jalan tanpa antrean: gagal dengan 503 (lihat tangani_antrean_tulis_penuh)
+            if SQLITE_SERIAL_TULIS and not _kunci_tulis.acquire(timeout=SQLITE_BUSY_MS / 1000):
+                raise AntreanTulisPenuh()
+            self.info['menulis'] = True
+            self.info['kunci_tulis'] = SQLITE_SERIAL_TULIS
+        if bind is None and SQLITE_POOL_BACA and not self.info.get('menulis'):
+            return db.engines['baca']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(SesiRute, 'after_transaction_end')
+def akhiri_transaksi_sesi(sesi, transaksi):
+    if transaksi.parent is None:
+        sesi.info.pop('menulis', None)
+        if sesi.info.pop('kunci_tulis', False):
+            _kunci_tulis.release()
+
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(base_dir, 'rumi.db')
+path_db = os.environ.get('RUMI_DATABASE', os.path.join(base_dir, 'rumi.db'))
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path_db
+if SQLITE_POOL_BACA:
+    app.config['SQLALCHEMY_BINDS'] = {'baca': {
+        'url': f'sqlite:///file:{path_db}?mode=ro&uri=true',
+        'pool_size': SQLITE_POOL_BACA_UKURAN,
+    }}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.secret_key = 'kunci_rahasia_rumi_yang_sangat_aman'
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': SesiRute})
+
+with app.app_context():
+    pasang_pragma(db.engines[None], SQLITE_PROFIL, begin_immediate=SQLITE_POOL_BACA)
+    if SQLITE_POOL_BACA:
+        pasang_pragma(db.engines['baca'], SQLITE_PROFIL, baca_saja=True)
+    # Koneksi tulis pertama membuat berkas database (bila belum ada) dan mengaktifkan journal_mode
+    # sebelum pool baca-saja membukanya.
+    with db.engines[None].connect():
+        pass
+
+MONITORING_PER_HALAMAN = 50
+# Tipe tiap kolom kunci kursor keyset: (User.kelas, User.nama_lengkap, User.id) dan (User.id,).
+KURSOR_MONITORING = ((str, None), str, int)
+SINKRON_MAKS_ITEM = 200
+SINKRON_MAKS_UMUR_HARI = 30
+NOTIFIKASI_CACHE_MAKS_ENTRI = int(os.environ.get('RUMI_NOTIFIKASI_CACHE_MAKS', '10000'))
+POJOK_BACA_PER_HALAMAN = 20
+POJOK_BACA_SARAN_JUMLAH = 8
+ADMIN_PENGGUNA_PER_HALAMAN = 50
+KURSOR_ADMIN = (int,)
+NOTIFIKASI_DROPDOWN_JUMLAH = 10
+# Ekspor progres kelas/sekolah: siswa dibaca per potongan dan CSV dikirim per blok sebesar EKSPOR_BLOK_BYTE.
+EKSPOR_SISWA_PER_POTONGAN = 200
+EKSPOR_BLOK_BYTE = 64 * 1024
+EKSPOR_FORMAT_WAKTU = '%Y-%m-%d %H:%M'
+# Kanal push (SSE). Dengan worker gunicorn sync biarkan PUSH_TAHAN_DETIK = 0: koneksi yang ditahan akan
+# memakan satu worker, jadi browser tidak membuka /pembaruan sama sekali dan sebagai gantinya bertanya ke
+# /pembaruan/cek setiap PEMBARUAN_CEK_DETIK (langsung dijawab, 0 = hanya saat halaman dimuat). Dengan
+# worker gthread/gevent isi > 0: koneksi ditahan selama itu, dicek setiap PUSH_INTERVAL_DETIK, lalu
+# EventSource tersambung ulang setelah PUSH_RETRY_MS.
+PUSH_TAHAN_DETIK = int(os.environ.get('RUMI_PUSH_TAHAN_DETIK', '0'))
+PUSH_INTERVAL_DETIK = int(os.environ.get('RUMI_PUSH_INTERVAL_DETIK', '3'))
+PUSH_RETRY_MS = int(os.environ.get('RUMI_PUSH_RETRY_MS', '15000'))
+PEMBARUAN_CEK_DETIK = int(os.environ.get('RUMI_PEMBARUAN_CEK_DETIK', '60'))
+# Impor daftar pengguna: hashing password dibagi ke beberapa proses bila jumlah baris cukup besar.
+# Setiap hash tetap mengambil slot HASH_KONKURENSI (slot terakhir dicadangkan untuk login), jadi jumlah
+# proses efektif paling banyak HASH_KONKURENSI - 1; slot ditunggu paling lama IMPOR_TUNGGU_SLOT_DETIK.
+IMPOR_PROSES_HASH = int(os.environ.get('RUMI_IMPOR_PROSES', str(os.cpu_count() or 1)))
+IMPOR_TUNGGU_SLOT_DETIK = float(os.environ.get('RUMI_IMPOR_TUNGGU_DETIK', '30'))
+IMPOR_AMBANG_PARALEL = 32
+IMPOR_MAKS_BARIS = 20000
+IMPOR_PERAN = ('siswa', 'guru', 'orangtua')
+# Hashing password. HASH_METODE adalah string metode werkzeug (mis. 'scrypt:32768:8:1' atau
+# 'pbkdf2:sha256:600000'); hash lama dengan parameter berbeda diperbarui otomatis saat login berhasil.
+# Paling banyak HASH_KONKURENSI hash berjalan bersamaan di seluruh server (semua worker gunicorn
+# berbagi berkas kunci di HASH_SLOT_DIR); permintaan lain menunggu paling lama HASH_TUNGGU_DETIK lalu
+# ditolak dengan pesan "server sibuk". Waktu tunggu dibuat singkat karena selama menunggu worker sync
+# tidak bisa melayani halaman lain.
+HASH_METODE = os.environ.get('RUMI_HASH_METODE', 'scrypt:32768:8:1')
+HASH_KONKURENSI = int(os.environ.get('RUMI_HASH_KONKURENSI', str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_TUNGGU_DETIK = float(os.environ.get('RUMI_HASH_TUNGGU_DETIK', '1'))
+HASH_SLOT_DIR = os.environ.get('RUMI_HASH_SLOT_DIR', os.path.join(os.path.dirname(path_db), '.rumi-hash'))
+# Pembatasan login: jumlah gagal maksimum per username dan per alamat IP dalam satu jendela waktu.
+# Batas IP dibuat longgar karena satu sekolah sering keluar lewat satu IP (NAT).
+LOGIN_JENDELA_DETIK = int(os.environ.get('RUMI_LOGIN_JENDELA_DETIK', '300'))
+LOGIN_MAKS_GAGAL_USERNAME = int(os.environ.get('RUMI_LOGIN_MAKS_GAGAL_USERNAME', '5'))
+LOGIN_MAKS_GAGAL_IP = int(os.environ.get('RUMI_LOGIN_MAKS_GAGAL_IP', '100'))
+KODE_PAIRING_ABJAD = string.ascii_uppercase + string.digits
+KODE_PAIRING_PANJANG = 6
+KODE_PAIRING_MASA_BERLAKU_HARI = int(os.environ.get('RUMI_KODE_PAIRING_HARI', '30'))
+BACKUP_DIR = os.environ.get('RUMI_BACKUP_DIR', os.path.join(base_dir, 'backups'))
+BACKUP_SIMPAN = int(os.environ.get('RUMI_BACKUP_SIMPAN', '7'))
+# Instrumentasi per request (jumlah query, waktu SQL/render, peringatan N+1, sampel query lambat).
+# Metrik dikumpulkan per proses dan dibaca di /admin/metrics; header Server-Timing hanya dikirim bila
+# INSTRUMEN_HEADER aktif (atau mode debug) karena memperlihatkan detail internal.
+INSTRUMEN_AKTIF = os.environ.get('RUMI_INSTRUMEN', '1') == '1'
+INSTRUMEN_HEADER = os.environ.get('RUMI_INSTRUMEN_HEADER', '0') == '1'
+INSTRUMEN_AMBANG_N1 = int(os.environ.get('RUMI_INSTRUMEN_AMBANG_N1', '5'))
+INSTRUMEN_QUERY_LAMBAT_MS = float(os.environ.get('RUMI_INSTRUMEN_QUERY_LAMBAT_MS', '100'))
+INSTRUMEN_SAMPEL = 20
+INSTRUMEN_BUCKET_DETIK = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+METRICS_TOKEN = os.environ.get('RUMI_METRICS_TOKEN', '')
+# Cache fragmen HTML bersama (jalur belajar per kelas, detail materi per materi) per proses worker.
+FRAGMEN_CACHE_MAKS_KB = int(os.environ.get('RUMI_FRAGMEN_CACHE_KB', '4096'))
+FRAGMEN_CACHE_MAKS_ENTRI = 1000
+# Aset statis: CSS/JS diperkecil, diberi nama berisi hash isi dan versi .gz oleh `flask bangun-aset`
+# di tahap deploy; saat dimulai aplikasi hanya membaca manifesnya, lalu menyajikan berkas berhash
+# dengan cache immutable satu tahun.
+ASET_AKTIF = os.environ.get('RUMI_ASET', '1') == '1'
+ASET_FOLDER_HASIL = 'dist'
+ASET_BUNDEL = {
+    'css/style.css': ('css/style.css',),
+    'js/main.js': ('js/main.js',),
+}
+ASET_MAX_AGE = 365 * 24 * 3600
 
 # --- FUNGSI BANTU ---
-def generate_pairing_code():
-    while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        if not User.query.filter_by(kode_pairing=code).first():
-            return code
+def potong(daftar, ukuran=500):
+    # Membagi daftar menjadi potongan agar klausa IN tidak melewati batas variabel SQLite
+    for i in range(0, len(daftar), ukuran):
+        yield daftar[i:i + ukuran]
+
+def waktu_utc_sekarang():
+    # Naive UTC, sama dengan CURRENT_TIMESTAMP SQLite yang dipakai kolom default.
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def encode_kursor(nilai):
+    # Kursor keyset untuk pagination: daftar nilai kolom baris terakhir, dikemas base64 agar aman di URL.
+    return base64.urlsafe_b64encode(json.dumps(nilai).encode()).decode()
+
+def cocok_jenis(nilai, jenis):
+    # bool adalah turunan int di Python, tetapi bukan nilai kolom id yang sah.
+    if isinstance(nilai, bool):
+        return False
+    return nilai is None if jenis is None else isinstance(nilai, jenis)
+
+def decode_kursor(kursor, jenis_kolom):
+    # jenis_kolom: satu entri per kolom kunci, berisi tipe atau tuple tipe (None = boleh NULL).
+    # Kursor rusak atau hasil rekayasa diperlakukan seperti tidak ada kursor (halaman pertama).
+    if not kursor:
+        return None
+    try:
+        nilai = json.loads(base64.urlsafe_b64decode(kursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(nilai, list) or len(nilai) != len(jenis_kolom):
+        return None
+    for isi, jenis in zip(nilai, jenis_kolom):
+        pilihan = jenis if isinstance(jenis, tuple) else (jenis,)
+        if not any(cocok_jenis(isi, j) for j in pilihan):
+            return None
+    return nilai
 
 def create_default_badges():
-    # Fungsi ini memastikan lencana "Langkah Pertama" selalu ada di database.
+    # Fungsi ini memastikan lencana bawaan ("Langkah Pertama", lencana streak dan tahap refleksi) selalu ada di database.
+    dibuat = []
     if Badge.query.filter_by(nama="Langkah Pertama").first() is None:
         icon_langkah = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 512 512" fill="currentColor" width="48" height="48"><path d="M256 512c141.4 0 256-114.6 256-256S397.4 0 256 0S0 114.6 0 256S114.6 512 256 512zM159.3 388.7c-2.6 8.4-11.6 13.2-20 10.5s-13.2-11.6-10.5-20l32-96c2.3-7 8.5-12.1 15.9-13.4l96-16c8.4-1.4 16.6 2.6 20 10.5s2.6 16.6-5.8 20L184 319.3l-24.7 69.4z"/></svg>'
         badge = Badge(nama="Langkah Pertama", deskripsi="Diberikan saat berhasil menyelesaikan konten belajar pertama kali.", icon_url=icon_langkah)
         db.session.add(badge)
+        dibuat.append(badge.nama)
+    if Badge.query.filter_by(nama="Semangat Tiga Hari").first() is None:
+        badge = Badge(nama="Semangat Tiga Hari", deskripsi="Diberikan saat belajar tiga hari berturut-turut.", icon_url=generate_badge_icon('#FF9800'))
+        db.session.add(badge)
+        dibuat.append(badge.nama)
+    if Badge.query.filter_by(nama="Perenung Sejati").first() is None:
+        badge = Badge(nama="Perenung Sejati", deskripsi="Diberikan saat menyelesaikan seluruh konten tahap Merefleksi pada satu materi.", icon_url=generate_badge_icon('#9C27B0'))
+        db.session.add(badge)
+        dibuat.append(badge.nama)
+    if dibuat:
+        naikkan_versi_katalog()
         db.session.commit()
-        print("Lencana 'Langkah Pertama' berhasil dibuat!")
-
-def check_and_award_badges(user):
-    progress_count = user.progress.count()
-    owned_badge_ids = {user_badge.badge_id for user_badge in user.badges}
-
-    # Logika Lencana 1: "Langkah Pertama"
-    badge_langkah_pertama = Badge.query.filter_by(nama="Langkah Pertama").first()
-    if badge_langkah_pertama and badge_langkah_pertama.id not in owned_badge_ids:
-        if progress_count == 1:
-            new_user_badge = UserBadge(user_id=user.id, badge_id=badge_langkah_pertama.id)
-            db.session.add(new_user_badge)
-            flash(f'🎉 Selamat! Anda mendapatkan lencana baru: "{badge_langkah_pertama.nama}"', 'success')
-
-    # Logika Lencana 2: Lencana per Materi Pokok
-    completed_konten_ids = {p.konten_id for p in user.progress}
-    related_materis = MateriPokok.query.join(KontenBelajar).filter(KontenBelajar.id.in_(completed_konten_ids)).distinct().all()
-
-    for materi in related_materis:
-        badge_for_materi = Badge.query.filter_by(materi_pokok_id=materi.id).first()
-        if badge_for_materi and badge_for_materi.id not in owned_badge_ids:
-            materi_konten_ids = {k.id for k in materi.kontens}
-            if materi_konten_ids and materi_konten_ids.issubset(completed_konten_ids):
-                new_user_badge = UserBadge(user_id=user.id, badge_id=badge_for_materi.id)
-                db.session.add(new_user_badge)
-                flash(f'🏆 Selamat! Anda mendapatkan lencana baru: "{badge_for_materi.nama}"', 'success')
-    
+        for nama in dibuat:
+            print(f"Lencana '{nama}' berhasil dibuat!")
+
+def perbarui_penguasaan(user_id, materi_id, selisih=1):
+    # Naikkan/turunkan hitungan konten selesai secara atomik. Baris baru dihitung dari ProgressSiswa
+    # agar ledger tetap benar walaupun siswa sudah punya progres sebelum ledger dibuat.
+    updated = PenguasaanMateri.query.filter_by(user_id=user_id, materi_id=materi_id).update(
+        {PenguasaanMateri.konten_selesai: PenguasaanMateri.konten_selesai + selisih},
+        synchronize_session=False
+    )
+    if not updated:
+        konten_selesai = db.session.query(func.count(ProgressSiswa.id)).join(
+            KontenBelajar, KontenBelajar.id == ProgressSiswa.konten_id
+        ).filter(ProgressSiswa.user_id == user_id, KontenBelajar.materi_id == materi_id).scalar()
+        total_konten = KontenBelajar.query.filter_by(materi_id=materi_id).count()
+        db.session.add(PenguasaanMateri(user_id=user_id, materi_id=materi_id,
+                                        konten_selesai=konten_selesai, total_konten=total_konten))
+
+def perbarui_penguasaan_alur(user_id, materi_id, alur, selisih=1):
+    # Pasangan perbarui_penguasaan untuk ledger per tahap; dipanggil di transaksi yang sama.
+    updated = PenguasaanAlur.query.filter_by(user_id=user_id, materi_id=materi_id, alur=alur).update(
+        {PenguasaanAlur.konten_selesai: PenguasaanAlur.konten_selesai + selisih},
+        synchronize_session=False
+    )
+    if not updated:
+        konten_selesai = db.session.query(func.count(ProgressSiswa.id)).join(
+            KontenBelajar, KontenBelajar.id == ProgressSiswa.konten_id
+        ).filter(ProgressSiswa.user_id == user_id, KontenBelajar.materi_id == materi_id,
+                 KontenBelajar.alur == alur).scalar()
+        total_konten = KontenBelajar.query.filter_by(materi_id=materi_id, alur=alur).count()
+        db.session.add(PenguasaanAlur(user_id=user_id, materi_id=materi_id, alur=alur,
+                                      konten_selesai=konten_selesai, total_konten=total_konten))
+
+def sesuaikan_total_konten(materi_id, alur, selisih):
+    # Dipanggil saat guru menambah/menghapus konten agar semua baris ledger materi dan tahapnya ikut berubah.
+    PenguasaanMateri.query.filter_by(materi_id=materi_id).update(
+        {PenguasaanMateri.total_konten: PenguasaanMateri.total_konten + selisih},
+        synchronize_session=False
+    )
+    PenguasaanAlur.query.filter_by(materi_id=materi_id, alur=alur).update(
+        {PenguasaanAlur.total_konten: PenguasaanAlur.total_konten + selisih},
+        synchronize_session=False
+    )
+
+def kurangi_statistik_konten_terhapus(konten_ids):
+    # Dipanggil sebelum konten dihapus bersama progresnya: total konten selesai setiap siswa yang pernah
+    # menyelesaikannya turun sebanyak progres yang hilang, dalam satu UPDATE berkorelasi.
+    terhapus = ProgressSiswa.konten_id.in_(konten_ids)
+    hilang = db.session.query(func.count(ProgressSiswa.id)).filter(
+        ProgressSiswa.user_id == StatistikSiswa.user_id, terhapus
+    ).scalar_subquery()
+    StatistikSiswa.query.filter(
+        StatistikSiswa.user_id.in_(db.session.query(ProgressSiswa.user_id).filter(terhapus))
+    ).update({StatistikSiswa.total_konten_selesai: StatistikSiswa.total_konten_selesai - hilang},
+             synchronize_session=False)
+
+def pindahkan_alur_konten(konten_id, materi_id, alur_lama, alur_baru):
+    # Konten dipindah ke tahap lain: total kedua tahap bergeser, begitu pula hitungan siswa yang sudah menyelesaikannya
+    penyelesai = db.session.query(ProgressSiswa.user_id).filter_by(konten_id=konten_id)
+    for alur, selisih in ((alur_lama, -1), (alur_baru, 1)):
+        PenguasaanAlur.query.filter_by(materi_id=materi_id, alur=alur).update(
+            {PenguasaanAlur.total_konten: PenguasaanAlur.total_konten + selisih},
+            synchronize_session=False
+        )
+        PenguasaanAlur.query.filter(
+            PenguasaanAlur.materi_id == materi_id, PenguasaanAlur.alur == alur,
+            PenguasaanAlur.user_id.in_(penyelesai)
+        ).update({PenguasaanAlur.konten_selesai: PenguasaanAlur.konten_selesai + selisih}, synchronize_session=False)
+
+def ambil_penguasaan(user_id):
+    # Satu query berindeks: {materi_id: PenguasaanMateri} untuk seorang siswa.
+    return {p.materi_id: p for p in PenguasaanMateri.query.filter_by(user_id=user_id).all()}
+
+def hitung_materi_selesai(user_id, kelas):
+    # Jumlah materi terpublikasi untuk kelas yang sudah tuntas, langsung dari ledger.
+    return db.session.query(func.count(PenguasaanMateri.id)).join(
+        MateriPokok, MateriPokok.id == PenguasaanMateri.materi_id
+    ).join(TujuanPembelajaran).filter(
+        PenguasaanMateri.user_id == user_id,
+        TujuanPembelajaran.kelas_tujuan == kelas,
+        MateriPokok.status == 'published',
+        PenguasaanMateri.total_konten > 0,
+        PenguasaanMateri.konten_selesai >= PenguasaanMateri.total_konten
+    ).scalar()
+
+def perbarui_statistik(user_id, waktu_selesai):
+    # waktu_selesai: daftar datetime untuk konten yang BARU diselesaikan.
+    statistik = db.session.get(StatistikSiswa, user_id)
+    if statistik is None:
+        # Baris pertama dihitung dari riwayat (sekali saja); progres baru sudah ter-flush di sini.
+        statistik = StatistikSiswa(user_id=user_id, streak_hari=0,
+                                   total_konten_selesai=ProgressSiswa.query.filter_by(user_id=user_id).count())
+        db.session.add(statistik)
+    else:
+        statistik.total_konten_selesai += len(waktu_selesai)
+    for tanggal in sorted({w.date() for w in waktu_selesai}):
+        if statistik.tanggal_terakhir is None or tanggal - statistik.tanggal_terakhir > datetime.timedelta(days=1):
+            statistik.streak_hari = 1
+        elif tanggal - statistik.tanggal_terakhir == datetime.timedelta(days=1):
+            statistik.streak_hari += 1
+        else:
+            continue  # hari yang sama atau stempel waktu lama dari klien
+        statistik.tanggal_terakhir = tanggal
+    return statistik
+
+def hitung_streak(tanggal_list):
+    # Streak berjalan yang berakhir di tanggal terbaru dari daftar tanggal unik.
+    streak = 0
+    sebelumnya = None
+    for tanggal in sorted(set(tanggal_list), reverse=True):
+        if sebelumnya is not None and sebelumnya - tanggal != datetime.timedelta(days=1):
+            break
+        streak += 1
+        sebelumnya = tanggal
+    return streak
+
+def bangun_ulang_statistik():
+    StatistikSiswa.query.delete()
+    tanggal_per_user = {}
+    for user_id, waktu in db.session.query(ProgressSiswa.user_id, ProgressSiswa.tanggal_selesai).all():
+        tanggal_per_user.setdefault(user_id, []).append(waktu)
+    for user_id, waktu_list in tanggal_per_user.items():
+        tanggal_list = [w.date() for w in waktu_list if w is not None]
+        db.session.add(StatistikSiswa(
+            user_id=user_id,
+            total_konten_selesai=len(waktu_list),
+            streak_hari=hitung_streak(tanggal_list),
+            tanggal_terakhir=max(tanggal_list) if tanggal_list else None
+        ))
     db.session.commit()
 
+def bangun_ulang_penguasaan():
+    # Isi ulang seluruh ledger dari ProgressSiswa (untuk database lama atau jika data diragukan).
+    PenguasaanMateri.query.delete()
+    konten_materi = db.aliased(KontenBelajar)
+    total_konten = db.session.query(func.count(konten_materi.id)).filter(
+        konten_materi.materi_id == KontenBelajar.materi_id
+    ).scalar_subquery()
+    sumber = db.session.query(
+        ProgressSiswa.user_id, KontenBelajar.materi_id, func.count(ProgressSiswa.id), total_konten
+    ).join(KontenBelajar, KontenBelajar.id == ProgressSiswa.konten_id).group_by(
+        ProgressSiswa.user_id, KontenBelajar.materi_id
+    )
+    db.session.execute(PenguasaanMateri.__table__.insert().from_select(
+        ['user_id', 'materi_id', 'konten_selesai', 'total_konten'], sumber
+    ))
+    bangun_ulang_penguasaan_alur()
+    db.session.commit()
+
+def bangun_ulang_penguasaan_alur():
+    PenguasaanAlur.query.delete()
+    konten_alur = db.aliased(KontenBelajar)
+    total_konten = db.session.query(func.count(konten_alur.id)).filter(
+        konten_alur.materi_id == KontenBelajar.materi_id, konten_alur.alur == KontenBelajar.alur
+    ).scalar_subquery()
+    sumber = db.session.query(
+        ProgressSiswa.user_id, KontenBelajar.materi_id, KontenBelajar.alur, func.count(ProgressSiswa.id), total_konten
+    ).join(KontenBelajar, KontenBelajar.id == ProgressSiswa.konten_id).group_by(
+        ProgressSiswa.user_id, KontenBelajar.materi_id, KontenBelajar.alur
+    )
+    db.session.execute(PenguasaanAlur.__table__.insert().from_select(
+        ['user_id', 'materi_id', 'alur', 'konten_selesai', 'total_konten'], sumber
+    ))
+
+_ledger_diperiksa = False
+
+@app.before_request
+def siapkan_ledger_penguasaan():
+    # Database lama sudah berisi progres siswa tetapi ledger masih kosong: isi sekali per proses pada
+    # request pertama, agar dashboard tidak menampilkan 0 materi tuntas untuk siswa lama.
+    global _ledger_diperiksa
+    if _ledger_diperiksa:
+        return
+    _ledger_diperiksa = True
+    if ProgressSiswa.query.first() is None:
+        return
+    if PenguasaanMateri.query.first() is None:
+        bangun_ulang_penguasaan()
+    if StatistikSiswa.query.first() is None:
+        bangun_ulang_statistik()
+
 def generate_badge_icon(color):
     return f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 576 512" fill="{color}" width="48" height="48"><path d="M288 0c-12.2 .1-24.2 2.1-35.5 5.9L11.2 113.2c-11.9 4-21.8 12.5-27.4 23.4S-1.5 162.3 5.4 172l152 211.2c11.3 15.8 30.1 24.8 49.3 24.8H369.3c19.2 0 38-9 49.3-24.8L570.6 172c6.9-9.7 8.9-22.4 3.3-33.3s-15.5-19.4-27.4-23.4L323.5 5.9C312.2 2.1 300.2 0 288 0zM288 64c5.3 0 10.5 .7 15.5 2.1l141.2 39.2L358.5 208H217.5L131.3 105.3 272.5 66.1C277.5 64.7 282.7 64 288 64z"/></svg>'
 
@@ -71,13 +468,19 @@ class User(db.Model):
     password_hash = db.Column(db.String(256))
     peran = db.Column(db.String(10), nullable=False)
     kelas = db.Column(db.String(10))
-    kode_pairing = db.Column(db.String(10), unique=True, nullable=True)
     parent_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    # Siswa yang tertaut dengan akun orang tua; hanya untuk dibaca (penautan tetap lewat student_id)
+    siswa = db.relationship('User', foreign_keys=[student_id], remote_side=[id], viewonly=True)
     tps = db.relationship('TujuanPembelajaran', backref='guru', lazy=True, cascade="all, delete-orphan")
+    __table_args__ = (
+        db.Index('ix_user_peran_id', 'peran', 'id'),
+        # monitoring_siswa (filter + urutan keyset) dan daftar sekolah di register_student
+        db.Index('ix_user_peran_sekolah_kelas', 'peran', 'nama_sekolah', 'kelas', 'nama_lengkap'),
+    )
     
-    def set_password(self, password): self.password_hash = generate_password_hash(password)
-    def check_password(self, password): return check_password_hash(self.password_hash, password)
+    def set_password(self, password): self.password_hash = hash_password(password)
+    def check_password(self, password): return cocokkan_password(self.password_hash, password)
 
 class TujuanPembelajaran(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -85,6 +488,7 @@ class TujuanPembelajaran(db.Model):
     kelas_tujuan = db.Column(db.Integer, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     materis = db.relationship('MateriPokok', backref='tp', lazy=True, cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_tp_kelas_tujuan', 'kelas_tujuan'),)
 
 class MateriPokok(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -92,8 +496,12 @@ class MateriPokok(db.Model):
     deskripsi = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(20), nullable=False, default='draft')
     tp_id = db.Column(db.Integer, db.ForeignKey('tujuan_pembelajaran.id'), nullable=False)
+    diperbarui = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
     kontens = db.relationship('KontenBelajar', backref='materi', lazy=True, cascade="all, delete-orphan")
     badge = db.relationship('Badge', backref='materi', uselist=False, cascade="all, delete-orphan")
+    penguasaan = db.relationship('PenguasaanMateri', backref='materi', lazy='dynamic', cascade="all, delete-orphan")
+    penguasaan_alur = db.relationship('PenguasaanAlur', lazy='dynamic', cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_materi_tp_status', 'tp_id', 'status'),)
 
 class KontenBelajar(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -103,15 +511,70 @@ class KontenBelajar(db.Model):
     sumber_url = db.Column(db.String(500), nullable=False)
     urutan = db.Column(db.Integer, default=0)
     materi_id = db.Column(db.Integer, db.ForeignKey('materi_pokok.id'), nullable=False)
+    diperbarui = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+    # Progres ikut terhapus bersama kontennya; tanpa ini id konten yang dipakai ulang oleh SQLite
+    # akan "mewarisi" progres lama dan ledger penguasaan menjadi tidak konsisten.
+    progress_siswa = db.relationship('ProgressSiswa', backref='konten', lazy='dynamic', cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_konten_materi', 'materi_id'),)
 
 class ProgressSiswa(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     konten_id = db.Column(db.Integer, db.ForeignKey('konten_belajar.id'), nullable=False)
     tanggal_selesai = db.Column(db.DateTime, default=db.func.current_timestamp())
-    __table_args__ = (db.UniqueConstraint('user_id', 'konten_id', name='_user_konten_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'konten_id', name='_user_konten_uc'),
+        db.Index('ix_progress_user_tanggal', 'user_id', 'tanggal_selesai'),
+    )
     user = db.relationship('User', backref=db.backref('progress', lazy='dynamic', cascade="all, delete-orphan"))
 
+class PenguasaanMateri(db.Model):
+    # Ledger penguasaan: satu baris per (siswa, materi) berisi jumlah konten selesai/total.
+    # Diperbarui secara inkremental oleh tandai_selesai() dan rute studio yang mengubah konten.
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    materi_id = db.Column(db.Integer, db.ForeignKey('materi_pokok.id'), nullable=False)
+    konten_selesai = db.Column(db.Integer, nullable=False, default=0)
+    total_konten = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('user_id', 'materi_id', name='_user_materi_uc'),)
+    user = db.relationship('User', backref=db.backref('penguasaan', lazy='dynamic', cascade="all, delete-orphan"))
+
+    @property
+    def selesai(self):
+        return self.total_konten > 0 and self.konten_selesai >= self.total_konten
+
+    @property
+    def persen(self):
+        if self.total_konten <= 0:
+            return 0
+        return round(min(self.konten_selesai, self.total_konten) / self.total_konten * 100)
+
+class PenguasaanAlur(db.Model):
+    # Ledger per tahap: satu baris per (siswa, materi, alur), diperbarui bersama PenguasaanMateri
+    # sehingga aturan lencana per tahap cukup membaca satu baris.
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    materi_id = db.Column(db.Integer, db.ForeignKey('materi_pokok.id'), nullable=False)
+    alur = db.Column(db.String(50), nullable=False)
+    konten_selesai = db.Column(db.Integer, nullable=False, default=0)
+    total_konten = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('user_id', 'materi_id', 'alur', name='_user_materi_alur_uc'),)
+    user = db.relationship('User', backref=db.backref('penguasaan_alur', lazy='dynamic', cascade="all, delete-orphan"))
+
+    @property
+    def selesai(self):
+        return self.total_konten > 0 and self.konten_selesai >= self.total_konten
+
+class StatistikSiswa(db.Model):
+    # Ringkasan aktivitas per siswa agar aturan lencana tidak perlu membaca seluruh riwayat progres.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_konten_selesai = db.Column(db.Integer, nullable=False, default=0)
+    streak_hari = db.Column(db.Integer, nullable=False, default=0)
+    tanggal_terakhir = db.Column(db.Date, nullable=True)
+    # Stempel versi progres siswa untuk ETag/Last-Modified halaman materi
+    diperbarui = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+    user = db.relationship('User', backref=db.backref('statistik', uselist=False, cascade="all, delete-orphan"))
+
 class Badge(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nama = db.Column(db.String(100), nullable=False)
@@ -126,6 +589,7 @@ class UserBadge(db.Model):
     tanggal_dapat = db.Column(db.DateTime, default=db.func.current_timestamp())
     user = db.relationship('User', backref=db.backref('badges', lazy=True, cascade="all, delete-orphan"))
     badge = db.relationship('Badge')
+    __table_args__ = (db.Index('ix_user_badge_user_tanggal', 'user_id', 'tanggal_dapat'),)
 
 class PojokBaca(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -134,6 +598,28 @@ class PojokBaca(db.Model):
     kategori = db.Column(db.String(50), nullable=True)
     url_sampul = db.Column(db.String(500), nullable=True)
     url_konten = db.Column(db.String(500), nullable=False)
+    diperbarui = db.Column(db.DateTime, default=db.func.current_timestamp(),
+                           onupdate=db.func.current_timestamp(), index=True)
+
+class KodePairing(db.Model):
+    # Kode pairing aktif per siswa, terpisah dari tabel user. Kode dibuat oleh alokator (lihat
+    # alokasikan_kode_pairing) dan dihapus saat dipakai orang tua atau setelah kedaluwarsa.
+    kode = db.Column(db.String(KODE_PAIRING_PANJANG), primary_key=True)
+    siswa_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    kedaluwarsa = db.Column(db.DateTime, nullable=False, index=True)
+    siswa = db.relationship('User', backref=db.backref('kode_pairing', uselist=False, cascade="all, delete-orphan"))
+
+class AlokatorKodePairing(db.Model):
+    # Satu baris: penghitung indeks berikutnya dan kunci permutasi acak milik deployment ini
+    id = db.Column(db.Integer, primary_key=True)
+    berikutnya = db.Column(db.Integer, nullable=False, default=0)
+    kunci = db.Column(db.String(64), nullable=False)
+
+class VersiKatalog(db.Model):
+    # Satu baris penghitung versi katalog. Dinaikkan oleh setiap rute tulis studio sehingga
+    # cache katalog di semua worker gunicorn tahu kapan harus dibangun ulang.
+    id = db.Column(db.Integer, primary_key=True)
+    versi = db.Column(db.Integer, nullable=False, default=0)
 
 class Notifikasi(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -145,14 +631,681 @@ class Notifikasi(db.Model):
 
     # Relasi untuk mengambil nama pengirim
     pengirim = db.relationship('User', foreign_keys=[pengirim_id])
+    __table_args__ = (
+        db.Index('ix_notifikasi_penerima_id', 'penerima_id', 'id'),
+        # Hitung belum-dibaca di atas watermark dan daftar terbaru per penerima
+        db.Index('ix_notifikasi_penerima_dibaca', 'penerima_id', 'sudah_dibaca', 'id'),
+        db.Index('ix_notifikasi_penerima_waktu', 'penerima_id', 'timestamp', 'id'),
+    )
+
+class NotifikasiSiaran(db.Model):
+    # Pesan siaran guru ke satu kelas (kelas terisi) atau seluruh sekolah (kelas NULL).
+    # Disimpan sekali; penerimanya ditentukan saat dibaca (fan-out-on-read).
+    id = db.Column(db.Integer, primary_key=True)
+    pengirim_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    nama_sekolah = db.Column(db.String(100), nullable=False)
+    kelas = db.Column(db.String(10), nullable=True)
+    konten = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
+    pengirim = db.relationship('User', foreign_keys=[pengirim_id])
+    __table_args__ = (db.Index('ix_siaran_sekolah_kelas', 'nama_sekolah', 'kelas', 'id'),)
+
+class PercobaanLogin(db.Model):
+    # Penghitung login gagal per kunci ('u:<username>' atau 'ip:<alamat>') dalam satu jendela waktu.
+    # Disimpan di database agar batasnya berlaku untuk semua worker gunicorn sekaligus.
+    kunci = db.Column(db.String(200), primary_key=True)
+    jumlah = db.Column(db.Integer, nullable=False, default=0)
+    jendela_mulai = db.Column(db.DateTime, nullable=False, index=True)
+
+class PenandaBaca(db.Model):
+    # Watermark "sudah dibaca sampai id X" per (user, kanal). Menandai semua sebagai dibaca cukup
+    # memperbarui satu baris; notifikasi dengan id <= watermark dianggap sudah dibaca.
+    # Kolom Notifikasi.sudah_dibaca hanya dipakai untuk pesan di atas watermark.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    kanal = db.Column(db.String(20), primary_key=True, default='langsung')
+    dibaca_sampai_id = db.Column(db.Integer, nullable=False, default=0)
+    user = db.relationship('User', backref=db.backref('penanda_baca', lazy=True, cascade="all, delete-orphan"))
+
+# --- KATALOG KURIKULUM ---
+# Snapshot katalog per kelas (TP terurut, materi terpublikasi, konten per alur, lencana) disimpan
+# di memori proses dan divalidasi terhadap VersiKatalog di database pada setiap request.
+KontenKatalog = namedtuple('KontenKatalog', 'id judul tipe alur sumber_url urutan materi_id')
+MateriKatalog = namedtuple('MateriKatalog', 'id judul deskripsi tp_id kontens konten_per_alur badge_id diperbarui')
+TPKatalog = namedtuple('TPKatalog', 'id deskripsi kelas_tujuan materis')
+Katalog = namedtuple('Katalog', 'kelas versi tps materis materi_by_id materi_id_per_konten badge_ids diperbarui')
+
+_katalog_cache = {}
+_katalog_lock = threading.Lock()
+
+def naikkan_versi_katalog():
+    # Dipanggil di dalam transaksi rute studio, sebelum commit.
+    updated = VersiKatalog.query.filter_by(id=1).update(
+        {VersiKatalog.versi: VersiKatalog.versi + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.session.add(VersiKatalog(id=1, versi=1))
+
+def versi_katalog():
+    # Dibaca sekali per request lalu disimpan di flask.g.
+    if 'versi_katalog' not in g:
+        versi = db.session.query(VersiKatalog.versi).filter_by(id=1).scalar()
+        g.versi_katalog = versi or 0
+    return g.versi_katalog
+
+def bangun_katalog(kelas, versi):
+    materis_query = MateriPokok.query.join(TujuanPembelajaran).filter(
+        TujuanPembelajaran.kelas_tujuan == kelas,
+        MateriPokok.status == 'published'
+    ).order_by(TujuanPembelajaran.id, MateriPokok.id)
+    materi_rows = materis_query.all()
+    materi_ids = [m.id for m in materi_rows]
+
+    kontens_per_materi = {}
+    badge_per_materi = {}
+    # Waktu perubahan terakhir per materi (materi atau salah satu kontennya), untuk Last-Modified
+    diperbarui_per_materi = {m.id: m.diperbarui for m in materi_rows}
+    if materi_ids:
+        for k in KontenBelajar.query.filter(KontenBelajar.materi_id.in_(materi_ids)).order_by(
+            KontenBelajar.urutan, KontenBelajar.id
+        ).all():
+            kontens_per_materi.setdefault(k.materi_id, []).append(
+                KontenKatalog(k.id, k.judul, k.tipe, k.alur, k.sumber_url, k.urutan, k.materi_id)
+            )
+            if k.diperbarui and (diperbarui_per_materi[k.materi_id] is None or k.diperbarui > diperbarui_per_materi[k.materi_id]):
+                diperbarui_per_materi[k.materi_id] = k.diperbarui
+        badge_per_materi = dict(db.session.query(Badge.materi_pokok_id, Badge.id).filter(
+            Badge.materi_pokok_id.in_(materi_ids)
+        ).all())
+
+    materis = []
+    materi_id_per_konten = {}
+    for m in materi_rows:
+        kontens = tuple(kontens_per_materi.get(m.id, ()))
+        per_alur = {}
+        for k in kontens:
+            per_alur.setdefault(k.alur, []).append(k)
+            materi_id_per_konten[k.id] = m.id
+        materis.append(MateriKatalog(
+            m.id, m.judul, m.deskripsi, m.tp_id, kontens,
+            MappingProxyType({alur: tuple(items) for alur, items in per_alur.items()}),
+            badge_per_materi.get(m.id),
+            diperbarui_per_materi[m.id]
+        ))
+    materis = tuple(materis)
+
+    tps = []
+    if materi_rows:
+        tp_rows = TujuanPembelajaran.query.filter(
+            TujuanPembelajaran.id.in_({m.tp_id for m in materi_rows})
+        ).order_by(TujuanPembelajaran.id).all()
+        for tp in tp_rows:
+            tps.append(TPKatalog(tp.id, tp.deskripsi, tp.kelas_tujuan,
+                                 tuple(m for m in materis if m.tp_id == tp.id)))
+
+    return Katalog(
+        kelas=kelas,
+        versi=versi,
+        tps=tuple(tps),
+        materis=materis,
+        materi_by_id=MappingProxyType({m.id: m for m in materis}),
+        materi_id_per_konten=MappingProxyType(materi_id_per_konten),
+        badge_ids=frozenset(m.badge_id for m in materis if m.badge_id is not None),
+        diperbarui=max((m.diperbarui for m in materis if m.diperbarui), default=None)
+    )
+
+def ambil_katalog(kelas):
+    kelas = str(kelas)
+    versi = versi_katalog()
+    katalog = _katalog_cache.get(kelas)
+    if katalog is None or katalog.versi != versi:
+        katalog = bangun_katalog(kelas, versi)
+        with _katalog_lock:
+            lama = _katalog_cache.get(kelas)
+            if lama is None or lama.versi <= versi:
+                _katalog_cache[kelas] = katalog
+    return katalog
+
+# --- CACHE FRAGMEN HTML ---
+# Markup yang sama untuk semua siswa (daftar TP per kelas, isi halaman materi) dirender sekali per versi
+# katalog lalu disimpan di LRU berbatas byte. Kunci memuat versi katalog, jadi perubahan di studio otomatis
+# memakai fragmen baru dan fragmen lama tersingkir dengan sendirinya. Status per siswa ditulis sebagai
+# penanda di fragmen lalu diisi oleh overlay: satu re.sub atas himpunan id konten yang sudah selesai.
+class CacheFragmen:
+    def __init__(self, maks_byte, maks_entri):
+        self.maks_byte = maks_byte
+        self.maks_entri = maks_entri
+        self.byte = 0
+        self.kena = 0
+        self.luput = 0
+        self._data = OrderedDict()
+        self._kunci = threading.Lock()
+
+    def ambil(self, kunci, buat):
+        with self._kunci:
+            entri = self._data.get(kunci)
+            if entri is not None:
+                self._data.move_to_end(kunci)
+                self.kena += 1
+                return entri[0]
+            self.luput += 1
+        # Render di luar kunci; dua request bersamaan paling buruk merender fragmen yang sama dua kali
+        html = buat()
+        ukuran = len(html.encode())
+        if ukuran > self.maks_byte:
+            return html
+        with self._kunci:
+            if kunci not in self._data:
+                self._data[kunci] = (html, ukuran)
+                self.byte += ukuran
+            while self.byte > self.maks_byte or len(self._data) > self.maks_entri:
+                _, (_, ukuran_lama) = self._data.popitem(last=False)
+                self.byte -= ukuran_lama
+        return html
+
+    def kosongkan(self):
+        with self._kunci:
+            self._data.clear()
+            self.byte = 0
+
+    def __len__(self):
+        return len(self._data)
+
+cache_fragmen = CacheFragmen(FRAGMEN_CACHE_MAKS_KB * 1024, FRAGMEN_CACHE_MAKS_ENTRI)
+
+# Penanda memakai nonce per proses agar teks buatan guru (judul, deskripsi) tidak bisa meniru penanda.
+_nonce_penanda = secrets.token_hex(4)
+_pola_penanda = re.compile(r'\[\[' + _nonce_penanda + r':(\w+):(\w+)\]\]')
+URUTAN_ALUR = ('memahami', 'mengaplikasi', 'merefleksi')
+IKON_KONTEN_SELESAI = '<i class="fas fa-check-circle fa-2x text-success"></i>'
+IKON_TAHAP_SELESAI = '<i class="fas fa-check-circle text-success ms-2"></i>'
+IKON_TAHAP_TERKUNCI = '<i class="fas fa-lock ms-2"></i>'
+
+def penanda(jenis, nilai):
+    return Markup(f'[[{_nonce_penanda}:{jenis}:{nilai}]]')
+
+def fragmen_jalur_belajar(katalog):
+    return cache_fragmen.ambil(('jalur', katalog.kelas, katalog.versi), lambda: render_template(
+        '_fragmen_jalur_belajar.html', tps=katalog.tps
+    ))
+
+def fragmen_materi_detail(materi, versi):
+    return cache_fragmen.ambil(('materi', materi.id, versi), lambda: render_template(
+        '_fragmen_materi_detail.html', materi=materi, penanda=penanda
+    ))
+
+def tahap_selesai(materi, selesai_konten_ids):
+    # Tahap tanpa konten dianggap belum selesai (tahap berikutnya tetap terkunci)
+    return {alur for alur in URUTAN_ALUR
+            if materi.konten_per_alur.get(alur) and all(k.id in selesai_konten_ids for k in materi.konten_per_alur[alur])}
+
+def status_tahap(materi, selesai_konten_ids):
+    # (tahap selesai, tahap terbuka); tahap pertama selalu terbuka, berikutnya setelah tahap sebelumnya selesai
+    selesai = tahap_selesai(materi, selesai_konten_ids)
+    return selesai, {alur for i, alur in enumerate(URUTAN_ALUR) if i == 0 or URUTAN_ALUR[i - 1] in selesai}
+
+def terapkan_overlay_materi(html, materi, selesai_konten_ids):
+    selesai, terbuka = status_tahap(materi, selesai_konten_ids)
+
+    def ganti(m):
+        jenis, nilai = m.groups()
+        if jenis == 'selesai':
+            return IKON_KONTEN_SELESAI if int(nilai) in selesai_konten_ids else ''
+        if jenis == 'kunci':
+            return '' if nilai in terbuka else 'disabled'
+        if nilai not in terbuka:
+            return IKON_TAHAP_TERKUNCI
+        return IKON_TAHAP_SELESAI if nilai in selesai else ''
+    return Markup(_pola_penanda.sub(ganti, html))
+
+# --- ASET STATIS ---
+# Setiap bundel di ASET_BUNDEL digabung, diperkecil, lalu ditulis ke static/dist/<nama>.<hash>.<ext>
+# beserta salinan .gz oleh `flask bangun-aset`. url_for('static', filename='js/main.js') otomatis menunjuk
+# nama berhash sehingga browser boleh menyimpan berkasnya selamanya; deploy dengan isi baru menghasilkan
+# URL baru. Tanpa manifes (build belum dijalankan) berkas sumber disajikan apa adanya.
+# Pemindai JS sengaja sederhana: string, template literal dan komentar dikenali. '/' dianggap membuka
+# literal regex bila token sebelumnya memulai ekspresi: tanda baca (kecuali ++/-- postfix seperti
+# `i++ / 2`), kata kunci seperti `return`/`typeof`, atau awal berkas. Setelah nama, angka, `)` dan `]`
+# '/' adalah pembagian.
+_PEMBUKA_REGEX_JS = set('(,=:[!&|?{};+-*%<>~^')
+_KATA_SEBELUM_REGEX_JS = frozenset(('return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                                    'throw', 'case', 'do', 'else', 'yield', 'await'))
+
+def _karakter_nama_js(c):
+    return c.isalnum() or c in '_$'
+
+def _regex_boleh_js(terakhir, sebelumnya, kata):
+    if kata:
+        return kata in _KATA_SEBELUM_REGEX_JS
+    if terakhir in '+-' and sebelumnya == terakhir:
+        return False
+    return not terakhir or terakhir in _PEMBUKA_REGEX_JS
+
+def _rapikan_kode_js(teks):
+    # Hanya untuk potongan di luar string/komentar. Baris baru dipertahankan agar automatic semicolon
+    # insertion tetap berlaku; + dan - tidak dirapatkan supaya `a + +b` tidak menjadi `a++b`.
+    teks = re.sub(r'[ \t]*\n\s*', '\n', teks)
+    teks = re.sub(r'[ \t]+', ' ', teks)
+    return re.sub(r' ?([{}()\[\];,:=<>!&|?]) ?', r'\1', teks)
+
+def perkecil_js(sumber):
+    keluaran, kode = [], []
+    # Dua karakter bukan spasi terakhir dan nama/kata kunci yang berakhir di sana (kosong bila bukan nama):
+    # penentu apakah '/' membuka literal regex
+    terakhir = sebelumnya = kata = ''
+    i, n = 0, len(sumber)
+
+    def literal(j):
+        keluaran.append(_rapikan_kode_js(''.join(kode)))
+        kode.clear()
+        keluaran.append(sumber[i:j])
+        return j
+
+    while i < n:
+        c = sumber[i]
+        if c in '\'"`':
+            j = i + 1
+            while j < n and sumber[j] != c:
+                j += 2 if sumber[j] == '\\' else 1
+            i = literal(j + 1)
+            terakhir, sebelumnya, kata = c, terakhir, ''
+        elif sumber.startswith('//', i):
+            j = sumber.find('\n', i)
+            i = n if j < 0 else j
+        elif sumber.startswith('/*', i):
+            j = sumber.find('*/', i + 2)
+            kode.append(' ')
+            i = n if j < 0 else j + 2
+        elif c == '/' and _regex_boleh_js(terakhir, sebelumnya, kata):
+            j, kelas = i + 1, False
+            while j < n and (kelas or sumber[j] != '/') and sumber[j] != '\n':
+                if sumber[j] == '\\':
+                    j += 1
+                elif sumber[j] in '[]':
+                    kelas = sumber[j] == '['
+                j += 1
+            i = literal(j + 1)
+            terakhir, sebelumnya, kata = '/', terakhir, ''
+        else:
+            kode.append(c)
+            if _karakter_nama_js(c):
+                kata = kata + c if i > 0 and _karakter_nama_js(sumber[i - 1]) else c
+            elif not c.isspace():
+                kata = ''
+            if not c.isspace():
+                terakhir, sebelumnya = c, terakhir
+            i += 1
+    keluaran.append(_rapikan_kode_js(''.join(kode)))
+    return ''.join(keluaran).strip() + '\n'
+
+def perkecil_css(sumber):
+    bagian = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', sumber)
+    for i in range(0, len(bagian), 2):
+        teks = re.sub(r'/\*.*?\*/', '', bagian[i], flags=re.S)
+        teks = re.sub(r'\s+', ' ', teks)
+        teks = re.sub(r'\s*([{};,>])\s*', r'\1', teks)
+        bagian[i] = re.sub(r':\s+', ':', teks).replace(';}', '}')
+    return ''.join(bagian).strip() + '\n'
+
+PEMERKECIL_ASET = {'.js': perkecil_js, '.css': perkecil_css}
+
+def tulis_atomik(path, isi):
+    # Worker yang sedang berjalan bisa membaca dist/ saat build deploy; os.replace mencegah berkas setengah jadi
+    fd, sementara = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(isi)
+    os.chmod(sementara, 0o644)
+    os.replace(sementara, path)
+
+def bangun_aset(folder_statis, bundel=ASET_BUNDEL):
+    # Mengembalikan manifes {nama logis: nama berhash}; berkas yang sudah ada dengan hash sama dilewati
+    folder_hasil = os.path.join(folder_statis, ASET_FOLDER_HASIL)
+    os.makedirs(folder_hasil, exist_ok=True)
+    manifes = {}
+    for nama, sumber in bundel.items():
+        ekstensi = os.path.splitext(nama)[1]
+        isi = []
+        for s in sumber:
+            with open(os.path.join(folder_statis, s), encoding='utf-8') as f:
+                isi.append(f.read())
+        pemisah = ';\n' if ekstensi == '.js' else '\n'
+        hasil = PEMERKECIL_ASET[ekstensi](pemisah.join(isi)).encode()
+        sidik = hashlib.sha256(hasil).hexdigest()[:12]
+        nama_hasil = f'{ASET_FOLDER_HASIL}/{os.path.basename(nama)[:-len(ekstensi)]}.{sidik}{ekstensi}'
+        path_hasil = os.path.join(folder_statis, nama_hasil)
+        if not (os.path.exists(path_hasil) and os.path.exists(path_hasil + '.gz')):
+            tulis_atomik(path_hasil, hasil)
+            # mtime=0 agar .gz identik di setiap build
+            tulis_atomik(path_hasil + '.gz', gzip.compress(hasil, compresslevel=9, mtime=0))
+        manifes[nama] = nama_hasil
+    tulis_atomik(os.path.join(folder_hasil, 'manifest.json'), json.dumps(manifes, indent=2, sort_keys=True).encode())
+    return manifes
+
+def bersihkan_aset_lama(folder_statis, manifes):
+    folder_hasil = os.path.join(folder_statis, ASET_FOLDER_HASIL)
+    dipakai = {os.path.basename(n) for n in manifes.values()} | {os.path.basename(n) + '.gz' for n in manifes.values()}
+    dihapus = []
+    for nama in os.listdir(folder_hasil):
+        if nama != 'manifest.json' and nama not in dipakai:
+            os.remove(os.path.join(folder_hasil, nama))
+            dihapus.append(nama)
+    return dihapus
+
+def muat_manifes_aset(folder_statis):
+    # Entri yang berkasnya hilang dilewati agar halaman tidak menunjuk URL berhash yang 404
+    try:
+        with open(os.path.join(folder_statis, ASET_FOLDER_HASIL, 'manifest.json'), encoding='utf-8') as f:
+            manifes = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {nama: hasil for nama, hasil in manifes.items()
+            if os.path.exists(os.path.join(folder_statis, hasil)) and os.path.exists(os.path.join(folder_statis, hasil + '.gz'))}
+
+ASET_MANIFES = muat_manifes_aset(app.static_folder) if ASET_AKTIF else {}
+ASET_BERHASH = frozenset(ASET_MANIFES.values())
+
+@app.url_defaults
+def arahkan_aset_berhash(endpoint, values):
+    # Mode debug memakai berkas sumber agar perubahan CSS/JS langsung terlihat tanpa restart
+    if endpoint == 'static' and not app.debug:
+        nama = ASET_MANIFES.get(values.get('filename'))
+        if nama:
+            values['filename'] = nama
+
+def kirim_aset_statis(filename):
+    if filename not in ASET_BERHASH:
+        return app.send_static_file(filename)
+    gz = 'gzip' in request.accept_encodings
+    # Nama .gz membuat werkzeug mengirim Content-Encoding: gzip dengan Content-Type berkas aslinya
+    respons = send_from_directory(app.static_folder, filename + '.gz' if gz else filename, max_age=ASET_MAX_AGE)
+    respons.vary.add('Accept-Encoding')
+    respons.cache_control.public = True
+    respons.cache_control.immutable = True
+    return respons
+
+app.view_functions['static'] = kirim_aset_statis
+
+# --- GET BERSYARAT (ETAG) ---
+# Halaman materi, Jalur Belajar dan Pojok Baca menjawab 304 tanpa query berat maupun render template bila
+# ETag dari browser masih cocok. ETag dibentuk dari stempel murah: versi tampilan (kode + template), user
+# dan jumlah notifikasi belum dibaca (keduanya tampil di layout), ditambah stempel khusus halaman seperti
+# versi katalog atau versi progres siswa. Keputusan 304 hanya memakai If-None-Match; Last-Modified
+# dikirim sebagai informasi karena lonceng notifikasi di layout tidak memiliki stempel waktu.
+def hitung_versi_tampilan():
+    h = hashlib.sha256()
+    folder_template = os.path.join(base_dir, 'templates')
+    for nama in sorted(os.listdir(folder_template)) if os.path.isdir(folder_template) else ():
+        with open(os.path.join(folder_template, nama), 'rb') as f:
+            h.update(nama.encode() + f.read())
+    with open(os.path.abspath(__file__), 'rb') as f:
+        h.update(f.read())
+    # URL aset berhash tertulis di layout, jadi aset baru berarti halaman baru
+    h.update(json.dumps(ASET_MANIFES, sort_keys=True).encode())
+    return h.hexdigest()[:12]
+
+VERSI_TAMPILAN = hitung_versi_tampilan()
+
+def jawab_bersyarat(stempel, terakhir_diubah, buat_respons):
+    # stempel: tuple nilai murah penentu isi halaman; buat_respons() baru dipanggil bila perlu render
+    if session.get('_flashes'):
+        # Pesan flash hanya tampil sekali, jadi halaman ini tidak boleh dianggap sama dengan sebelumnya
+        return buat_respons()
+    # Lonceng di layout ikut menentukan isi halaman: stempel_notifikasi (bukan angka dari cache) agar
+    # pesan baru di worker mana pun selalu menghasilkan ETag baru
+    bagian = (VERSI_TAMPILAN, session.get('user_id'), stempel_notifikasi(pengguna_saat_ini())) + tuple(stempel)
+    etag = hashlib.sha256(repr(bagian).encode()).hexdigest()[:24]
+    if request.if_none_match.contains_weak(etag):
+        respons = Response(status=304)
+    else:
+        respons = app.make_response(buat_respons())
+    respons.set_etag(etag, weak=True)
+    if terakhir_diubah is not None:
+        respons.last_modified = terakhir_diubah.replace(tzinfo=datetime.timezone.utc)
+    # Halaman berisi data per user: hanya cache browser, dan selalu divalidasi ulang
+    respons.headers['Cache-Control'] = 'private, no-cache'
+    return respons
+
+def stempel_progres(user_id):
+    # (jumlah konten selesai, waktu perubahan) dari StatistikSiswa; satu lookup primary key
+    baris = db.session.query(StatistikSiswa.total_konten_selesai, StatistikSiswa.diperbarui).filter_by(user_id=user_id).first()
+    return tuple(baris) if baris else (0, None)
+
+def stempel_pojok_baca():
+    # Jumlah baris dan perubahan terakhir; MAX memakai indeks diperbarui, COUNT menangkap penghapusan
+    return db.session.query(func.count(PojokBaca.id), func.max(PojokBaca.diperbarui)).one()
+
+# --- MESIN ATURAN LENCANA ---
+# Indeks konten -> materi -> lencana dibangun sekali per versi katalog. Satu penyelesaian hanya
+# mengevaluasi aturan yang bisa dipengaruhi konten tersebut, dan setiap aturan dicek dengan
+# data ringkasan (StatistikSiswa, PenguasaanMateri, PenguasaanAlur) sehingga biayanya tidak bergantung pada riwayat siswa.
+JENIS_ATURAN = {}
+
+def daftarkan_aturan(jenis):
+    def decorator(cls):
+        cls.jenis = jenis
+        JENIS_ATURAN[jenis] = cls
+        return cls
+    return decorator
+
+class AturanLencana:
+    jenis = None
+    emoji = '🏆'
+
+    def __init__(self, badge_id):
+        self.badge_id = badge_id
+
+    def cakupan_materi(self):
+        # None berarti aturan dipicu oleh konten apa pun; selain itu himpunan materi_id pemicu.
+        return None
+
+    def terpenuhi(self, konteks):
+        raise NotImplementedError
+
+@daftarkan_aturan('jumlah_konten')
+class AturanJumlahKonten(AturanLencana):
+    emoji = '🎉'
+
+    def __init__(self, badge_id, ambang=1):
+        super().__init__(badge_id)
+        self.ambang = ambang
+
+    def terpenuhi(self, konteks):
+        return konteks.statistik.total_konten_selesai >= self.ambang
+
+@daftarkan_aturan('streak')
+class AturanStreak(AturanLencana):
+    emoji = '🔥'
+
+    def __init__(self, badge_id, hari=3):
+        super().__init__(badge_id)
+        self.hari = hari
+
+    def terpenuhi(self, konteks):
+        return konteks.statistik.streak_hari >= self.hari
+
+@daftarkan_aturan('alur_selesai')
+class AturanAlurSelesai(AturanLencana):
+    # Terpenuhi bila semua konten suatu tahap pada materi yang baru disentuh sudah selesai.
+    # Hanya materi yang konten pemicunya berada di tahap ini yang dicek, masing-masing satu baris ledger.
+    emoji = '🧭'
+
+    def __init__(self, badge_id, alur='merefleksi'):
+        super().__init__(badge_id)
+        self.alur = alur
+
+    def terpenuhi(self, konteks):
+        for materi_id in konteks.materi_per_alur.get(self.alur, ()):
+            penguasaan = konteks.penguasaan_alur(materi_id, self.alur)
+            if penguasaan is not None and penguasaan.selesai:
+                return True
+        return False
+
+@daftarkan_aturan('materi_selesai')
+class AturanMateriSelesai(AturanLencana):
+    def __init__(self, badge_id, materi_id):
+        super().__init__(badge_id)
+        self.materi_id = materi_id
+
+    def cakupan_materi(self):
+        return {self.materi_id}
+
+    def terpenuhi(self, konteks):
+        penguasaan = konteks.penguasaan(self.materi_id)
+        return penguasaan is not None and penguasaan.selesai
+
+# Aturan untuk lencana bernama; lencana per materi dibuat otomatis dari Badge.materi_pokok_id.
+ATURAN_LENCANA = [
+    {'jenis': 'jumlah_konten', 'badge': 'Langkah Pertama', 'ambang': 1},
+    {'jenis': 'streak', 'badge': 'Semangat Tiga Hari', 'hari': 3},
+    {'jenis': 'alur_selesai', 'badge': 'Perenung Sejati', 'alur': 'merefleksi'},
+]
+
+IndeksLencana = namedtuple('IndeksLencana', 'versi materi_per_konten alur_per_konten aturan_umum aturan_per_materi badge_by_id')
+_indeks_lencana = None
+
+def bangun_indeks_lencana(versi):
+    materi_per_konten = {}
+    alur_per_konten = {}
+    for konten_id, materi_id, alur in db.session.query(KontenBelajar.id, KontenBelajar.materi_id, KontenBelajar.alur).all():
+        materi_per_konten[konten_id] = materi_id
+        alur_per_konten[konten_id] = alur
+
+    badges = Badge.query.all()
+    badge_by_nama = {b.nama: b for b in badges}
+    aturan = []
+    for config in ATURAN_LENCANA:
+        badge = badge_by_nama.get(config['badge'])
+        if badge is None:
+            continue
+        params = {k: v for k, v in config.items() if k not in ('jenis', 'badge')}
+        aturan.append(JENIS_ATURAN[config['jenis']](badge.id, **params))
+    for badge in badges:
+        if badge.materi_pokok_id is not None:
+            aturan.append(AturanMateriSelesai(badge.id, badge.materi_pokok_id))
+
+    aturan_umum = []
+    aturan_per_materi = {}
+    for a in aturan:
+        cakupan = a.cakupan_materi()
+        if cakupan is None:
+            aturan_umum.append(a)
+        else:
+            for materi_id in cakupan:
+                aturan_per_materi.setdefault(materi_id, []).append(a)
+
+    return IndeksLencana(
+        versi=versi,
+        materi_per_konten=MappingProxyType(materi_per_konten),
+        alur_per_konten=MappingProxyType(alur_per_konten),
+        aturan_umum=tuple(aturan_umum),
+        aturan_per_materi=MappingProxyType({k: tuple(v) for k, v in aturan_per_materi.items()}),
+        badge_by_id=MappingProxyType({b.id: (b.nama, b.deskripsi, b.icon_url) for b in badges})
+    )
+
+def ambil_indeks_lencana():
+    global _indeks_lencana
+    versi = versi_katalog()
+    indeks = _indeks_lencana
+    if indeks is None or indeks.versi != versi:
+        indeks = bangun_indeks_lencana(versi)
+        _indeks_lencana = indeks
+    return indeks
+
+class KonteksEvaluasi:
+    def __init__(self, user_id, konten_ids, indeks, statistik):
+        self.user_id = user_id
+        self.indeks = indeks
+        self.statistik = statistik
+        self.materi_ids = set()
+        self.materi_per_alur = {}
+        for k in konten_ids:
+            if k in indeks.materi_per_konten:
+                self.materi_ids.add(indeks.materi_per_konten[k])
+                self.materi_per_alur.setdefault(indeks.alur_per_konten[k], set()).add(indeks.materi_per_konten[k])
+        self._penguasaan = {}
+        self._penguasaan_alur = {}
+
+    # Ledger baru saja dinaikkan lewat UPDATE massal (synchronize_session=False); populate_existing
+    # memastikan objek yang mungkin sudah ada di sesi memakai nilai terbaru.
+    def penguasaan(self, materi_id):
+        if materi_id not in self._penguasaan:
+            self._penguasaan[materi_id] = PenguasaanMateri.query.filter_by(
+                user_id=self.user_id, materi_id=materi_id
+            ).populate_existing().first()
+        return self._penguasaan[materi_id]
+
+    def penguasaan_alur(self, materi_id, alur):
+        if (materi_id, alur) not in self._penguasaan_alur:
+            self._penguasaan_alur[materi_id, alur] = PenguasaanAlur.query.filter_by(
+                user_id=self.user_id, materi_id=materi_id, alur=alur
+            ).populate_existing().first()
+        return self._penguasaan_alur[materi_id, alur]
+
+def evaluasi_lencana(user_id, konten_ids, statistik):
+    # Dipanggil setelah progres, ledger dan statistik diperbarui (sebelum commit).
+    # Mengembalikan daftar (badge_id, nama, emoji) untuk lencana yang baru diberikan.
+    indeks = ambil_indeks_lencana()
+    konteks = KonteksEvaluasi(user_id, konten_ids, indeks, statistik)
+
+    kandidat = {}
+    for a in indeks.aturan_umum:
+        kandidat.setdefault(a.badge_id, []).append(a)
+    for materi_id in konteks.materi_ids:
+        for a in indeks.aturan_per_materi.get(materi_id, ()):
+            kandidat.setdefault(a.badge_id, []).append(a)
+    if not kandidat:
+        return []
+
+    dimiliki = {row[0] for row in db.session.query(UserBadge.badge_id).filter(
+        UserBadge.user_id == user_id, UserBadge.badge_id.in_(kandidat.keys())
+    ).all()}
+
+    lencana_baru = []
+    for badge_id, daftar_aturan in kandidat.items():
+        if badge_id in dimiliki:
+            continue
+        aturan_terpenuhi = next((a for a in daftar_aturan if a.terpenuhi(konteks)), None)
+        if aturan_terpenuhi:
+            db.session.add(UserBadge(user_id=user_id, badge_id=badge_id))
+            lencana_baru.append((badge_id, indeks.badge_by_id[badge_id][0], aturan_terpenuhi.emoji))
+    return lencana_baru
 
 # --- DECORATOR ---
-def login_required(f):
+# User yang login dimuat sekali per request oleh login_required dan disimpan di g.pengguna. View memilih
+# relasi yang ikut dimuat lewat login_required(muat=...) agar template tidak memicu lazy load per baris.
+# Nilainya fungsi karena relasi backref baru tersedia setelah semua mapper dikonfigurasi.
+PROFIL_MUAT_PENGGUNA = {
+    'lencana': lambda: (db.selectinload(User.badges).joinedload(UserBadge.badge),),
+    'siswa_tertaut': lambda: (db.joinedload(User.siswa),),
+}
+
+def muat_pengguna(user_id, profil=()):
+    opsi = [o for nama in profil for o in PROFIL_MUAT_PENGGUNA[nama]()]
+    return db.session.get(User, user_id, options=opsi)
+
+def pengguna_saat_ini():
+    # None bila belum login
+    if 'pengguna' not in g:
+        g.pengguna = muat_pengguna(session['user_id']) if 'user_id' in session else None
+    return g.pengguna
+
+def login_required(f=None, muat=()):
+    # @login_required, @login_required(muat='lencana'), atau profil per peran:
+    # @login_required(muat={'orangtua': 'siswa_tertaut'})
+    if f is None:
+        return partial(login_required, muat=muat)
+
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Anda harus masuk terlebih dahulu.', 'warning')
             return redirect(url_for('login'))
+        profil = muat.get(session.get('user_role'), ()) if isinstance(muat, dict) else muat
+        g.pengguna = muat_pengguna(session['user_id'], (profil,) if isinstance(profil, str) else profil)
+        if g.pengguna is None:
+            # Akun sudah dihapus sementara sesinya masih aktif
+            session.clear()
+            flash('Akun Anda tidak ditemukan. Silakan masuk kembali.', 'warning')
+            return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -160,7 +1313,9 @@ def role_required(role):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if session.get('user_role') != role:
+            # Peran dibaca dari user yang dimuat, sehingga perubahan peran oleh admin langsung berlaku
+            pengguna = pengguna_saat_ini()
+            if pengguna is None or pengguna.peran != role:
                 flash('Anda tidak memiliki izin untuk mengakses halaman ini.', 'danger')
                 return redirect(url_for('dashboard'))
             return f(*args, **kwargs)
@@ -170,32 +1325,882 @@ def role_required(role):
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if session.get('user_role') != 'admin':
+        pengguna = pengguna_saat_ini()
+        if pengguna is None or pengguna.peran != 'admin':
             flash('Anda harus menjadi admin untuk mengakses halaman ini.', 'danger')
             return redirect(url_for('dashboard'))
         return f(*args, **kwargs)
     return decorated_function
 
-@app.context_processor
-def inject_notifications():
-    if 'user_id' in session:
-        # Query ini HANYA untuk menghitung angka di lonceng
-        unread_count = Notifikasi.query.filter_by(
-            penerima_id=session['user_id'], 
-            sudah_dibaca=False
+# --- HASHING PASSWORD & PEMBATASAN LOGIN ---
+class HashSibuk(Exception):
+    # Semua slot hashing terpakai lebih lama dari HASH_TUNGGU_DETIK
+    pass
+
+@contextmanager
+def slot_hash(jumlah_slot=None, tunggu_detik=None):
+    # Semafor lintas proses: slot ke-i adalah berkas HASH_SLOT_DIR/slot-i.kunci yang dikunci flock
+    # (kunci per berkas terbuka, jadi juga membatasi thread dalam satu proses). Kunci lepas sendiri bila
+    # proses mati di tengah hashing, sehingga slot tidak pernah bocor. jumlah_slot < HASH_KONKURENSI
+    # hanya memakai slot awal, sehingga slot sisanya tetap tersedia untuk login.
+    os.makedirs(HASH_SLOT_DIR, exist_ok=True)
+    batas = time.monotonic() + (HASH_TUNGGU_DETIK if tunggu_detik is None else tunggu_detik)
+    while True:
+        for i in range(HASH_KONKURENSI if jumlah_slot is None else jumlah_slot):
+            berkas = open(os.path.join(HASH_SLOT_DIR, f'slot-{i}.kunci'), 'a')
+            try:
+                fcntl.flock(berkas, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                berkas.close()
+                continue
+            try:
+                yield
+            finally:
+                berkas.close()
+            return
+        if time.monotonic() >= batas:
+            raise HashSibuk()
+        time.sleep(0.02 + random.random() * 0.03)
+
+def jalankan_hash(fungsi, *args, **kwargs):
+    # Hashing berjalan langsung di thread request setelah mendapat slot, agar lonjakan login tidak
+    # memakan CPU yang dibutuhkan halaman lain
+    with slot_hash():
+        return fungsi(*args, **kwargs)
+
+def hash_password(password):
+    return jalankan_hash(generate_password_hash, password, method=HASH_METODE)
+
+def cocokkan_password(password_hash, password):
+    return jalankan_hash(check_password_hash, password_hash, password)
+
+@lru_cache(maxsize=None)
+def awalan_hash_aktif():
+    # Bentuk lengkap HASH_METODE seperti yang ditulis werkzeug di depan hash, mis. 'pbkdf2:sha256:1000000'
+    return generate_password_hash('', method=HASH_METODE).split('$', 1)[0]
+
+def perlu_hash_ulang(password_hash):
+    return password_hash.split('$', 1)[0] != awalan_hash_aktif()
+
+def kunci_login(username):
+    return [f'u:{username}', f'ip:{request.remote_addr}']
+
+def sisa_waktu_blokir_login(username):
+    # Detik tersisa sebelum boleh mencoba lagi; 0 jika username dan IP belum melewati batas
+    batas_awal = waktu_utc_sekarang() - datetime.timedelta(seconds=LOGIN_JENDELA_DETIK)
+    sisa = 0
+    for percobaan in PercobaanLogin.query.filter(
+        PercobaanLogin.kunci.in_(kunci_login(username)),
+        PercobaanLogin.jendela_mulai > batas_awal
+    ):
+        batas = LOGIN_MAKS_GAGAL_USERNAME if percobaan.kunci.startswith('u:') else LOGIN_MAKS_GAGAL_IP
+        if percobaan.jumlah >= batas:
+            sisa = max(sisa, int((percobaan.jendela_mulai - batas_awal).total_seconds()) + 1)
+    return sisa
+
+def catat_login_gagal(username):
+    sekarang = waktu_utc_sekarang()
+    batas_awal = sekarang - datetime.timedelta(seconds=LOGIN_JENDELA_DETIK)
+    PercobaanLogin.query.filter(PercobaanLogin.jendela_mulai <= batas_awal).delete(synchronize_session=False)
+    for kunci in kunci_login(username):
+        stmt = sqlite_insert(PercobaanLogin).values(kunci=kunci, jumlah=1, jendela_mulai=sekarang)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['kunci'],
+            set_={'jumlah': PercobaanLogin.jumlah + 1}
+        ))
+    db.session.commit()
+
+def hapus_login_gagal(username):
+    PercobaanLogin.query.filter_by(kunci=f'u:{username}').delete(synchronize_session=False)
+
+@app.errorhandler(AntreanTulisPenuh)
+def tangani_antrean_tulis_penuh(e):
+    app.logger.warning('Kunci tulis tidak didapat dalam %d ms (%s %s)', SQLITE_BUSY_MS, request.method, request.path)
+    return Response('Server sedang sibuk menyimpan data. Silakan coba lagi.', status=503,
+                    headers={'Retry-After': '1'}, mimetype='text/plain')
+
+@app.errorhandler(HashSibuk)
+def tangani_hash_sibuk(e):
+    flash('Server sedang sibuk melayani banyak login. Silakan coba lagi beberapa detik lagi.', 'warning')
+    return redirect(request.url), 303
+
+# --- ALOKATOR KODE PAIRING ---
+# Kode tidak diacak lalu dicek satu per satu. Alokator memesan blok indeks dari penghitung di
+# database (satu UPDATE ... RETURNING), lalu setiap indeks dipetakan ke kode lewat permutasi berkunci
+# atas seluruh ruang kode (Feistel 32-bit + cycle walking ke 36^6). Indeks berbeda selalu menghasilkan
+# kode berbeda, jadi tidak perlu query per kode. Kode lama dari sebelum alokator dipakai bisa saja
+# bertabrakan; baris itu dilewati oleh ON CONFLICT DO NOTHING dan diberi indeks baru.
+RUANG_KODE_PAIRING = len(KODE_PAIRING_ABJAD) ** KODE_PAIRING_PANJANG
+
+def _feistel32(nilai, kunci):
+    kiri, kanan = nilai >> 16, nilai & 0xFFFF
+    for putaran in range(6):
+        f = hmac.new(kunci, bytes([putaran]) + kanan.to_bytes(2, 'big'), hashlib.sha256).digest()
+        kiri, kanan = kanan, kiri ^ int.from_bytes(f[:2], 'big')
+    return (kiri << 16) | kanan
+
+def indeks_ke_kode_pairing(indeks, kunci):
+    nilai = _feistel32(indeks, kunci)
+    while nilai >= RUANG_KODE_PAIRING:
+        nilai = _feistel32(nilai, kunci)
+    huruf = []
+    for _ in range(KODE_PAIRING_PANJANG):
+        nilai, sisa = divmod(nilai, len(KODE_PAIRING_ABJAD))
+        huruf.append(KODE_PAIRING_ABJAD[sisa])
+    return ''.join(reversed(huruf))
+
+def pesan_indeks_kode_pairing(jumlah):
+    # Memesan blok [awal, awal + jumlah) secara atomik; aman dipanggil dari banyak worker
+    db.session.execute(sqlite_insert(AlokatorKodePairing).values(
+        id=1, berikutnya=0, kunci=secrets.token_hex(16)
+    ).on_conflict_do_nothing())
+    akhir, kunci = db.session.execute(
+        db.update(AlokatorKodePairing).where(AlokatorKodePairing.id == 1)
+        .values(berikutnya=AlokatorKodePairing.berikutnya + jumlah)
+        .returning(AlokatorKodePairing.berikutnya, AlokatorKodePairing.kunci)
+    ).one()
+    if akhir > RUANG_KODE_PAIRING:
+        raise RuntimeError('Ruang kode pairing sudah habis.')
+    return range(akhir - jumlah, akhir), bytes.fromhex(kunci)
+
+def alokasikan_kode_pairing(siswa_ids):
+    # Memberi kode baru (berlaku KODE_PAIRING_MASA_BERLAKU_HARI hari) untuk banyak siswa sekaligus.
+    # Kode lama siswa tersebut diganti. Tidak melakukan commit.
+    siswa_ids = list(siswa_ids)
+    for bagian in potong(siswa_ids):
+        KodePairing.query.filter(KodePairing.siswa_id.in_(bagian)).delete(synchronize_session=False)
+    kedaluwarsa = waktu_utc_sekarang() + datetime.timedelta(days=KODE_PAIRING_MASA_BERLAKU_HARI)
+    hasil = {}
+    sisa = siswa_ids
+    while sisa:
+        rentang, kunci = pesan_indeks_kode_pairing(len(sisa))
+        baris = [{'kode': indeks_ke_kode_pairing(indeks, kunci), 'siswa_id': siswa_id, 'kedaluwarsa': kedaluwarsa}
+                 for indeks, siswa_id in zip(rentang, sisa)]
+        for bagian in potong(baris, 300):
+            stmt = sqlite_insert(KodePairing).values(bagian).on_conflict_do_nothing()
+            for kode, siswa_id in db.session.execute(stmt.returning(KodePairing.kode, KodePairing.siswa_id)):
+                hasil[siswa_id] = kode
+        sisa = [siswa_id for siswa_id in sisa if siswa_id not in hasil]
+    return hasil
+
+def kode_pairing_aktif(siswa):
+    # Kode yang masih berlaku untuk siswa tanpa orang tua; kode kedaluwarsa diganti otomatis
+    if siswa.parent_id:
+        return None
+    kode = siswa.kode_pairing
+    if kode is None or kode.kedaluwarsa <= waktu_utc_sekarang():
+        alokasikan_kode_pairing([siswa.id])
+        db.session.commit()
+        db.session.expire(siswa, ['kode_pairing'])
+        kode = siswa.kode_pairing
+    return kode
+
+def bersihkan_kode_pairing():
+    jumlah = KodePairing.query.filter(
+        KodePairing.kedaluwarsa <= waktu_utc_sekarang()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return jumlah
+
+def migrasi_kode_pairing():
+    # Memindahkan kolom lama user.kode_pairing (jika masih ada) ke tabel kode_pairing
+    kolom = {baris[1] for baris in db.session.execute(text('PRAGMA table_info("user")'))}
+    if 'kode_pairing' not in kolom:
+        return 0
+    kedaluwarsa = waktu_utc_sekarang() + datetime.timedelta(days=KODE_PAIRING_MASA_BERLAKU_HARI)
+    jumlah = db.session.execute(text(
+        'INSERT INTO kode_pairing (kode, siswa_id, kedaluwarsa) '
+        'SELECT kode_pairing, id, :kedaluwarsa FROM "user" '
+        "WHERE kode_pairing IS NOT NULL AND peran = 'siswa' AND parent_id IS NULL "
+        'ON CONFLICT DO NOTHING'
+    ), {'kedaluwarsa': kedaluwarsa}).rowcount
+    db.session.execute(text('UPDATE "user" SET kode_pairing = NULL WHERE kode_pairing IS NOT NULL'))
+    db.session.commit()
+    return jumlah
+
+# --- BACKUP DATABASE ---
+# Snapshot diambil dengan SQLite online backup API sehingga konsisten walaupun worker lain sedang
+# menulis, diperiksa dengan PRAGMA integrity_check, lalu disimpan terkompresi gzip di BACKUP_DIR.
+# manifest.json mencatat setiap snapshot (ukuran, sha256); hanya BACKUP_SIMPAN snapshot terbaru disimpan.
+class GagalBackup(Exception):
+    pass
+
+def path_database():
+    return db.engine.url.database
+
+def path_manifest_backup():
+    return os.path.join(BACKUP_DIR, 'manifest.json')
+
+def baca_manifest_backup():
+    try:
+        with open(path_manifest_backup()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def _tulis_manifest_backup(daftar):
+    sementara = path_manifest_backup() + '.tmp'
+    with open(sementara, 'w') as f:
+        json.dump(daftar, f, indent=2)
+    os.replace(sementara, path_manifest_backup())
+
+def _sha256_berkas(path):
+    hasil = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for blok in iter(lambda: f.read(1024 * 1024), b''):
+            hasil.update(blok)
+    return hasil.hexdigest()
+
+def _cek_integritas_sqlite(path):
+    koneksi = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return koneksi.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        koneksi.close()
+
+def buat_snapshot(path_db):
+    # Dipanggil dari thread latar belakang atau CLI; tidak memakai sesi SQLAlchemy.
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with open(os.path.join(BACKUP_DIR, '.kunci'), 'w') as kunci:
+        try:
+            fcntl.flock(kunci, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise GagalBackup('Backup lain sedang berjalan.')
+        stempel = datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
+        nama, urutan = f'rumi_{stempel}.db.gz', 1
+        while os.path.exists(os.path.join(BACKUP_DIR, nama)):
+            urutan += 1
+            nama = f'rumi_{stempel}_{urutan}.db.gz'
+        with tempfile.TemporaryDirectory(dir=BACKUP_DIR) as folder_sementara:
+            salinan = os.path.join(folder_sementara, 'rumi.db')
+            sumber, tujuan = sqlite3.connect(path_db), sqlite3.connect(salinan)
+            try:
+                sumber.backup(tujuan)
+            finally:
+                tujuan.close()
+                sumber.close()
+            integritas = _cek_integritas_sqlite(salinan)
+            if integritas != 'ok':
+                raise GagalBackup(f'Snapshot gagal integrity_check: {integritas}')
+            terkompresi = os.path.join(folder_sementara, nama)
+            with open(salinan, 'rb') as masuk, gzip.open(terkompresi, 'wb', compresslevel=6) as keluar:
+                shutil.copyfileobj(masuk, keluar, 1024 * 1024)
+            entri = {
+                'berkas': nama,
+                'dibuat': waktu_utc_sekarang().isoformat(timespec='seconds'),
+                'ukuran_asli': os.path.getsize(salinan),
+                'ukuran': os.path.getsize(terkompresi),
+                'sha256': _sha256_berkas(terkompresi),
+            }
+            os.replace(terkompresi, os.path.join(BACKUP_DIR, nama))
+
+        # Rotasi: simpan BACKUP_SIMPAN snapshot terbaru, hapus sisanya beserta berkasnya
+        daftar = [entri] + baca_manifest_backup()
+        for lama in daftar[BACKUP_SIMPAN:]:
+            try:
+                os.remove(os.path.join(BACKUP_DIR, lama['berkas']))
+            except FileNotFoundError:
+                pass
+        _tulis_manifest_backup(daftar[:BACKUP_SIMPAN])
+        return entri
+
+_backup_berjalan = threading.Event()
+
+def mulai_backup_latar():
+    # Mengembalikan False bila backup dari proses ini masih berjalan
+    if _backup_berjalan.is_set():
+        return False
+    _backup_berjalan.set()
+    path_db = path_database()
+
+    def kerja():
+        try:
+            buat_snapshot(path_db)
+        except Exception:
+            app.logger.exception('Backup latar belakang gagal')
+        finally:
+            _backup_berjalan.clear()
+
+    threading.Thread(target=kerja, name='rumi-backup', daemon=True).start()
+    return True
+
+def entri_backup(nama_berkas):
+    return next((e for e in baca_manifest_backup() if e['berkas'] == nama_berkas), None)
+
+def verifikasi_snapshot(nama_berkas, simpan_ke=None):
+    # Memeriksa sha256 terhadap manifest dan integritas SQLite hasil dekompresi.
+    # Jika simpan_ke diberikan, hasil dekompresi yang lolos disalin ke sana.
+    entri = entri_backup(nama_berkas)
+    path = os.path.join(BACKUP_DIR, nama_berkas)
+    if entri is None or not os.path.exists(path):
+        raise GagalBackup(f'Snapshot {nama_berkas} tidak ada di manifest.')
+    if _sha256_berkas(path) != entri['sha256']:
+        raise GagalBackup('Checksum sha256 tidak cocok dengan manifest.')
+    with tempfile.TemporaryDirectory(dir=BACKUP_DIR) as folder_sementara:
+        salinan = os.path.join(folder_sementara, 'rumi.db')
+        with gzip.open(path, 'rb') as masuk, open(salinan, 'wb') as keluar:
+            shutil.copyfileobj(masuk, keluar, 1024 * 1024)
+        integritas = _cek_integritas_sqlite(salinan)
+        if integritas != 'ok':
+            raise GagalBackup(f'integrity_check gagal: {integritas}')
+        if simpan_ke:
+            sumber, tujuan = sqlite3.connect(salinan), sqlite3.connect(simpan_ke)
+            try:
+                sumber.backup(tujuan)
+            finally:
+                tujuan.close()
+                sumber.close()
+    return entri
+
+# --- INDEKS PENCARIAN POJOK BACA ---
+# Tabel FTS5 external-content di atas pojok_baca (judul, deskripsi, kategori). Disinkronkan secara
+# eksplisit oleh tambah_bacaan, edit_bacaan dan hapus_bacaan; dibuat & diisi otomatis saat pertama dipakai.
+_fts_pojok_baca_siap = False
+
+def siapkan_fts_pojok_baca():
+    global _fts_pojok_baca_siap
+    if _fts_pojok_baca_siap:
+        return
+    ada = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pojok_baca_fts'"
+    )).first()
+    if not ada:
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS pojok_baca_fts USING fts5("
+            "judul, deskripsi, kategori, content='pojok_baca', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+        db.session.execute(text("INSERT INTO pojok_baca_fts(pojok_baca_fts) VALUES ('rebuild')"))
+        db.session.commit()
+    _fts_pojok_baca_siap = True
+
+def bangun_ulang_fts_pojok_baca():
+    siapkan_fts_pojok_baca()
+    db.session.execute(text("INSERT INTO pojok_baca_fts(pojok_baca_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+def fts_tambah_bacaan(bacaan):
+    db.session.execute(text(
+        "INSERT INTO pojok_baca_fts (rowid, judul, deskripsi, kategori) VALUES (:id, :judul, :deskripsi, :kategori)"
+    ), {'id': bacaan.id, 'judul': bacaan.judul, 'deskripsi': bacaan.deskripsi, 'kategori': bacaan.kategori})
+
+def fts_hapus_bacaan(bacaan_id, judul, deskripsi, kategori):
+    # Tabel external-content butuh nilai lama yang persis sama untuk menghapus entri indeks.
+    db.session.execute(text(
+        "INSERT INTO pojok_baca_fts (pojok_baca_fts, rowid, judul, deskripsi, kategori) "
+        "VALUES ('delete', :id, :judul, :deskripsi, :kategori)"
+    ), {'id': bacaan_id, 'judul': judul, 'deskripsi': deskripsi, 'kategori': kategori})
+
+def buat_query_fts(kata_kunci):
+    # Setiap kata menjadi token berkutip dengan pencocokan awalan ("fotosin"*) agar aman dari
+    # sintaks FTS5 dan mendukung pencarian sambil mengetik. Semua kata harus cocok (AND).
+    kata = re.findall(r'\w+', kata_kunci)
+    return ' '.join(f'"{k}"*' for k in kata)
+
+def cari_bacaan(kata_kunci, kategori=None, limit=POJOK_BACA_PER_HALAMAN, offset=0):
+    # Mengembalikan (daftar PojokBaca terurut relevansi, total hasil, facet {kategori: jumlah}).
+    siapkan_fts_pojok_baca()
+    params = {'q': buat_query_fts(kata_kunci), 'limit': limit, 'offset': offset, 'kategori': kategori}
+    dari = ("FROM pojok_baca_fts JOIN pojok_baca ON pojok_baca.id = pojok_baca_fts.rowid "
+            "WHERE pojok_baca_fts MATCH :q")
+    filter_kategori = " AND pojok_baca.kategori = :kategori" if kategori else ""
+
+    ids = [row[0] for row in db.session.execute(text(
+        f"SELECT pojok_baca.id {dari}{filter_kategori} "
+        "ORDER BY bm25(pojok_baca_fts, 10.0, 3.0, 1.0) LIMIT :limit OFFSET :offset"
+    ), params)]
+    total = db.session.execute(text(f"SELECT COUNT(*) {dari}{filter_kategori}"), params).scalar()
+    facet = dict(db.session.execute(text(
+        f"SELECT pojok_baca.kategori, COUNT(*) {dari} GROUP BY pojok_baca.kategori"
+    ), params).all())
+
+    bacaan_map = {b.id: b for b in PojokBaca.query.filter(PojokBaca.id.in_(ids)).all()} if ids else {}
+    return [bacaan_map[i] for i in ids if i in bacaan_map], total, facet
+
+# --- INDEKS PENCARIAN PENGGUNA ---
+# Tabel FTS5 external-content di atas tabel user (nama_lengkap, username). Berbeda dengan Pojok Baca,
+# tabel user ditulis dari banyak rute (registrasi, admin, profil), jadi indeks disinkronkan oleh trigger SQLite.
+_fts_user_siap = False
+
+def siapkan_fts_user():
+    global _fts_user_siap
+    if _fts_user_siap:
+        return
+    ada = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_fts'"
+    )).first()
+    if not ada:
+        for perintah in (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5("
+            "nama_lengkap, username, content='user', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+            'CREATE TRIGGER IF NOT EXISTS user_fts_ai AFTER INSERT ON "user" BEGIN '
+            "INSERT INTO user_fts (rowid, nama_lengkap, username) VALUES (new.id, new.nama_lengkap, new.username); END",
+            'CREATE TRIGGER IF NOT EXISTS user_fts_ad AFTER DELETE ON "user" BEGIN '
+            "INSERT INTO user_fts (user_fts, rowid, nama_lengkap, username) "
+            "VALUES ('delete', old.id, old.nama_lengkap, old.username); END",
+            'CREATE TRIGGER IF NOT EXISTS user_fts_au AFTER UPDATE OF nama_lengkap, username ON "user" BEGIN '
+            "INSERT INTO user_fts (user_fts, rowid, nama_lengkap, username) "
+            "VALUES ('delete', old.id, old.nama_lengkap, old.username); "
+            "INSERT INTO user_fts (rowid, nama_lengkap, username) VALUES (new.id, new.nama_lengkap, new.username); END",
+            'CREATE INDEX IF NOT EXISTS ix_user_peran_id ON "user" (peran, id)',
+            "INSERT INTO user_fts (user_fts) VALUES ('rebuild')",
+        ):
+            db.session.execute(text(perintah))
+        db.session.commit()
+    _fts_user_siap = True
+
+def bangun_ulang_fts_user():
+    siapkan_fts_user()
+    db.session.execute(text("INSERT INTO user_fts (user_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+def filter_cari_user(kata_kunci):
+    # Kondisi "User.id IN (hasil FTS)" untuk digabung dengan filter lain pada query User
+    hasil_fts = text("SELECT rowid FROM user_fts WHERE user_fts MATCH :q").bindparams(
+        q=buat_query_fts(kata_kunci)
+    ).columns(rowid=db.Integer)
+    return User.id.in_(hasil_fts)
+
+# --- IMPOR DAFTAR PENGGUNA ---
+# Kolom berkas: nama_lengkap, username, password, peran, nama_sekolah, kelas, username_siswa.
+# username_siswa (opsional, khusus orangtua) langsung menghubungkan orang tua dengan siswanya.
+BarisImpor = namedtuple('BarisImpor', 'nomor data galat')
+
+def _teks_sel(nilai):
+    if nilai is None:
+        return ''
+    if isinstance(nilai, float) and nilai.is_integer():
+        nilai = int(nilai)
+    return str(nilai).strip()
+
+def baca_berkas_impor(aliran, nama_berkas):
+    # Mengembalikan daftar dict per baris dengan nama kolom huruf kecil
+    if nama_berkas.lower().endswith('.xlsx'):
+        if openpyxl is None:
+            raise ValueError('Impor XLSX membutuhkan paket openpyxl. Simpan berkas sebagai CSV atau pasang openpyxl.')
+        buku = openpyxl.load_workbook(aliran, read_only=True, data_only=True)
+        baris = buku.active.iter_rows(values_only=True)
+        kolom = [_teks_sel(nama).lower() for nama in next(baris, ())]
+        daftar = [dict(zip(kolom, map(_teks_sel, isi))) for isi in baris if any(sel is not None for sel in isi)]
+    else:
+        teks = io.TextIOWrapper(aliran, encoding='utf-8-sig', newline='')
+        contoh = teks.read(4096)
+        teks.seek(0)
+        try:
+            dialek = csv.Sniffer().sniff(contoh, delimiters=',;\t')
+        except csv.Error:
+            dialek = csv.excel
+        pembaca = csv.reader(teks, dialek)
+        kolom = [nama.strip().lower() for nama in next(pembaca, [])]
+        daftar = [dict(zip(kolom, map(_teks_sel, isi))) for isi in pembaca if any(sel.strip() for sel in isi)]
+    if 'username' not in kolom:
+        raise ValueError('Kolom "username" tidak ditemukan. Pastikan baris pertama berisi nama kolom.')
+    if len(daftar) > IMPOR_MAKS_BARIS:
+        raise ValueError(f'Berkas berisi {len(daftar)} baris; maksimal {IMPOR_MAKS_BARIS} baris per impor.')
+    return daftar
+
+def validasi_impor(daftar):
+    # Memeriksa setiap baris tanpa menulis apa pun; nomor baris mengikuti berkas (baris 1 = nama kolom)
+    usernames = [baris.get('username', '') for baris in daftar]
+    sudah_ada = set()
+    for bagian in potong([u for u in usernames if u]):
+        sudah_ada.update(u for (u,) in db.session.query(User.username).filter(User.username.in_(bagian)))
+
+    hasil = []
+    dilihat = set()
+    for nomor, baris in enumerate(daftar, start=2):
+        galat = []
+        username, peran, kelas = baris.get('username', ''), baris.get('peran', '').lower(), baris.get('kelas', '')
+        baris = dict(baris, peran=peran)
+        if not baris.get('nama_lengkap'):
+            galat.append('nama_lengkap kosong')
+        if not username:
+            galat.append('username kosong')
+        elif username in sudah_ada:
+            galat.append('username sudah digunakan')
+        elif username in dilihat:
+            galat.append('username ganda di dalam berkas')
+        dilihat.add(username)
+        if not baris.get('password'):
+            galat.append('password kosong')
+        if peran not in IMPOR_PERAN:
+            galat.append('peran harus siswa, guru, atau orangtua')
+        if peran in ('siswa', 'guru') and not baris.get('nama_sekolah'):
+            galat.append('nama_sekolah kosong')
+        if peran == 'siswa' and not kelas.isdigit():
+            galat.append('kelas siswa harus berupa angka, misalnya 7')
+        if baris.get('username_siswa') and peran != 'orangtua':
+            galat.append('username_siswa hanya untuk peran orangtua')
+        hasil.append(BarisImpor(nomor, baris, galat))
+
+    # Tautan orang tua -> siswa: siswa harus valid di berkas ini atau sudah ada dan belum punya orang tua
+    siswa_di_berkas = {b.data['username'] for b in hasil if not b.galat and b.data['peran'] == 'siswa'}
+    dirujuk = sorted({b.data['username_siswa'] for b in hasil if b.data.get('username_siswa')} - siswa_di_berkas)
+    siswa_di_db = {}
+    for bagian in potong(dirujuk):
+        siswa_di_db.update(db.session.query(User.username, User.parent_id).filter(
+            User.username.in_(bagian), User.peran == 'siswa'
+        ).all())
+    tertaut = set()
+    for b in hasil:
+        target = b.data.get('username_siswa')
+        if not target or b.data['peran'] != 'orangtua':
+            continue
+        if target not in siswa_di_berkas and target not in siswa_di_db:
+            b.galat.append(f'siswa "{target}" tidak ditemukan')
+        elif siswa_di_db.get(target) or target in tertaut:
+            b.galat.append(f'siswa "{target}" sudah terhubung dengan orang tua lain')
+        tertaut.add(target)
+    return hasil
+
+def _hash_impor(password, jumlah_slot):
+    with slot_hash(jumlah_slot, IMPOR_TUNGGU_SLOT_DETIK):
+        return generate_password_hash(password, method=HASH_METODE)
+
+def hash_password_massal(daftar_password):
+    # generate_password_hash sengaja lambat; untuk impor besar kerjakan paralel di beberapa proses.
+    # Setiap hash mengambil slot hash bersama, jadi impor tidak melewati HASH_KONKURENSI dan satu slot
+    # selalu tersisa untuk login di worker lain.
+    jumlah_slot = max(1, HASH_KONKURENSI - 1)
+    buat_hash = partial(_hash_impor, jumlah_slot=jumlah_slot)
+    proses = min(IMPOR_PROSES_HASH, jumlah_slot)
+    if len(daftar_password) < IMPOR_AMBANG_PARALEL or proses <= 1:
+        return [buat_hash(password) for password in daftar_password]
+    ukuran_potongan = max(1, len(daftar_password) // (proses * 4))
+    with ProcessPoolExecutor(max_workers=proses) as pool:
+        return list(pool.map(buat_hash, daftar_password, chunksize=ukuran_potongan))
+
+def impor_pengguna(daftar, simpan=True):
+    # Mengembalikan (hasil validasi per baris, jumlah akun dibuat). Baris bergalat dilewati.
+    hasil = validasi_impor(daftar)
+    valid = [b for b in hasil if not b.galat]
+    if not simpan or not valid:
+        return hasil, 0
+
+    daftar_hash = hash_password_massal([b.data['password'] for b in valid])
+    baris_user = []
+    for b, password_hash in zip(valid, daftar_hash):
+        peran = b.data['peran']
+        baris_user.append({
+            'nama_lengkap': b.data['nama_lengkap'],
+            'username': b.data['username'],
+            'password_hash': password_hash,
+            'peran': peran,
+            'nama_sekolah': b.data.get('nama_sekolah') or '-',
+            'kelas': b.data['kelas'] if peran == 'siswa' else None,
+        })
+    db.session.execute(db.insert(User), baris_user)
+
+    # Kode pairing hanya untuk siswa baru yang belum langsung dihubungkan dengan orang tua di berkas ini
+    siswa_tertaut = {b.data['username_siswa'] for b in valid if b.data.get('username_siswa')}
+    username_siswa_baru = [b.data['username'] for b in valid
+                           if b.data['peran'] == 'siswa' and b.data['username'] not in siswa_tertaut]
+    siswa_ids = []
+    for bagian in potong(username_siswa_baru):
+        siswa_ids.extend(i for (i,) in db.session.query(User.id).filter(User.username.in_(bagian)))
+    alokasikan_kode_pairing(siswa_ids)
+
+    tautan = [(b.data['username'], b.data['username_siswa']) for b in valid if b.data.get('username_siswa')]
+    if tautan:
+        id_per_username = {}
+        for bagian in potong(sorted({u for pasangan in tautan for u in pasangan})):
+            id_per_username.update(db.session.query(User.username, User.id).filter(User.username.in_(bagian)).all())
+        perubahan = []
+        for username_ortu, username_siswa in tautan:
+            ortu_id, siswa_id = id_per_username[username_ortu], id_per_username[username_siswa]
+            perubahan.append({'id': ortu_id, 'student_id': siswa_id})
+            perubahan.append({'id': siswa_id, 'parent_id': ortu_id})
+        db.session.execute(db.update(User), perubahan)
+        siswa_tertaut_ids = [p['id'] for p in perubahan if 'parent_id' in p]
+        for bagian in potong(siswa_tertaut_ids):
+            KodePairing.query.filter(KodePairing.siswa_id.in_(bagian)).delete(synchronize_session=False)
+    db.session.commit()
+    return hasil, len(valid)
+
+# --- RINGKASAN NOTIFIKASI ---
+# Cache LRU per user (jumlah belum dibaca + id notifikasi terbaru) agar render halaman biasa tidak
+# menjalankan range count notifikasi. Setiap entri menyimpan stempel_notifikasi saat dihitung dan hanya
+# dipakai selama stempel di database masih sama, jadi pesan baru atau tanda dibaca dari worker mana pun
+# langsung terlihat; biayanya satu query stempel per request.
+RingkasanNotifikasi = namedtuple('RingkasanNotifikasi', 'stempel belum_dibaca id_terbaru')
+_ringkasan_notifikasi = OrderedDict()
+_kunci_ringkasan_notifikasi = threading.Lock()
+
+def ambil_watermark(user_id):
+    # {kanal: dibaca_sampai_id} dalam satu query primary key
+    return dict(db.session.query(PenandaBaca.kanal, PenandaBaca.dibaca_sampai_id).filter_by(user_id=user_id).all())
+
+def kondisi_siaran(user):
+    # Kondisi penerima siaran untuk seorang siswa; None bila user tidak menerima siaran.
+    if user is None or user.peran != 'siswa':
+        return None
+    return and_(
+        NotifikasiSiaran.nama_sekolah == user.nama_sekolah,
+        or_(NotifikasiSiaran.kelas.is_(None), NotifikasiSiaran.kelas == user.kelas)
+    )
+
+def geser_watermark_baca(user_id, sampai_id, kanal='langsung'):
+    # Upsert satu baris; watermark tidak pernah mundur.
+    stmt = sqlite_insert(PenandaBaca).values(user_id=user_id, kanal=kanal, dibaca_sampai_id=sampai_id)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'kanal'],
+        set_={'dibaca_sampai_id': func.max(PenandaBaca.dibaca_sampai_id, stmt.excluded.dibaca_sampai_id)}
+    ))
+
+def migrasi_status_baca():
+    # Isi watermark dari flag sudah_dibaca lama: watermark = id belum-dibaca terkecil - 1,
+    # atau id terbesar bila semua sudah dibaca. Aman dijalankan berulang kali.
+    db.session.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_notifikasi_penerima_id ON notifikasi (penerima_id, id)"
+    ))
+    db.session.execute(text(
+        "INSERT INTO penanda_baca (user_id, kanal, dibaca_sampai_id) "
+        "SELECT penerima_id, 'langsung', "
+        "COALESCE(MIN(CASE WHEN sudah_dibaca = 0 THEN id END) - 1, MAX(id)) "
+        "FROM notifikasi GROUP BY penerima_id "
+        "ON CONFLICT (user_id, kanal) DO UPDATE SET "
+        "dibaca_sampai_id = MAX(dibaca_sampai_id, excluded.dibaca_sampai_id)"
+    ))
+    db.session.commit()
+
+def stempel_notifikasi(user):
+    # (id notifikasi langsung terbesar, id siaran terbesar, watermark kedua kanal) dalam satu query:
+    # berubah setiap ada notifikasi baru atau notifikasi ditandai dibaca. Disimpan di g selama request.
+    if has_request_context() and g.get('stempel_notifikasi', (None,))[0] == user.id:
+        return g.stempel_notifikasi[1]
+    kondisi = kondisi_siaran(user)
+    watermark = lambda kanal: db.session.query(PenandaBaca.dibaca_sampai_id).filter_by(
+        user_id=user.id, kanal=kanal).scalar_subquery()
+    kolom = [
+        db.session.query(func.max(Notifikasi.id)).filter(Notifikasi.penerima_id == user.id).scalar_subquery(),
+        db.session.query(func.max(NotifikasiSiaran.id)).filter(kondisi).scalar_subquery()
+        if kondisi is not None else db.literal(0),
+        watermark('langsung'),
+        watermark('siaran'),
+    ]
+    stempel = tuple(nilai or 0 for nilai in db.session.execute(db.select(*kolom)).one())
+    if has_request_context():
+        g.stempel_notifikasi = (user.id, stempel)
+    return stempel
+
+def hitung_ringkasan_notifikasi(user_id):
+    # Gabungan notifikasi langsung dan siaran. Masing-masing: range count berindeks di atas
+    # watermark kanalnya + N id terbaru, lalu digabung berdasarkan waktu. Stempel dibaca lebih dulu:
+    # perubahan di antara keduanya hanya membuat entri cache dihitung ulang pada request berikutnya.
+    user = db.session.get(User, user_id)
+    stempel = stempel_notifikasi(user)
+    watermark = ambil_watermark(user_id)
+    belum_dibaca = Notifikasi.query.filter(
+        Notifikasi.penerima_id == user_id,
+        Notifikasi.id > watermark.get('langsung', 0),
+        Notifikasi.sudah_dibaca.is_(False)
+    ).count()
+    terbaru = [('langsung', nid, ts) for nid, ts in db.session.query(Notifikasi.id, Notifikasi.timestamp).filter_by(
+        penerima_id=user_id
+    ).order_by(Notifikasi.timestamp.desc(), Notifikasi.id.desc()).limit(NOTIFIKASI_DROPDOWN_JUMLAH).all()]
+
+    kondisi = kondisi_siaran(user)
+    if kondisi is not None:
+        belum_dibaca += NotifikasiSiaran.query.filter(
+            kondisi, NotifikasiSiaran.id > watermark.get('siaran', 0)
         ).count()
+        terbaru += [('siaran', sid, ts) for sid, ts in db.session.query(
+            NotifikasiSiaran.id, NotifikasiSiaran.timestamp
+        ).filter(kondisi).order_by(NotifikasiSiaran.id.desc()).limit(NOTIFIKASI_DROPDOWN_JUMLAH).all()]
 
-        # Query ini untuk menampilkan 5 notifikasi TERBARU di dropdown
-        recent_notifs = Notifikasi.query.filter_by(
-            penerima_id=session['user_id']
-        ).order_by(Notifikasi.timestamp.desc()).limit(10).all()
+    terbaru.sort(key=lambda item: (item[2] or datetime.datetime.min, item[1]), reverse=True)
+    id_terbaru = tuple((kanal, nid) for kanal, nid, _ in terbaru[:NOTIFIKASI_DROPDOWN_JUMLAH])
+    ringkasan = RingkasanNotifikasi(stempel, belum_dibaca, id_terbaru)
+    with _kunci_ringkasan_notifikasi:
+        _ringkasan_notifikasi[user_id] = ringkasan
+        _ringkasan_notifikasi.move_to_end(user_id)
+        while len(_ringkasan_notifikasi) > NOTIFIKASI_CACHE_MAKS_ENTRI:
+            _ringkasan_notifikasi.popitem(last=False)
+    return ringkasan
 
+def ringkasan_notifikasi(user_id):
+    with _kunci_ringkasan_notifikasi:
+        ringkasan = _ringkasan_notifikasi.get(user_id)
+        if ringkasan is not None:
+            _ringkasan_notifikasi.move_to_end(user_id)
+    # User request ini sudah ada di identity map, jadi get() tidak menambah query
+    if ringkasan is None or ringkasan.stempel != stempel_notifikasi(db.session.get(User, user_id)):
+        ringkasan = hitung_ringkasan_notifikasi(user_id)
+    return ringkasan
+
+def hapus_cache_notifikasi(user_id=None):
+    # Tanpa user_id: kosongkan seluruh cache worker ini (dipakai setelah mengirim siaran). Stempel yang
+    # sudah dibaca request ini ikut dibuang agar render berikutnya melihat perubahannya.
+    with _kunci_ringkasan_notifikasi:
+        if user_id is None:
+            _ringkasan_notifikasi.clear()
+        else:
+            _ringkasan_notifikasi.pop(user_id, None)
+    if has_request_context():
+        g.pop('stempel_notifikasi', None)
+
+@app.context_processor
+def inject_notifications():
+    if 'user_id' in session:
+        # Hanya angka di lonceng; isi dropdown dimuat lewat /notifikasi saat lonceng dibuka
         return dict(
-            notifikasi_header=recent_notifs, # Ganti nama variabel
-            jumlah_notifikasi_belum_dibaca=unread_count
+            jumlah_notifikasi_belum_dibaca=ringkasan_notifikasi(session['user_id']).belum_dibaca,
+            push_aktif=PUSH_TAHAN_DETIK > 0,
+            pembaruan_cek_detik=0 if PUSH_TAHAN_DETIK > 0 else PEMBARUAN_CEK_DETIK
         )
     return dict()
 
+# --- INSTRUMENTASI REQUEST ---
+# Event engine mencatat setiap query ke g.instrumen milik request yang sedang berjalan; sinyal template
+# mencatat waktu render. Setelah request selesai angka-angkanya dijumlahkan per endpoint. Pernyataan SQL
+# yang sama (teks setelah bind parameter dipisah) dijalankan >= INSTRUMEN_AMBANG_N1 kali dalam satu
+# request ditandai sebagai N+1.
+MetrikEndpoint = namedtuple('MetrikEndpoint', 'request query sql_detik render_detik total_detik query_maks n1 lambat bucket')
+_metrik_endpoint = {}
+_sampel_query_lambat = deque(maxlen=INSTRUMEN_SAMPEL)
+_sampel_n1 = deque(maxlen=INSTRUMEN_SAMPEL)
+_kunci_metrik = threading.Lock()
+
+def instrumen_request():
+    return g.get('instrumen') if has_request_context() else None
+
+def mulai_query(conn, cursor, statement, parameters, context, executemany):
+    if instrumen_request() is not None:
+        conn.info.setdefault('instrumen_mulai', []).append(time.perf_counter())
+
+def selesai_query(conn, cursor, statement, parameters, context, executemany):
+    data = instrumen_request()
+    if data is None or not conn.info.get('instrumen_mulai'):
+        return
+    durasi = time.perf_counter() - conn.info['instrumen_mulai'].pop()
+    data['query'] += 1
+    data['sql_detik'] += durasi
+    data['pernyataan'][statement] += 1
+    if durasi * 1000 >= INSTRUMEN_QUERY_LAMBAT_MS:
+        data['lambat'] += 1
+        with _kunci_metrik:
+            _sampel_query_lambat.append((request.endpoint or '-', statement, repr(parameters)[:200], durasi))
+
+def mulai_render(sender, template, context, **extra):
+    data = instrumen_request()
+    if data is not None:
+        data['render_mulai'].append(time.perf_counter())
+
+def selesai_render(sender, template, context, **extra):
+    data = instrumen_request()
+    if data is not None and data['render_mulai']:
+        data['render_detik'] += time.perf_counter() - data['render_mulai'].pop()
+
+def pasang_instrumen():
+    for mesin in db.engines.values():
+        event.listen(mesin, 'before_cursor_execute', mulai_query)
+        event.listen(mesin, 'after_cursor_execute', selesai_query)
+    before_render_template.connect(mulai_render, app)
+    template_rendered.connect(selesai_render, app)
+
+def catat_metrik_request(endpoint, data, total_detik):
+    # Mengembalikan daftar pernyataan yang terdeteksi sebagai N+1 pada request ini
+    n1 = [(sql, n) for sql, n in data['pernyataan'].items() if n >= INSTRUMEN_AMBANG_N1]
+    with _kunci_metrik:
+        lama = _metrik_endpoint.get(endpoint) or MetrikEndpoint(0, 0, 0.0, 0.0, 0.0, 0, 0, 0, (0,) * len(INSTRUMEN_BUCKET_DETIK))
+        _metrik_endpoint[endpoint] = MetrikEndpoint(
+            request=lama.request + 1,
+            query=lama.query + data['query'],
+            sql_detik=lama.sql_detik + data['sql_detik'],
+            render_detik=lama.render_detik + data['render_detik'],
+            total_detik=lama.total_detik + total_detik,
+            query_maks=max(lama.query_maks, data['query']),
+            n1=lama.n1 + bool(n1),
+            lambat=lama.lambat + data['lambat'],
+            bucket=tuple(b + (total_detik <= batas) for b, batas in zip(lama.bucket, INSTRUMEN_BUCKET_DETIK)),
+        )
+        for sql, n in n1:
+            _sampel_n1.append((endpoint, sql, n))
+    return n1
+
+@app.before_request
+def mulai_instrumen():
+    if INSTRUMEN_AKTIF:
+        g.instrumen = {'mulai': time.perf_counter(), 'query': 0, 'sql_detik': 0.0, 'render_detik': 0.0,
+                       'render_mulai': [], 'lambat': 0, 'pernyataan': Counter()}
+
+@app.after_request
+def akhiri_instrumen(response):
+    data = g.pop('instrumen', None)
+    if data is None or request.endpoint == 'static':
+        return response
+    total = time.perf_counter() - data['mulai']
+    endpoint = request.endpoint or 'tidak_dikenal'
+    n1 = catat_metrik_request(endpoint, data, total)
+    for sql, n in n1:
+        app.logger.warning('Kemungkinan N+1 di %s: %d kali %s', endpoint, n, ' '.join(sql.split())[:200])
+    if INSTRUMEN_HEADER or app.debug:
+        response.headers['Server-Timing'] = (
+            f'sql;dur={data["sql_detik"] * 1000:.1f};desc="{data["query"]} query", '
+            f'render;dur={data["render_detik"] * 1000:.1f}, total;dur={total * 1000:.1f}'
+        )
+        response.headers['X-Rumi-Query'] = str(data['query'])
+        if n1:
+            response.headers['X-Rumi-N1'] = '; '.join(f'{n}x {" ".join(sql.split())[:80]}' for sql, n in n1)
+    return response
+
+def label_prometheus(nilai):
+    return str(nilai).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def metrik_prometheus():
+    # Format teks eksposisi Prometheus 0.0.4
+    with _kunci_metrik:
+        per_endpoint = sorted(_metrik_endpoint.items())
+        lambat = list(_sampel_query_lambat)
+        n1 = list(_sampel_n1)
+    baris = []
+
+    def metrik(nama, jenis, bantuan, nilai):
+        baris.append(f'# HELP {nama} {bantuan}')
+        baris.append(f'# TYPE {nama} {jenis}')
+        baris.extend(nilai)
+
+    ep = lambda e: f'endpoint="{label_prometheus(e)}"'
+    metrik('rumi_request_total', 'counter', 'Jumlah request per endpoint.',
+           [f'rumi_request_total{{{ep(e)}}} {m.request}' for e, m in per_endpoint])
+    durasi = []
+    for e, m in per_endpoint:
+        for batas, jumlah in zip(INSTRUMEN_BUCKET_DETIK, m.bucket):
+            durasi.append(f'rumi_request_durasi_detik_bucket{{{ep(e)},le="{batas}"}} {jumlah}')
+        durasi.append(f'rumi_request_durasi_detik_bucket{{{ep(e)},le="+Inf"}} {m.request}')
+        durasi.append(f'rumi_request_durasi_detik_sum{{{ep(e)}}} {m.total_detik:.6f}')
+        durasi.append(f'rumi_request_durasi_detik_count{{{ep(e)}}} {m.request}')
+    metrik('rumi_request_durasi_detik', 'histogram', 'Latensi total request.', durasi)
+    metrik('rumi_sql_query_total', 'counter', 'Jumlah query SQL.',
+           [f'rumi_sql_query_total{{{ep(e)}}} {m.query}' for e, m in per_endpoint])
+    metrik('rumi_sql_query_maks', 'gauge', 'Query terbanyak dalam satu request.',
+           [f'rumi_sql_query_maks{{{ep(e)}}} {m.query_maks}' for e, m in per_endpoint])
+    metrik('rumi_sql_detik_total', 'counter', 'Total waktu eksekusi SQL.',
+           [f'rumi_sql_detik_total{{{ep(e)}}} {m.sql_detik:.6f}' for e, m in per_endpoint])
+    metrik('rumi_render_detik_total', 'counter', 'Total waktu render template.',
+           [f'rumi_render_detik_total{{{ep(e)}}} {m.render_detik:.6f}' for e, m in per_endpoint])
+    metrik('rumi_n1_total', 'counter', 'Request dengan pernyataan SQL berulang (kemungkinan N+1).',
+           [f'rumi_n1_total{{{ep(e)}}} {m.n1}' for e, m in per_endpoint])
+    metrik('rumi_query_lambat_total', 'counter', f'Query yang berjalan >= {INSTRUMEN_QUERY_LAMBAT_MS:g} ms.',
+           [f'rumi_query_lambat_total{{{ep(e)}}} {m.lambat}' for e, m in per_endpoint])
+    metrik('rumi_fragmen_cache_total', 'counter', 'Pengambilan cache fragmen HTML.',
+           [f'rumi_fragmen_cache_total{{hasil="kena"}} {cache_fragmen.kena}',
+            f'rumi_fragmen_cache_total{{hasil="luput"}} {cache_fragmen.luput}'])
+    metrik('rumi_fragmen_cache_byte', 'gauge', 'Ukuran cache fragmen HTML.',
+           [f'rumi_fragmen_cache_byte {cache_fragmen.byte}'])
+    metrik('rumi_n1_sampel', 'gauge', 'Sampel terbaru pernyataan berulang dan jumlah eksekusinya.',
+           [f'rumi_n1_sampel{{{ep(e)},sql="{label_prometheus(" ".join(sql.split())[:300])}"}} {n}'
+            for e, sql, n in n1])
+    metrik('rumi_query_lambat_sampel_detik', 'gauge', 'Sampel terbaru query lambat beserta parameternya.',
+           [f'rumi_query_lambat_sampel_detik{{{ep(e)},sql="{label_prometheus(" ".join(sql.split())[:300])}",'
+            f'parameter="{label_prometheus(param)}"}} {d:.6f}' for e, sql, param, d in lambat])
+    return '\n'.join(baris) + '\n'
+
+if INSTRUMEN_AKTIF:
+    with app.app_context():
+        pasang_instrumen()
+
 # --- ROUTING OTENTIKASI ---
 @app.route('/')
 def index():
@@ -206,14 +2211,26 @@ def login():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
     if request.method == 'POST':
-        user = User.query.filter_by(username=request.form.get('username')).first()
-        if user and user.check_password(request.form.get('password')):
+        username = request.form.get('username', '')
+        password = request.form.get('password', '')
+        sisa = sisa_waktu_blokir_login(username)
+        if sisa:
+            flash(f'Terlalu banyak percobaan login gagal. Coba lagi dalam {(sisa + 59) // 60} menit.', 'danger')
+            return redirect(url_for('login'))
+        user = User.query.filter_by(username=username).first()
+        if user and user.check_password(password):
+            # Perbarui hash lama bila parameter hashing deployment sudah berubah
+            if perlu_hash_ulang(user.password_hash):
+                user.set_password(password)
+            hapus_login_gagal(username)
+            db.session.commit()
             session['user_id'] = user.id
             session['user_name'] = user.nama_lengkap
             session['user_role'] = user.peran
             flash(f'Selamat datang kembali, {user.nama_lengkap}!', 'success')
             return redirect(url_for('dashboard'))
         else:
+            catat_login_gagal(username)
             flash('Username atau password salah.', 'danger')
             return redirect(url_for('login'))
     return render_template('login.html')
@@ -242,11 +2259,12 @@ def register_student():
             nama_sekolah=request.form.get('sekolah'), 
             kelas=request.form.get('kelas'), 
             username=username, 
-            peran='siswa',
-            kode_pairing=generate_pairing_code()
+            peran='siswa'
         )
         new_user.set_password(request.form.get('password'))
         db.session.add(new_user)
+        db.session.flush()
+        alokasikan_kode_pairing([new_user.id])
         db.session.commit()
         flash('Akun siswa berhasil dibuat! Silakan masuk.', 'success')
         return redirect(url_for('login'))
@@ -300,27 +2318,33 @@ def register_parent():
 # --- ROUTING APLIKASI UTAMA ---
 
 @app.route('/dashboard')
-@login_required
+@login_required(muat={'orangtua': 'siswa_tertaut'})
 def dashboard():
     # Logika untuk SISWA
     if session['user_role'] == 'siswa':
-        user = User.query.get(session['user_id'])
+        user = pengguna_saat_ini()
         
         # --- LOGIKA BARU UNTUK MENGAMBIL DATA DINAMIS ---
         
-        # 1. Ambil data statistik umum
-        all_materis_query = MateriPokok.query.join(TujuanPembelajaran).filter(
-            TujuanPembelajaran.kelas_tujuan == user.kelas, 
-            MateriPokok.status == 'published'
-        )
-        all_materis = all_materis_query.order_by(TujuanPembelajaran.id, MateriPokok.id).all()
+        # 1. Ambil data statistik umum dari katalog kelas (cache per worker)
+        katalog = ambil_katalog(user.kelas)
+        all_materis = katalog.materis
         
-        selesai_konten_ids = {p.konten_id for p in user.progress}
-        selesai_materi_count = 0
-        for materi in all_materis:
-            konten_ids_materi = {k.id for k in materi.kontens}
-            if konten_ids_materi and konten_ids_materi.issubset(selesai_konten_ids):
-                selesai_materi_count += 1
+        # Ledger penguasaan: satu query berindeks untuk semua materi siswa
+        penguasaan = ambil_penguasaan(user.id)
+
+        def materi_selesai(materi):
+            p = penguasaan.get(materi.id)
+            return p is not None and p.selesai
+
+        def materi_belum_tuntas(materi):
+            return len(materi.kontens) > 0 and not materi_selesai(materi)
+
+        def hitung_progress_bar(materi):
+            p = penguasaan.get(materi.id)
+            return p.persen if p else 0
+
+        selesai_materi_count = sum(1 for materi in all_materis if materi_selesai(materi))
         
         jumlah_lencana = len(user.badges)
 
@@ -330,48 +2354,34 @@ def dashboard():
         last_progress = user.progress.order_by(ProgressSiswa.tanggal_selesai.desc()).first()
 
         if last_progress:
-            konten_terakhir = KontenBelajar.query.get(last_progress.konten_id)
-            if konten_terakhir:
-                pelajaran_saat_ini = konten_terakhir.materi
+            materi_id = katalog.materi_id_per_konten.get(last_progress.konten_id)
+            if materi_id is not None:
+                pelajaran_saat_ini = katalog.materi_by_id[materi_id]
+            else:
+                # Konten di luar katalog kelas (mis. materi sudah ditarik ke draft)
+                konten_terakhir = KontenBelajar.query.get(last_progress.konten_id)
+                if konten_terakhir:
+                    pelajaran_saat_ini = konten_terakhir.materi
         
         # Jika tidak ada progres sama sekali, coba cari materi pertama yang belum selesai
         if not pelajaran_saat_ini and all_materis:
              for materi in all_materis:
-                konten_ids_materi = {k.id for k in materi.kontens}
-                if not konten_ids_materi.issubset(selesai_konten_ids):
+                if materi_belum_tuntas(materi):
                     pelajaran_saat_ini = materi
                     break
         
         if pelajaran_saat_ini:
             # Hitung progres bar untuk materi tersebut
-            total_konten_materi = len(pelajaran_saat_ini.kontens)
-            konten_selesai_di_materi = 0
-            if total_konten_materi > 0:
-                for konten in pelajaran_saat_ini.kontens:
-                    if konten.id in selesai_konten_ids:
-                        konten_selesai_di_materi += 1
-                progress_bar = round((konten_selesai_di_materi / total_konten_materi) * 100)
+            progress_bar = hitung_progress_bar(pelajaran_saat_ini)
 
             # --- LOGIKA BARU: JIKA SUDAH 100%, CARI MATERI BERIKUTNYA ---
             if progress_bar == 100:
-                found_next = False
                 for materi in all_materis:
-                    konten_ids_materi = {k.id for k in materi.kontens}
-                    if not konten_ids_materi.issubset(selesai_konten_ids):
+                    if materi_belum_tuntas(materi):
                         pelajaran_saat_ini = materi
-                        # Hitung ulang progress bar untuk materi baru ini
-                        total_konten_materi = len(pelajaran_saat_ini.kontens)
-                        konten_selesai_di_materi = 0
-                        if total_konten_materi > 0:
-                            for konten in pelajaran_saat_ini.kontens:
-                                if konten.id in selesai_konten_ids:
-                                    konten_selesai_di_materi += 1
-                            progress_bar = round((konten_selesai_di_materi / total_konten_materi) * 100)
-                        found_next = True
+                        progress_bar = hitung_progress_bar(pelajaran_saat_ini)
                         break
-                # Jika semua materi sudah selesai
-                if not found_next:
-                    pass # Biarkan 'pelajaran_saat_ini' tetap materi terakhir yang selesai
+                # Jika semua materi sudah selesai, biarkan 'pelajaran_saat_ini' tetap materi terakhir yang selesai
 
         return render_template('dashboard.html',
                                total_materi=len(all_materis),
@@ -386,18 +2396,12 @@ def dashboard():
 
     # Logika untuk ORANG TUA
     elif session['user_role'] == 'orangtua':
-        parent = User.query.get(session['user_id'])
+        parent = pengguna_saat_ini()
         if parent.student_id:
-            student = User.query.get(parent.student_id)
-            progress_records = ProgressSiswa.query.filter_by(user_id=student.id).all()
-            selesai_konten_ids = {p.konten_id for p in progress_records}
-            all_materis = MateriPokok.query.join(TujuanPembelajaran).filter(TujuanPembelajaran.kelas_tujuan == student.kelas, MateriPokok.status == 'published').all()
-            
-            selesai_materi_count = 0
-            for materi in all_materis:
-                konten_ids_materi = {k.id for k in materi.kontens}
-                if konten_ids_materi and konten_ids_materi.issubset(selesai_konten_ids):
-                    selesai_materi_count += 1
+            student = parent.siswa
+            jumlah_konten_selesai = ProgressSiswa.query.filter_by(user_id=student.id).count()
+            total_materi = len(ambil_katalog(student.kelas).materis)
+            selesai_materi_count = hitung_materi_selesai(student.id, student.kelas)
             
             recent_progress = ProgressSiswa.query.filter_by(user_id=student.id).order_by(ProgressSiswa.tanggal_selesai.desc()).limit(5).all()
             recent_konten_ids = [p.konten_id for p in recent_progress]
@@ -410,9 +2414,9 @@ def dashboard():
 
             return render_template('dashboard.html', 
                                    student=student,
-                                   jumlah_konten_selesai=len(selesai_konten_ids),
+                                   jumlah_konten_selesai=jumlah_konten_selesai,
                                    jumlah_materi_selesai=selesai_materi_count,
-                                   total_materi_tersedia=len(all_materis),
+                                   total_materi_tersedia=total_materi,
                                    aktivitas_terbaru=aktivitas_terbaru)
         else:
             flash('Anda belum terhubung dengan akun siswa. Silakan masukkan Kode Pairing.', 'info')
@@ -423,36 +2427,162 @@ def dashboard():
 
 
 @app.route('/profil')
-@login_required
+@login_required(muat='lencana')
 def profil():
-    user = User.query.get(session['user_id'])
-    return render_template('profil.html', user=user)
+    user = pengguna_saat_ini()
+    kode_pairing = kode_pairing_aktif(user) if user.peran == 'siswa' else None
+    return render_template('profil.html', user=user, kode_pairing=kode_pairing)
 
 @app.route('/notifikasi/baca', methods=['POST'])
 @login_required
 def tandai_notifikasi_dibaca():
-    notifs = Notifikasi.query.filter_by(penerima_id=session['user_id'], sudah_dibaca=False).all()
-    for notif in notifs:
-        notif.sudah_dibaca = True
+    user_id = session['user_id']
+    id_terakhir = db.session.query(func.max(Notifikasi.id)).filter_by(penerima_id=user_id).scalar()
+    if id_terakhir:
+        geser_watermark_baca(user_id, id_terakhir)
+    kondisi = kondisi_siaran(pengguna_saat_ini())
+    if kondisi is not None:
+        siaran_terakhir = db.session.query(func.max(NotifikasiSiaran.id)).filter(kondisi).scalar()
+        if siaran_terakhir:
+            geser_watermark_baca(user_id, siaran_terakhir, kanal='siaran')
     db.session.commit()
+    hapus_cache_notifikasi(user_id)
     return jsonify({'status': 'ok'})
 
+@app.route('/notifikasi')
+@login_required
+def daftar_notifikasi():
+    # Isi dropdown lonceng, dimuat oleh main.js hanya saat dropdown dibuka.
+    user_id = session['user_id']
+    ringkasan = hitung_ringkasan_notifikasi(user_id)
+    watermark = ambil_watermark(user_id)
+    ids_per_kanal = {'langsung': [], 'siaran': []}
+    for kanal, nid in ringkasan.id_terbaru:
+        ids_per_kanal[kanal].append(nid)
+
+    item_map = {}
+    if ids_per_kanal['langsung']:
+        for n in Notifikasi.query.options(db.joinedload(Notifikasi.pengirim)).filter(
+            Notifikasi.id.in_(ids_per_kanal['langsung'])
+        ).all():
+            item_map[('langsung', n.id)] = (n, n.sudah_dibaca or n.id <= watermark.get('langsung', 0))
+    if ids_per_kanal['siaran']:
+        for n in NotifikasiSiaran.query.options(db.joinedload(NotifikasiSiaran.pengirim)).filter(
+            NotifikasiSiaran.id.in_(ids_per_kanal['siaran'])
+        ).all():
+            item_map[('siaran', n.id)] = (n, n.id <= watermark.get('siaran', 0))
+
+    notifikasi = []
+    for key in ringkasan.id_terbaru:
+        if key not in item_map:
+            continue
+        n, sudah_dibaca = item_map[key]
+        notifikasi.append({
+            'id': n.id,
+            'kanal': key[0],
+            'konten': n.konten,
+            'pengirim': n.pengirim.nama_lengkap if n.pengirim else '-',
+            'waktu': n.timestamp.strftime('%d %b %Y, %H:%M') if n.timestamp else '',
+            'sudah_dibaca': sudah_dibaca
+        })
+    return jsonify({'belum_dibaca': ringkasan.belum_dibaca, 'notifikasi': notifikasi})
+
+def stempel_pembaruan(user):
+    # Stempel murah "ada yang baru sejak X": id notifikasi langsung & siaran terbesar (stempel_notifikasi)
+    # dan jumlah konten selesai siswa (primary key StatistikSiswa).
+    max_langsung, max_siaran = stempel_notifikasi(user)[:2]
+    siswa_id = user.id if user.peran == 'siswa' else user.student_id
+    progres = 0
+    if siswa_id:
+        progres = db.session.query(StatistikSiswa.total_konten_selesai).filter_by(user_id=siswa_id).scalar() or 0
+    return f'{max_langsung}.{max_siaran}.{progres}'
+
+def peristiwa_pembaruan(user_id, stempel_lama, stempel):
+    # {event: data} untuk lonceng dan progres di antara dua stempel; kosong bila stempel lama tidak
+    # dikenal (sambungan pertama), karena halaman yang baru dimuat sudah menampilkan keadaan terkini.
+    peristiwa = {}
+    lama = stempel_lama.split('.') if stempel_lama else None
+    baru = stempel.split('.')
+    if lama and len(lama) == 3 and lama != baru:
+        if lama[:2] != baru[:2]:
+            peristiwa['notifikasi'] = {'belum_dibaca': hitung_ringkasan_notifikasi(user_id).belum_dibaca}
+        if lama[2] != baru[2]:
+            peristiwa['progres'] = {'total_konten_selesai': int(baru[2])}
+    return peristiwa
+
+def format_sse(event, data, event_id=None):
+    baris = []
+    if event_id is not None:
+        baris.append(f'id: {event_id}')
+    baris.append(f'event: {event}')
+    baris.append(f'data: {json.dumps(data)}')
+    return '\n'.join(baris) + '\n\n'
+
+@app.route('/pembaruan')
+@login_required
+def aliran_pembaruan():
+    # Server-sent events untuk lonceng notifikasi dan progres, tanpa broker eksternal.
+    # EventSource mengirim stempel terakhir lewat Last-Event-ID saat tersambung ulang.
+    user_id = session['user_id']
+    sejak = request.headers.get('Last-Event-ID') or request.args.get('sejak') or ''
+
+    def generate():
+        stempel_lama = sejak
+        batas = time.monotonic() + PUSH_TAHAN_DETIK
+        yield f'retry: {PUSH_RETRY_MS}\n\n'
+        while True:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return
+            stempel = stempel_pembaruan(user)
+            if stempel != stempel_lama:
+                for nama, data in peristiwa_pembaruan(user_id, stempel_lama, stempel).items():
+                    yield format_sse(nama, data)
+                yield format_sse('stempel', {'stempel': stempel}, event_id=stempel)
+                stempel_lama = stempel
+            # Lepaskan transaksi baca SQLite selama menunggu pengecekan berikutnya, dan baca ulang
+            # stempel notifikasi (bukan dari g) pada pengecekan berikutnya
+            db.session.rollback()
+            g.pop('stempel_notifikasi', None)
+            if time.monotonic() >= batas:
+                return
+            time.sleep(PUSH_INTERVAL_DETIK)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/pembaruan/cek')
+@login_required
+def cek_pembaruan():
+    # Pengganti kanal push untuk worker sync: satu pengecekan stempel yang langsung dijawab, berisi
+    # peristiwa yang sama dengan /pembaruan sejak stempel `sejak` milik browser.
+    user = pengguna_saat_ini()
+    stempel = stempel_pembaruan(user)
+    data = peristiwa_pembaruan(user.id, request.args.get('sejak', ''), stempel)
+    data['stempel'] = stempel
+    respons = jsonify(data)
+    respons.headers['Cache-Control'] = 'no-store'
+    return respons
+
 @app.route('/parent-access', methods=['GET', 'POST'])
 @login_required
 @role_required('orangtua')
 def parent_access():
-    parent = User.query.get(session['user_id'])
+    parent = pengguna_saat_ini()
     if parent.student_id:
         flash('Akun Anda sudah terhubung dengan seorang siswa.', 'info')
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
         kode = request.form.get('unique_code')
-        student = User.query.filter_by(kode_pairing=kode, peran='siswa').first()
-        if student:
+        kode_pairing = db.session.get(KodePairing, (kode or '').strip().upper())
+        if kode_pairing and kode_pairing.kedaluwarsa <= waktu_utc_sekarang():
+            flash('Kode Pairing sudah kedaluwarsa. Minta siswa membuka halaman profil untuk mendapatkan kode baru.', 'danger')
+        elif kode_pairing and kode_pairing.siswa.peran == 'siswa':
+            student = kode_pairing.siswa
             parent.student_id = student.id
             student.parent_id = parent.id
-            student.kode_pairing = None
+            db.session.delete(kode_pairing)
             db.session.commit()
             flash('Akun berhasil terhubung dengan siswa!', 'success')
             return redirect(url_for('dashboard'))
@@ -502,6 +2632,7 @@ def edit_tp(tp_id):
     if request.method == 'POST':
         tp.deskripsi = request.form.get('deskripsi')
         tp.kelas_tujuan = request.form.get('kelas_tujuan')
+        naikkan_versi_katalog()
         db.session.commit()
         flash('Tujuan Pembelajaran berhasil diperbarui!', 'success')
         return redirect(url_for('studio'))
@@ -516,7 +2647,10 @@ def hapus_tp(tp_id):
         flash('Akses ditolak.', 'danger')
         return redirect(url_for('studio'))
 
+    # Ledger penguasaan ikut terhapus bersama materinya; statistik siswa dikurangi lebih dulu
+    kurangi_statistik_konten_terhapus(db.session.query(KontenBelajar.id).join(MateriPokok).filter(MateriPokok.tp_id == tp.id))
     db.session.delete(tp)
+    naikkan_versi_katalog()
     db.session.commit()
     flash('Tujuan Pembelajaran berhasil dihapus.', 'success')
     return redirect(url_for('studio'))
@@ -545,6 +2679,7 @@ def buat_materi(tp_id):
             materi_pokok_id=new_materi.id
         )
         db.session.add(new_badge)
+        naikkan_versi_katalog()
         db.session.commit()
 
         flash('Materi Pokok baru berhasil ditambahkan!', 'success')
@@ -563,6 +2698,7 @@ def edit_materi(materi_id):
     if request.method == 'POST':
         materi.judul = request.form['judul']
         materi.deskripsi = request.form['deskripsi']
+        naikkan_versi_katalog()
         db.session.commit()
         flash('Materi Pokok berhasil diperbarui.', 'success')
         return redirect(url_for('detail_tp', tp_id=materi.tp_id))
@@ -583,8 +2719,11 @@ def hapus_materi(materi_id):
         flash('Akses ditolak.', 'danger')
         return redirect(url_for('studio'))
 
-    # Hapus materi (ini juga akan otomatis menghapus semua konten & badge terkait berkat 'cascade')
+    # Hapus materi (ini juga akan otomatis menghapus semua konten, progres, ledger & badge terkait berkat 'cascade').
+    # StatistikSiswa tidak ikut cascade, jadi totalnya dikurangi dulu di transaksi yang sama.
+    kurangi_statistik_konten_terhapus(db.session.query(KontenBelajar.id).filter_by(materi_id=materi.id))
     db.session.delete(materi)
+    naikkan_versi_katalog()
     db.session.commit()
     
     flash('Materi Pokok berhasil dihapus.', 'success')
@@ -599,7 +2738,10 @@ def publish_materi(materi_id):
         flash('Akses ditolak.', 'danger')
         return redirect(url_for('studio'))
     
+    # Ledger penguasaan tidak perlu disentuh: hitungannya tidak bergantung pada status,
+    # dan dashboard memfilter status 'published' saat membaca.
     materi.status = 'published' if materi.status == 'draft' else 'draft'
+    naikkan_versi_katalog()
     db.session.commit()
     flash(f'Status materi "{materi.judul}" berhasil diubah.', 'success')
     return redirect(url_for('detail_tp', tp_id=materi.tp_id))
@@ -622,6 +2764,8 @@ def kelola_konten(materi_id):
             materi_id=materi.id
         )
         db.session.add(new_konten)
+        sesuaikan_total_konten(materi.id, new_konten.alur, 1)
+        naikkan_versi_katalog()
         db.session.commit()
         flash('Konten baru berhasil ditambahkan!', 'success')
         return redirect(url_for('kelola_konten', materi_id=materi.id))
@@ -640,9 +2784,12 @@ def edit_konten(konten_id):
 
     if request.method == 'POST':
         konten.judul = request.form['judul']
+        if request.form['alur'] != konten.alur:
+            pindahkan_alur_konten(konten.id, materi.id, konten.alur, request.form['alur'])
         konten.alur = request.form['alur']
         konten.tipe = request.form['tipe']
         konten.sumber_url = request.form['sumber_url']
+        naikkan_versi_katalog()
         db.session.commit()
         flash('Konten berhasil diperbarui.', 'success')
         return redirect(url_for('kelola_konten', materi_id=materi.id))
@@ -659,7 +2806,18 @@ def hapus_konten(konten_id):
         flash('Akses ditolak.', 'danger')
         return redirect(url_for('studio'))
     
+    # Siswa yang sudah menyelesaikan konten ini kehilangan satu hitungan selesai pada ledger
+    penyelesai = db.session.query(ProgressSiswa.user_id).filter_by(konten_id=konten.id)
+    PenguasaanMateri.query.filter(
+        PenguasaanMateri.materi_id == materi_id, PenguasaanMateri.user_id.in_(penyelesai)
+    ).update({PenguasaanMateri.konten_selesai: PenguasaanMateri.konten_selesai - 1}, synchronize_session=False)
+    PenguasaanAlur.query.filter(
+        PenguasaanAlur.materi_id == materi_id, PenguasaanAlur.alur == konten.alur, PenguasaanAlur.user_id.in_(penyelesai)
+    ).update({PenguasaanAlur.konten_selesai: PenguasaanAlur.konten_selesai - 1}, synchronize_session=False)
+    sesuaikan_total_konten(materi_id, konten.alur, -1)
+    kurangi_statistik_konten_terhapus([konten.id])
     db.session.delete(konten)
+    naikkan_versi_katalog()
     db.session.commit()
     flash('Konten berhasil dihapus.', 'success')
     return redirect(url_for('kelola_konten', materi_id=materi_id))
@@ -668,45 +2826,98 @@ def hapus_konten(konten_id):
 @login_required
 @role_required('guru')
 def monitoring_siswa():
-    guru = User.query.get(session['user_id'])
-    
-    # Ambil semua siswa dari sekolah yang sama dengan guru
-    daftar_siswa = User.query.filter_by(peran='siswa', nama_sekolah=guru.nama_sekolah).order_by(User.kelas, User.nama_lengkap).all()
+    guru = pengguna_saat_ini()
+    kelas_filter = request.args.get('kelas', '')
+    kursor = decode_kursor(request.args.get('setelah'), KURSOR_MONITORING)
     
+    # Ambil satu halaman siswa dari sekolah yang sama dengan guru (keyset pada kelas, nama, id)
+    query = User.query.filter(
+        User.peran == 'siswa',
+        User.nama_sekolah == guru.nama_sekolah,
+        User.kelas.isnot(None)
+    )
+    if kelas_filter:
+        query = query.filter(User.kelas == kelas_filter)
+    if kursor:
+        query = query.filter(tuple_(User.kelas, User.nama_lengkap, User.id) > tuple_(*kursor))
+    daftar_siswa = query.order_by(User.kelas, User.nama_lengkap, User.id).limit(MONITORING_PER_HALAMAN + 1).all()
+
+    kursor_berikutnya = None
+    if len(daftar_siswa) > MONITORING_PER_HALAMAN:
+        daftar_siswa = daftar_siswa[:MONITORING_PER_HALAMAN]
+        terakhir = daftar_siswa[-1]
+        kursor_berikutnya = encode_kursor([terakhir.kelas, terakhir.nama_lengkap, terakhir.id])
+    siswa_ids = [siswa.id for siswa in daftar_siswa]
+
+    # Total materi terpublikasi per kelas, materi tuntas dan lencana per siswa: masing-masing satu query
+    total_per_kelas = {}
+    selesai_per_siswa = {}
+    lencana_per_siswa = {}
+    if siswa_ids:
+        total_per_kelas = dict(db.session.query(
+            TujuanPembelajaran.kelas_tujuan, func.count(MateriPokok.id)
+        ).join(MateriPokok).filter(
+            MateriPokok.status == 'published',
+            TujuanPembelajaran.kelas_tujuan.in_({siswa.kelas for siswa in daftar_siswa})
+        ).group_by(TujuanPembelajaran.kelas_tujuan).all())
+        selesai_per_siswa = dict(db.session.query(
+            PenguasaanMateri.user_id, func.count(PenguasaanMateri.id)
+        ).join(MateriPokok, MateriPokok.id == PenguasaanMateri.materi_id).join(TujuanPembelajaran).join(
+            User, User.id == PenguasaanMateri.user_id
+        ).filter(
+            PenguasaanMateri.user_id.in_(siswa_ids),
+            TujuanPembelajaran.kelas_tujuan == User.kelas,
+            MateriPokok.status == 'published',
+            PenguasaanMateri.total_konten > 0,
+            PenguasaanMateri.konten_selesai >= PenguasaanMateri.total_konten
+        ).group_by(PenguasaanMateri.user_id).all())
+        lencana_per_siswa = dict(db.session.query(
+            UserBadge.user_id, func.count(UserBadge.id)
+        ).filter(UserBadge.user_id.in_(siswa_ids)).group_by(UserBadge.user_id).all())
+
     data_progres = []
     for siswa in daftar_siswa:
-        # Query semua materi yang tersedia untuk kelas siswa
-        all_materis = MateriPokok.query.join(TujuanPembelajaran).filter(
-            TujuanPembelajaran.kelas_tujuan == siswa.kelas,
-            MateriPokok.status == 'published'
-        ).all()
-        
-        # Hitung materi yang selesai
-        selesai_konten_ids = {p.konten_id for p in siswa.progress}
-        selesai_materi_count = 0
-        for materi in all_materis:
-            konten_ids_materi = {k.id for k in materi.kontens}
-            if konten_ids_materi and konten_ids_materi.issubset(selesai_konten_ids):
-                selesai_materi_count += 1
-        
         data_progres.append({
             'siswa': siswa,
-            'selesai_materi': selesai_materi_count,
-            'total_materi': len(all_materis),
-            'jumlah_lencana': len(siswa.badges)
+            'selesai_materi': selesai_per_siswa.get(siswa.id, 0),
+            'total_materi': total_per_kelas.get(int(siswa.kelas), 0) if siswa.kelas.isdigit() else 0,
+            'jumlah_lencana': lencana_per_siswa.get(siswa.id, 0)
         })
 
-    return render_template('monitoring_siswa.html', data_progres=data_progres)
+    return render_template('monitoring_siswa.html',
+                           data_progres=data_progres,
+                           kelas_filter=kelas_filter,
+                           kursor_berikutnya=kursor_berikutnya,
+                           halaman_pertama=kursor is None,
+                           ekspor_xlsx=openpyxl is not None)
+
+@app.route('/monitoring-siswa/siaran', methods=['POST'])
+@login_required
+@role_required('guru')
+def kirim_siaran():
+    # Satu baris untuk seluruh kelas/sekolah; penerima diselesaikan saat notifikasi dibaca.
+    guru = pengguna_saat_ini()
+    konten = (request.form.get('konten') or '').strip()
+    kelas = request.form.get('kelas') or None
+    if not konten:
+        flash('Isi pesan tidak boleh kosong.', 'danger')
+    else:
+        db.session.add(NotifikasiSiaran(pengirim_id=guru.id, nama_sekolah=guru.nama_sekolah, kelas=kelas,
+                                        konten=konten, timestamp=waktu_utc_sekarang()))
+        db.session.commit()
+        hapus_cache_notifikasi()
+        sasaran = f'kelas {kelas}' if kelas else 'seluruh sekolah'
+        flash(f'Pengumuman berhasil dikirim ke {sasaran}!', 'success')
+    return redirect(url_for('monitoring_siswa', kelas=kelas))
 
 @app.route('/monitoring-siswa/<int:siswa_id>', methods=['GET', 'POST']) # Tambahkan methods
 @login_required
 @role_required('guru')
 def detail_siswa(siswa_id):
-    siswa = User.query.get_or_404(siswa_id)
-    guru = User.query.get(session['user_id'])
+    siswa = db.get_or_404(User, siswa_id, options=PROFIL_MUAT_PENGGUNA['lencana']())
+    guru = pengguna_saat_ini()
     
     # Otorisasi: Pastikan siswa dari sekolah yang sama
-    guru = User.query.get(session['user_id'])
     if siswa.nama_sekolah != guru.nama_sekolah:
         flash('Akses ditolak.', 'danger')
         return redirect(url_for('monitoring_siswa'))
@@ -718,30 +2929,30 @@ def detail_siswa(siswa_id):
             new_notif = Notifikasi(
                 pengirim_id=guru.id,
                 penerima_id=siswa.id,
-                konten=konten_notif
+                konten=konten_notif,
+                timestamp=waktu_utc_sekarang()
             )
             db.session.add(new_notif)
             db.session.commit()
+            hapus_cache_notifikasi(siswa.id)
             flash('Notifikasi berhasil dikirim!', 'success')
         else:
             flash('Isi pesan tidak boleh kosong.', 'danger')
         return redirect(url_for('detail_siswa', siswa_id=siswa_id))
 
     # Ambil semua materi yang tersedia untuk kelas siswa
-    all_materis = MateriPokok.query.join(TujuanPembelajaran).filter(
-        TujuanPembelajaran.kelas_tujuan == siswa.kelas,
-        MateriPokok.status == 'published'
-    ).order_by(MateriPokok.id).all()
+    all_materis = sorted(ambil_katalog(siswa.kelas).materis, key=lambda m: m.id)
     
     # Dapatkan ID konten yang sudah selesai
-    selesai_konten_ids = {p.konten_id for p in siswa.progress}
+    selesai_konten_ids = {k for (k,) in db.session.query(ProgressSiswa.konten_id).filter_by(user_id=siswa.id)}
     
-    # Pisahkan materi yang sudah selesai dan yang belum
+    # Pisahkan materi yang sudah selesai dan yang belum berdasarkan ledger penguasaan
+    penguasaan = ambil_penguasaan(siswa.id)
     materi_selesai = []
     materi_belum_selesai = []
     for materi in all_materis:
-        konten_ids_materi = {k.id for k in materi.kontens}
-        if konten_ids_materi and konten_ids_materi.issubset(selesai_konten_ids):
+        p = penguasaan.get(materi.id)
+        if p is not None and p.selesai:
             materi_selesai.append(materi)
         else:
             materi_belum_selesai.append(materi)
@@ -752,24 +2963,175 @@ def detail_siswa(siswa_id):
                            materi_belum_selesai=materi_belum_selesai,
                            selesai_konten_ids=selesai_konten_ids)
 
+def format_waktu_ekspor(waktu):
+    return waktu.strftime(EKSPOR_FORMAT_WAKTU) if waktu else ''
+
+def baris_ekspor_progres(nama_sekolah, kelas_filter=None):
+    # Matriks siswa x materi: baris pertama header, lalu satu baris per siswa. Sel berisi waktu tuntas
+    # (penyelesaian konten terakhir), "selesai/total" bila baru sebagian, atau kosong. Siswa dibaca per
+    # potongan dengan keyset (kelas, nama, id); progres dan lencana tiap potongan masing-masing satu query
+    # agregat, sehingga memori hanya sebesar satu potongan berapa pun jumlah siswa dan materinya.
+    if kelas_filter:
+        daftar_kelas = [kelas_filter]
+    else:
+        daftar_kelas = sorted(k for (k,) in db.session.query(User.kelas).filter(
+            User.peran == 'siswa', User.nama_sekolah == nama_sekolah, User.kelas.isnot(None)
+        ).distinct())
+    # Kolom materi per kelas bersebelahan; sel materi kelas lain dibiarkan kosong
+    rentang_kelas = {}
+    judul_kolom = []
+    for kelas in daftar_kelas:
+        materis = ambil_katalog(kelas).materis
+        rentang_kelas[kelas] = (len(judul_kolom), materis)
+        judul_kolom.extend(f'Kelas {kelas}: {m.judul}' if len(daftar_kelas) > 1 else m.judul for m in materis)
+    yield ['ID', 'Nama Siswa', 'Username', 'Kelas', 'Materi Tuntas'] + judul_kolom + ['Lencana']
+
+    kursor = None
+    while True:
+        query = db.session.query(User.id, User.nama_lengkap, User.username, User.kelas).filter(
+            User.peran == 'siswa',
+            User.nama_sekolah == nama_sekolah,
+            User.kelas.isnot(None)
+        )
+        if kelas_filter:
+            query = query.filter(User.kelas == kelas_filter)
+        if kursor:
+            query = query.filter(tuple_(User.kelas, User.nama_lengkap, User.id) > tuple_(*kursor))
+        daftar_siswa = query.order_by(User.kelas, User.nama_lengkap, User.id).limit(EKSPOR_SISWA_PER_POTONGAN).all()
+        if not daftar_siswa:
+            return
+        siswa_ids = [siswa.id for siswa in daftar_siswa]
+
+        progres = {(user_id, materi_id): (jumlah, terakhir) for user_id, materi_id, jumlah, terakhir in db.session.query(
+            ProgressSiswa.user_id, KontenBelajar.materi_id, func.count(ProgressSiswa.id), func.max(ProgressSiswa.tanggal_selesai)
+        ).join(KontenBelajar, KontenBelajar.id == ProgressSiswa.konten_id).filter(
+            ProgressSiswa.user_id.in_(siswa_ids)
+        ).group_by(ProgressSiswa.user_id, KontenBelajar.materi_id)}
+        lencana = {}
+        for user_id, nama, tanggal in db.session.query(UserBadge.user_id, Badge.nama, UserBadge.tanggal_dapat).join(Badge).filter(
+            UserBadge.user_id.in_(siswa_ids)
+        ).order_by(UserBadge.user_id, UserBadge.tanggal_dapat):
+            lencana.setdefault(user_id, []).append(f'{nama} ({format_waktu_ekspor(tanggal)})')
+        # Lepaskan transaksi baca SQLite selama potongan ini dikirim ke klien
+        db.session.rollback()
+
+        for siswa in daftar_siswa:
+            sel = [''] * len(judul_kolom)
+            awal, materis = rentang_kelas.get(siswa.kelas, (0, ()))
+            tuntas = 0
+            for i, materi in enumerate(materis):
+                jumlah, terakhir = progres.get((siswa.id, materi.id), (0, None))
+                if materi.kontens and jumlah >= len(materi.kontens):
+                    sel[awal + i] = format_waktu_ekspor(terakhir)
+                    tuntas += 1
+                elif jumlah:
+                    sel[awal + i] = f'{jumlah}/{len(materi.kontens)}'
+            yield [siswa.id, siswa.nama_lengkap, siswa.username, siswa.kelas, f'{tuntas}/{len(materis)}'] + sel + [
+                '; '.join(lencana.get(siswa.id, ()))]
+        kursor = (daftar_siswa[-1].kelas, daftar_siswa[-1].nama_lengkap, daftar_siswa[-1].id)
+
+# Nama, username dan judul materi diisi pengguna (siswa mendaftar sendiri). Sel teks yang diawali karakter
+# ini akan dijalankan sebagai rumus oleh Excel/LibreOffice, jadi diberi awalan ' agar tetap dibaca sebagai teks.
+AWALAN_RUMUS = ('=', '+', '-', '@', '\t', '\r')
+
+def amankan_sel(nilai):
+    if isinstance(nilai, str) and nilai.startswith(AWALAN_RUMUS):
+        return "'" + nilai
+    return nilai
+
+def aliran_csv(baris):
+    # BOM agar Excel membaca UTF-8; baris dikumpulkan per blok supaya tidak ada satu write per sel
+    buffer = io.StringIO()
+    penulis = csv.writer(buffer)
+    yield '\ufeff'
+    for b in baris:
+        penulis.writerow([amankan_sel(sel) for sel in b])
+        if buffer.tell() >= EKSPOR_BLOK_BYTE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def berkas_xlsx(baris, judul_lembar):
+    # Mode write_only menulis baris langsung ke berkas sementara milik openpyxl. Arsip XLSX baru lengkap
+    # setelah baris terakhir, jadi hasilnya dikirim sesudah selesai dibangun, bukan dialirkan.
+    buku = openpyxl.Workbook(write_only=True)
+    lembar = buku.create_sheet(judul_lembar)
+    for b in baris:
+        lembar.append([amankan_sel(sel) for sel in b])
+    berkas = tempfile.TemporaryFile()
+    buku.save(berkas)
+    berkas.seek(0)
+    return berkas
+
+@app.route('/monitoring-siswa/ekspor')
+@login_required
+@role_required('guru')
+def ekspor_progres():
+    guru = pengguna_saat_ini()
+    kelas = request.args.get('kelas') or None
+    format_berkas = request.args.get('format', 'csv')
+    if format_berkas not in ('csv', 'xlsx'):
+        abort(400)
+    sasaran = f'kelas-{kelas}' if kelas else 'semua-kelas'
+    nama_berkas = secure_filename(f"progres-{guru.nama_sekolah}-{sasaran}-{waktu_utc_sekarang():%Y%m%d}") or 'progres'
+    baris = baris_ekspor_progres(guru.nama_sekolah, kelas)
+
+    if format_berkas == 'xlsx':
+        if openpyxl is None:
+            flash('Ekspor XLSX membutuhkan paket openpyxl. Gunakan ekspor CSV atau pasang openpyxl.', 'danger')
+            return redirect(url_for('monitoring_siswa', kelas=kelas))
+        return send_file(berkas_xlsx(baris, 'Progres'), as_attachment=True, download_name=f'{nama_berkas}.xlsx',
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    return Response(stream_with_context(aliran_csv(baris)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{nama_berkas}.csv"',
+                             'X-Accel-Buffering': 'no'})
+
 # --- ROUTING POJOK BACA ---
 @app.route('/pojok-baca')
 @login_required
 def pojok_baca():
-    # Ambil kata kunci pencarian dari URL, jika ada
-    search_query = request.args.get('q', '')
-    
-    # Mulai query dasar
-    query = PojokBaca.query
+    # Ambil kata kunci pencarian, filter kategori dan halaman dari URL, jika ada
+    search_query = request.args.get('q', '').strip()
+    kategori = request.args.get('kategori', '')
+    halaman = max(request.args.get('halaman', 1, type=int), 1)
+    offset = (halaman - 1) * POJOK_BACA_PER_HALAMAN
 
-    # Jika ada kata kunci, filter hasilnya
-    if search_query:
-        query = query.filter(PojokBaca.judul.ilike(f'%{search_query}%'))
-    
-    # Eksekusi query akhir
-    semua_bacaan = query.order_by(PojokBaca.judul).all()
-    
-    return render_template('pojok_baca.html', semua_bacaan=semua_bacaan, search_query=search_query)
+    def render():
+        if buat_query_fts(search_query):
+            # Pencarian teks penuh, diurutkan berdasarkan relevansi (bm25)
+            semua_bacaan, total, facet = cari_bacaan(search_query, kategori or None, offset=offset)
+        else:
+            query = PojokBaca.query
+            if kategori:
+                query = query.filter_by(kategori=kategori)
+            total = query.count()
+            semua_bacaan = query.order_by(PojokBaca.judul).limit(POJOK_BACA_PER_HALAMAN).offset(offset).all()
+            facet = dict(db.session.query(PojokBaca.kategori, func.count(PojokBaca.id)).group_by(PojokBaca.kategori).all())
+
+        jumlah_halaman = max((total + POJOK_BACA_PER_HALAMAN - 1) // POJOK_BACA_PER_HALAMAN, 1)
+        return render_template('pojok_baca.html',
+                               semua_bacaan=semua_bacaan,
+                               search_query=search_query,
+                               kategori=kategori,
+                               facet=sorted(((k, n) for k, n in facet.items() if k), key=lambda item: (-item[1], item[0])),
+                               total=total,
+                               halaman=halaman,
+                               jumlah_halaman=jumlah_halaman)
+
+    # Parameter pencarian tidak perlu masuk ETag karena ETag berlaku per URL
+    jumlah, terakhir_diubah = stempel_pojok_baca()
+    return jawab_bersyarat(('pojok_baca', jumlah, terakhir_diubah), terakhir_diubah, render)
+
+@app.route('/pojok-baca/saran')
+@login_required
+def saran_pojok_baca():
+    # Saran judul untuk pencarian sambil mengetik (dipanggil main.js dengan debounce)
+    search_query = request.args.get('q', '').strip()
+    if not buat_query_fts(search_query):
+        return jsonify({'saran': []})
+    hasil, _, _ = cari_bacaan(search_query, limit=POJOK_BACA_SARAN_JUMLAH)
+    return jsonify({'saran': [b.judul for b in hasil]})
 
 @app.route('/studio/pojok-baca/kelola')
 @login_required
@@ -790,7 +3152,10 @@ def tambah_bacaan():
             url_sampul=request.form['url_sampul'],
             url_konten=request.form['url_konten']
         )
+        siapkan_fts_pojok_baca()
         db.session.add(new_bacaan)
+        db.session.flush()
+        fts_tambah_bacaan(new_bacaan)
         db.session.commit()
         flash('Materi bacaan baru berhasil ditambahkan!', 'success')
         return redirect(url_for('kelola_pojok_baca'))
@@ -802,11 +3167,14 @@ def tambah_bacaan():
 def edit_bacaan(bacaan_id):
     bacaan = PojokBaca.query.get_or_404(bacaan_id)
     if request.method == 'POST':
+        siapkan_fts_pojok_baca()
+        fts_hapus_bacaan(bacaan.id, bacaan.judul, bacaan.deskripsi, bacaan.kategori)
         bacaan.judul = request.form['judul']
         bacaan.deskripsi = request.form['deskripsi']
         bacaan.kategori = request.form['kategori']
         bacaan.url_sampul = request.form['url_sampul']
         bacaan.url_konten = request.form['url_konten']
+        fts_tambah_bacaan(bacaan)
         db.session.commit()
         flash('Materi bacaan berhasil diperbarui!', 'success')
         return redirect(url_for('kelola_pojok_baca'))
@@ -817,6 +3185,8 @@ def edit_bacaan(bacaan_id):
 @role_required('guru')
 def hapus_bacaan(bacaan_id):
     bacaan = PojokBaca.query.get_or_404(bacaan_id)
+    siapkan_fts_pojok_baca()
+    fts_hapus_bacaan(bacaan.id, bacaan.judul, bacaan.deskripsi, bacaan.kategori)
     db.session.delete(bacaan)
     db.session.commit()
     flash('Materi bacaan berhasil dihapus.', 'success')
@@ -827,59 +3197,212 @@ def hapus_bacaan(bacaan_id):
 @login_required
 @role_required('siswa')
 def jalur_belajar():
-    user = User.query.get(session['user_id'])
-    tps_tersedia = TujuanPembelajaran.query.filter(
-        TujuanPembelajaran.kelas_tujuan == user.kelas,
-        TujuanPembelajaran.materis.any(MateriPokok.status == 'published')
-    ).all()
-    return render_template('jalur_belajar.html', tps=tps_tersedia)
+    user = pengguna_saat_ini()
+    # Katalog hanya memuat TP yang memiliki materi terpublikasi; HTML-nya dirender sekali per kelas
+    katalog = ambil_katalog(user.kelas)
+    return jawab_bersyarat(('jalur', katalog.kelas, katalog.versi), katalog.diperbarui, lambda: render_template(
+        'jalur_belajar.html', isi=Markup(fragmen_jalur_belajar(katalog))
+    ))
 
 @app.route('/materi/<int:materi_id>')
 @login_required
 @role_required('siswa')
 def materi_detail(materi_id):
-    materi = MateriPokok.query.get_or_404(materi_id)
-    user = User.query.get(session['user_id'])
-    if materi.status != 'published' or str(materi.tp.kelas_tujuan) != user.kelas:
+    user = pengguna_saat_ini()
+    katalog = ambil_katalog(user.kelas)
+    materi = katalog.materi_by_id.get(materi_id)
+    if materi is None:
+        if db.session.get(MateriPokok, materi_id) is None:
+            abort(404)
         flash('Materi ini tidak tersedia untuk Anda.', 'danger')
         return redirect(url_for('jalur_belajar'))
     
-    progress_records = ProgressSiswa.query.filter_by(user_id=user.id).all()
-    selesai_konten_ids = {p.konten_id for p in progress_records}
-    konten_memahami = [k for k in materi.kontens if k.alur == 'memahami']
-    konten_mengaplikasi = [k for k in materi.kontens if k.alur == 'mengaplikasi']
-    konten_merefleksi = [k for k in materi.kontens if k.alur == 'merefleksi']
-    
-    memahami_selesai = bool(konten_memahami) and all(k.id in selesai_konten_ids for k in konten_memahami)
-    mengaplikasi_selesai = bool(konten_mengaplikasi) and all(k.id in selesai_konten_ids for k in konten_mengaplikasi)
-    merefleksi_selesai = bool(konten_merefleksi) and all(k.id in selesai_konten_ids for k in konten_merefleksi)
-
-    return render_template('materi_detail.html', 
-                            materi=materi, 
-                            konten_memahami=konten_memahami,
-                            konten_mengaplikasi=konten_mengaplikasi,
-                            konten_merefleksi=konten_merefleksi,
-                            selesai_konten_ids=selesai_konten_ids,
-                            memahami_selesai=memahami_selesai,
-                            mengaplikasi_selesai=mengaplikasi_selesai,
-                            merefleksi_selesai=merefleksi_selesai)
+    jumlah_selesai, progres_diperbarui = stempel_progres(user.id)
+
+    def render():
+        selesai_konten_ids = {k for (k,) in db.session.query(ProgressSiswa.konten_id).filter(
+            ProgressSiswa.user_id == user.id,
+            ProgressSiswa.konten_id.in_([k.id for k in materi.kontens])
+        )}
+        # Fragmen bersama per materi, lalu centang dan kunci tahap milik siswa ini diisi lewat overlay
+        isi = terapkan_overlay_materi(fragmen_materi_detail(materi, katalog.versi), materi, selesai_konten_ids)
+        return render_template('materi_detail.html', materi=materi, isi=isi)
+
+    terakhir_diubah = max((w for w in (materi.diperbarui, progres_diperbarui) if w), default=None)
+    return jawab_bersyarat(('materi', materi.id, katalog.versi, jumlah_selesai), terakhir_diubah, render)
+
+def catat_penyelesaian(user_id, daftar):
+    # daftar: [(konten_id, waktu_selesai)]. Semua penyelesaian ditulis dalam satu transaksi dengan
+    # INSERT OR IGNORE terhadap _user_konten_uc, lalu ledger, statistik dan lencana diperbarui sekali.
+    waktu_per_konten = {}
+    for konten_id, waktu in daftar:
+        if konten_id not in waktu_per_konten or waktu < waktu_per_konten[konten_id]:
+            waktu_per_konten[konten_id] = waktu
+    posisi_konten = {konten_id: (materi_id, alur) for konten_id, materi_id, alur in db.session.query(
+        KontenBelajar.id, KontenBelajar.materi_id, KontenBelajar.alur
+    ).filter(KontenBelajar.id.in_(waktu_per_konten.keys()))} if waktu_per_konten else {}
+    materi_per_konten = {konten_id: materi_id for konten_id, (materi_id, _) in posisi_konten.items()}
+
+    baru = []
+    if materi_per_konten:
+        stmt = sqlite_insert(ProgressSiswa).values([
+            {'user_id': user_id, 'konten_id': konten_id, 'tanggal_selesai': waktu_per_konten[konten_id]}
+            for konten_id in materi_per_konten
+        ]).on_conflict_do_nothing().returning(ProgressSiswa.konten_id)
+        baru = [row[0] for row in db.session.execute(stmt)]
+
+    lencana_baru = []
+    if baru:
+        per_materi = Counter(materi_per_konten[k] for k in baru)
+        for materi_id, jumlah in per_materi.items():
+            perbarui_penguasaan(user_id, materi_id, jumlah)
+        for (materi_id, alur), jumlah in Counter(posisi_konten[k] for k in baru).items():
+            perbarui_penguasaan_alur(user_id, materi_id, alur, jumlah)
+        statistik = perbarui_statistik(user_id, [waktu_per_konten[k] for k in baru])
+        lencana_baru = evaluasi_lencana(user_id, baru, statistik)
+    db.session.commit()
+
+    return {
+        'baru': baru,
+        'diabaikan': [k for k in waktu_per_konten if k not in baru],
+        'materi_ids': sorted(set(materi_per_konten.values())),
+        'lencana_baru': lencana_baru
+    }
+
+def parse_waktu_klien(nilai, sekarang):
+    # Menerima ISO 8601 atau epoch milidetik dari klien; dibatasi agar tidak di masa depan
+    # atau terlalu lama (antrean offline maksimal SINKRON_MAKS_UMUR_HARI).
+    waktu = None
+    try:
+        if isinstance(nilai, (int, float)):
+            waktu = datetime.datetime.fromtimestamp(nilai / 1000, datetime.timezone.utc)
+        elif isinstance(nilai, str):
+            waktu = datetime.datetime.fromisoformat(nilai.replace('Z', '+00:00'))
+    except (ValueError, OverflowError, OSError):
+        waktu = None
+    if waktu is None:
+        return sekarang
+    if waktu.tzinfo is not None:
+        waktu = waktu.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    batas_bawah = sekarang - datetime.timedelta(days=SINKRON_MAKS_UMUR_HARI)
+    return min(max(waktu, batas_bawah), sekarang)
+
+def konten_berikutnya(katalog, materi, selesai_konten_ids, penguasaan):
+    # Rekomendasi: konten pertama yang belum selesai di tahap yang sudah terbuka. Bila materi ini tuntas,
+    # materi berikutnya di Jalur Belajar yang belum tuntas (berputar ke awal katalog).
+    selesai, terbuka = status_tahap(materi, selesai_konten_ids)
+    for alur in URUTAN_ALUR:
+        if alur not in terbuka:
+            break
+        for k in materi.konten_per_alur.get(alur, ()):
+            if k.id not in selesai_konten_ids:
+                return {'materi_id': materi.id, 'konten_id': k.id, 'judul': k.judul,
+                        'url': url_for('materi_detail', materi_id=materi.id)}
+    posisi = katalog.materis.index(materi)
+    for m in katalog.materis[posisi + 1:] + katalog.materis[:posisi]:
+        p = penguasaan.get(m.id)
+        if m.kontens and not (p and p.selesai):
+            return {'materi_id': m.id, 'konten_id': None, 'judul': m.judul,
+                    'url': url_for('materi_detail', materi_id=m.id)}
+    return None
+
+def delta_progres(user_id, katalog, hasil):
+    # Respons tandai_selesai/sinkron_progres: cukup data bagi main.js untuk memperbarui centang, kunci
+    # tahap, persentase dan rekomendasi di halaman tanpa memuat ulang. Struktur materi diambil dari
+    # katalog di memori; dari database hanya status konten materi terkait dan ledger penguasaan.
+    # Katalog diambil pemanggil sebelum commit agar objek user yang kedaluwarsa tidak dimuat ulang.
+    materis = [katalog.materi_by_id[m] for m in hasil['materi_ids'] if m in katalog.materi_by_id]
+    konten_ids = [k.id for m in materis for k in m.kontens]
+    selesai_konten_ids = {k for (k,) in db.session.query(ProgressSiswa.konten_id).filter(
+        ProgressSiswa.user_id == user_id,
+        ProgressSiswa.konten_id.in_(konten_ids)
+    )} if konten_ids else set()
+    penguasaan = ambil_penguasaan(user_id) if hasil['materi_ids'] else {}
+
+    progres = []
+    for materi_id in hasil['materi_ids']:
+        p = penguasaan.get(materi_id)
+        if p is None:
+            continue
+        item = {
+            'materi_id': p.materi_id,
+            'konten_selesai': p.konten_selesai,
+            'total_konten': p.total_konten,
+            'persen': p.persen,
+            'selesai': p.selesai
+        }
+        materi = katalog.materi_by_id.get(materi_id)
+        if materi is not None:
+            selesai, terbuka = status_tahap(materi, selesai_konten_ids)
+            item['tahap'] = {alur: {'selesai': alur in selesai, 'terbuka': alur in terbuka} for alur in URUTAN_ALUR}
+            item['konten_ids_selesai'] = [k.id for k in materi.kontens if k.id in selesai_konten_ids]
+            item['berikutnya'] = konten_berikutnya(katalog, materi, selesai_konten_ids, penguasaan)
+        progres.append(item)
+    return {
+        'status': 'ok',
+        'diterima': hasil['baru'],
+        'diabaikan': hasil['diabaikan'],
+        'progres': progres,
+        'lencana_baru': [{'id': badge_id, 'nama': nama, 'emoji': emoji} for badge_id, nama, emoji in hasil['lencana_baru']]
+    }
+
+def umumkan_lencana(lencana_baru):
+    # main.js (header X-Rumi-Delta) menampilkan lencana baru sendiri dari respons. Pengiriman lewat
+    # sendBeacon tidak bisa membaca respons, jadi lencananya tetap disampaikan lewat flash.
+    if request.headers.get('X-Rumi-Delta') == '1':
+        return
+    for _, nama, emoji in lencana_baru:
+        flash(f'{emoji} Selamat! Anda mendapatkan lencana baru: "{nama}"', 'success')
 
 @app.route('/konten/<int:konten_id>/selesai', methods=['POST'])
 @login_required
 @role_required('siswa')
 def tandai_selesai(konten_id):
-    user_id = session['user_id']
-    existing_progress = ProgressSiswa.query.filter_by(user_id=user_id, konten_id=konten_id).first()
-    
-    if not existing_progress:
-        new_progress = ProgressSiswa(user_id=user_id, konten_id=konten_id)
-        db.session.add(new_progress)
-        db.session.commit()
+    user = pengguna_saat_ini()
+    user_id, katalog = user.id, ambil_katalog(user.kelas)
+    hasil = catat_penyelesaian(user_id, [(konten_id, waktu_utc_sekarang())])
+    umumkan_lencana(hasil['lencana_baru'])
+    return jsonify(delta_progres(user_id, katalog, hasil))
 
-        user = User.query.get(user_id)
-        check_and_award_badges(user)
-        
-    return jsonify({'status': 'ok'})
+@app.route('/progres/sinkron', methods=['POST'])
+@login_required
+@role_required('siswa')
+def sinkron_progres():
+    # Endpoint batch untuk klien dengan koneksi buruk: main.js mengantre penyelesaian lalu
+    # mengirimkannya sekaligus. Body: {"penyelesaian": [{"konten_id": 1, "waktu": "2024-01-01T07:00:00Z"}]}
+    data = request.get_json(silent=True) or {}
+    items = data.get('penyelesaian')
+    if not isinstance(items, list) or len(items) > SINKRON_MAKS_ITEM:
+        return jsonify({'status': 'error', 'pesan': f'Kirim daftar "penyelesaian" berisi maksimal {SINKRON_MAKS_ITEM} item.'}), 400
+
+    sekarang = waktu_utc_sekarang()
+    daftar = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        konten_id = item.get('konten_id')
+        if isinstance(konten_id, bool) or not isinstance(konten_id, int):
+            continue
+        daftar.append((konten_id, parse_waktu_klien(item.get('waktu'), sekarang)))
+
+    user = pengguna_saat_ini()
+    user_id, katalog = user.id, ambil_katalog(user.kelas)
+    hasil = catat_penyelesaian(user_id, daftar)
+    umumkan_lencana(hasil['lencana_baru'])
+    return jsonify(delta_progres(user_id, katalog, hasil))
+
+@app.route('/progres/delta')
+@login_required
+@role_required('siswa')
+def ambil_delta_progres():
+    # Dipanggil main.js saat kanal push mengabarkan progres berubah (mis. konten diselesaikan di perangkat
+    # lain): status terbaru materi yang tampil di halaman, dalam format respons tandai_selesai.
+    materi_ids = [int(m) for m in request.args.get('materi', '').split(',') if m.isdigit()][:MONITORING_PER_HALAMAN]
+    user = pengguna_saat_ini()
+    katalog = ambil_katalog(user.kelas)
+    hasil = {'baru': [], 'diabaikan': [], 'lencana_baru': [],
+             'materi_ids': [m for m in dict.fromkeys(materi_ids) if m in katalog.materi_by_id]}
+    return jsonify(delta_progres(user.id, katalog, hasil))
 
 
 # --- ROUTING ADMIN ---
@@ -887,32 +3410,49 @@ def tandai_selesai(konten_id):
 @login_required
 @admin_required
 def admin_dashboard():
-    # Ambil parameter dari URL untuk filter dan pencarian
-    search_query = request.args.get('q', '')
+    # Ambil parameter dari URL untuk filter, pencarian dan kursor halaman
+    search_query = request.args.get('q', '').strip()
     role_filter = request.args.get('peran', '')
+    kursor = decode_kursor(request.args.get('setelah'), KURSOR_ADMIN)
 
-    # Query dasar
+    # Query dasar; indeks pencarian user_fts dan triggernya dibuat oleh `flask migrasi` (migrasi 4)
     query = User.query
 
-    # Terapkan filter pencarian jika ada
-    if search_query:
-        query = query.filter(or_(
-            User.nama_lengkap.ilike(f'%{search_query}%'),
-            User.username.ilike(f'%{search_query}%')
-        ))
+    # Terapkan pencarian teks penuh (awalan kata pada nama atau username) jika ada
+    if buat_query_fts(search_query):
+        query = query.filter(filter_cari_user(search_query))
+
+    # Jumlah per peran dalam satu GROUP BY di atas indeks (peran, id), sebelum filter peran
+    jumlah_per_peran = dict(
+        query.with_entities(User.peran, func.count(User.id)).group_by(User.peran).all()
+    )
+    total = jumlah_per_peran.get(role_filter, 0) if role_filter else sum(jumlah_per_peran.values())
 
     # Terapkan filter peran jika ada
     if role_filter:
         query = query.filter_by(peran=role_filter)
 
-    # Eksekusi query akhir, diurutkan berdasarkan ID terbaru
-    all_users = query.order_by(User.id.desc()).all()
+    # Satu halaman, diurutkan berdasarkan ID terbaru (keyset pada id)
+    if kursor:
+        query = query.filter(User.id < kursor[0])
+    all_users = query.order_by(User.id.desc()).limit(ADMIN_PENGGUNA_PER_HALAMAN + 1).all()
+
+    kursor_berikutnya = None
+    if len(all_users) > ADMIN_PENGGUNA_PER_HALAMAN:
+        all_users = all_users[:ADMIN_PENGGUNA_PER_HALAMAN]
+        kursor_berikutnya = encode_kursor([all_users[-1].id])
 
     return render_template(
         'admin_dashboard.html', 
         all_users=all_users, 
         search_query=search_query, 
-        role_filter=role_filter
+        role_filter=role_filter,
+        jumlah_per_peran=jumlah_per_peran,
+        total=total,
+        kursor_berikutnya=kursor_berikutnya,
+        halaman_pertama=kursor is None,
+        daftar_backup=baca_manifest_backup(),
+        backup_berjalan=_backup_berjalan.is_set()
     )
 
 @app.route('/admin/user/<int:user_id>/hapus', methods=['POST'])
@@ -988,22 +3528,895 @@ def tambah_user():
         
     return render_template('tambah_user.html')
 
-@app.route('/admin/backup')
+@app.route('/admin/user/impor', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def impor_user():
+    if request.method == 'POST':
+        berkas = request.files.get('berkas')
+        if not berkas or not berkas.filename:
+            flash('Pilih berkas CSV atau XLSX terlebih dahulu.', 'danger')
+            return redirect(url_for('impor_user'))
+        try:
+            daftar = baca_berkas_impor(berkas.stream, berkas.filename)
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f'Berkas tidak dapat dibaca: {e}', 'danger')
+            return redirect(url_for('impor_user'))
+
+        pratinjau = request.form.get('mode') == 'pratinjau'
+        hasil, jumlah_dibuat = impor_pengguna(daftar, simpan=not pratinjau)
+        jumlah_galat = sum(1 for b in hasil if b.galat)
+        if not pratinjau:
+            flash(f'{jumlah_dibuat} pengguna berhasil diimpor, {jumlah_galat} baris dilewati.',
+                  'success' if jumlah_dibuat else 'warning')
+        return render_template('impor_user.html', hasil=hasil, pratinjau=pratinjau,
+                               jumlah_galat=jumlah_galat, jumlah_dibuat=jumlah_dibuat)
+
+    return render_template('impor_user.html', hasil=None)
+
+@app.route('/admin/backup', methods=['POST'])
 @login_required
 @admin_required
 def backup_database():
+    if mulai_backup_latar():
+        flash('Snapshot database sedang dibuat di latar belakang. Muat ulang halaman ini sebentar lagi.', 'info')
+    else:
+        flash('Backup sebelumnya masih berjalan.', 'warning')
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/backup/<nama_berkas>')
+@login_required
+@admin_required
+def unduh_backup(nama_berkas):
+    # Hanya berkas yang tercatat di manifest yang boleh diunduh
+    if entri_backup(nama_berkas) is None:
+        abort(404)
+    return send_file(os.path.join(BACKUP_DIR, nama_berkas), as_attachment=True,
+                     download_name=nama_berkas, mimetype='application/gzip')
+
+@app.route('/admin/metrics')
+def metrics():
+    # Scraper Prometheus memakai header "Authorization: Bearer <RUMI_METRICS_TOKEN>"; selain itu hanya admin
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN):
+        return Response(metrik_prometheus(), mimetype='text/plain; version=0.0.4')
+    return metrics_admin()
+
+@login_required
+@admin_required
+def metrics_admin():
+    return Response(metrik_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# --- MIGRASI SKEMA ---
+# Versi skema disimpan di PRAGMA user_version. `flask migrasi` menjalankan db.create_all() (tabel baru
+# beserta indeksnya) lalu setiap langkah bernomor di atas user_version, berurutan, masing-masing dalam
+# satu transaksi. Langkah harus idempoten karena database baru sudah lengkap setelah create_all.
+MIGRASI = []
+
+def daftarkan_migrasi(versi, keterangan):
+    def dekorator(fungsi):
+        MIGRASI.append((versi, keterangan, fungsi))
+        MIGRASI.sort(key=lambda langkah: langkah[0])
+        return fungsi
+    return dekorator
+
+def versi_skema():
+    return db.session.execute(text('PRAGMA user_version')).scalar()
+
+def jalankan_migrasi(cetak=print):
+    db.create_all()
+    versi_awal = versi_skema()
+    for versi, keterangan, fungsi in MIGRASI:
+        if versi <= versi_awal:
+            continue
+        cetak(f"Migrasi {versi}: {keterangan}")
+        fungsi()
+        db.session.execute(text(f'PRAGMA user_version = {int(versi)}'))
+        db.session.commit()
+    return versi_awal, versi_skema()
+
+def buat_indeks(*perintah):
+    for sql in perintah:
+        db.session.execute(text(sql))
+
+@daftarkan_migrasi(1, 'Indeks notifikasi, siaran, dan pengguna per peran')
+def _migrasi_indeks_awal():
+    buat_indeks(
+        'CREATE INDEX IF NOT EXISTS ix_notifikasi_penerima_id ON notifikasi (penerima_id, id)',
+        'CREATE INDEX IF NOT EXISTS ix_siaran_sekolah_kelas ON notifikasi_siaran (nama_sekolah, kelas, id)',
+        'CREATE INDEX IF NOT EXISTS ix_user_peran_id ON "user" (peran, id)',
+    )
+
+@daftarkan_migrasi(2, 'Ledger penguasaan materi dan statistik siswa')
+def _migrasi_ledger():
+    if PenguasaanMateri.query.first() is None and ProgressSiswa.query.first() is not None:
+        bangun_ulang_penguasaan()
+        bangun_ulang_statistik()
+
+@daftarkan_migrasi(3, 'Watermark status baca notifikasi')
+def _migrasi_status_baca():
+    migrasi_status_baca()
+
+@daftarkan_migrasi(4, 'Indeks pencarian FTS5 Pojok Baca dan pengguna')
+def _migrasi_fts():
+    siapkan_fts_pojok_baca()
+    siapkan_fts_user()
+
+@daftarkan_migrasi(5, 'Kode pairing dipindahkan ke tabel kode_pairing')
+def _migrasi_kode_pairing():
+    migrasi_kode_pairing()
+
+@daftarkan_migrasi(6, 'Indeks untuk query panas (monitoring, notifikasi, progres, katalog)')
+def _migrasi_indeks_beban_kerja():
+    buat_indeks(
+        'CREATE INDEX IF NOT EXISTS ix_user_peran_sekolah_kelas ON "user" (peran, nama_sekolah, kelas, nama_lengkap)',
+        'CREATE INDEX IF NOT EXISTS ix_notifikasi_penerima_dibaca ON notifikasi (penerima_id, sudah_dibaca, id)',
+        'CREATE INDEX IF NOT EXISTS ix_notifikasi_penerima_waktu ON notifikasi (penerima_id, timestamp, id)',
+        'CREATE INDEX IF NOT EXISTS ix_progress_user_tanggal ON progress_siswa (user_id, tanggal_selesai)',
+        'CREATE INDEX IF NOT EXISTS ix_tp_kelas_tujuan ON tujuan_pembelajaran (kelas_tujuan)',
+        'CREATE INDEX IF NOT EXISTS ix_materi_tp_status ON materi_pokok (tp_id, status)',
+        'CREATE INDEX IF NOT EXISTS ix_konten_materi ON konten_belajar (materi_id)',
+    )
+
+@daftarkan_migrasi(7, 'Kolom diperbarui untuk ETag/Last-Modified (materi, konten, Pojok Baca, statistik siswa)')
+def _migrasi_kolom_diperbarui():
+    # ALTER TABLE di SQLite tidak menerima default CURRENT_TIMESTAMP, jadi kolom diisi setelah dibuat
+    for tabel in ('materi_pokok', 'konten_belajar', 'pojok_baca', 'statistik_siswa'):
+        kolom = {baris[1] for baris in db.session.execute(text(f'PRAGMA table_info({tabel})'))}
+        if 'diperbarui' not in kolom:
+            db.session.execute(text(f'ALTER TABLE {tabel} ADD COLUMN diperbarui DATETIME'))
+            db.session.execute(text(f'UPDATE {tabel} SET diperbarui = CURRENT_TIMESTAMP'))
+    buat_indeks('CREATE INDEX IF NOT EXISTS ix_pojok_baca_diperbarui ON pojok_baca (diperbarui)')
+
+@daftarkan_migrasi(8, 'Indeks lencana per siswa (monitoring dan ekspor progres)')
+def _migrasi_indeks_lencana():
+    buat_indeks('CREATE INDEX IF NOT EXISTS ix_user_badge_user_tanggal ON user_badge (user_id, tanggal_dapat)')
+
+@daftarkan_migrasi(9, 'Lencana bawaan (Langkah Pertama, Semangat Tiga Hari)')
+def _migrasi_lencana_bawaan():
+    create_default_badges()
+
+@daftarkan_migrasi(10, 'Ledger penguasaan per tahap (alur) dan lencana Perenung Sejati')
+def _migrasi_ledger_alur():
+    bangun_ulang_penguasaan_alur()
+    create_default_badges()
+
+# --- DATA SINTETIS & BENCHMARK ---
+# `flask bangkitkan-data` mengisi database (sebaiknya berkas terpisah lewat RUMI_DATABASE) dengan sekolah,
+# guru, siswa, orang tua, kurikulum, serta riwayat progres, lencana dan notifikasi yang miring: sebagian
+# kecil siswa sangat aktif, sebagian besar hanya menyelesaikan sedikit konten. `flask benchmark-rute`
+# memanggil rute utama lewat test client lalu menyimpan latensi, jumlah query dan memori puncak ke JSON.
+SINTETIS_PASSWORD = 'rumi12345'
+SINTETIS_KELAS = ('7', '8', '9')
+SINTETIS_TIPE = {
+    'memahami': ('Bacaan (PDF/Slide)', 'Video', 'Infografis'),
+    'mengaplikasi': ('Kuis', 'Studi Kasus'),
+    'merefleksi': ('Jurnal Refleksi', 'Diskusi Terpandu'),
+}
+SINTETIS_KATA = ('ekosistem', 'pecahan', 'energi', 'sejarah', 'puisi', 'geometri', 'iklim', 'sel', 'gaya',
+                 'cahaya', 'budaya', 'statistik', 'peta', 'bunyi', 'cerpen', 'aljabar', 'vulkanik', 'rempah')
+SINTETIS_NAMA_DEPAN = ('Andi', 'Budi', 'Citra', 'Dewi', 'Eka', 'Fajar', 'Gita', 'Hadi', 'Indah', 'Joko',
+                       'Kartika', 'Lestari', 'Made', 'Nur', 'Putri', 'Rizky', 'Siti', 'Tono', 'Wayan', 'Yusuf')
+SINTETIS_NAMA_BELAKANG = ('Pratama', 'Saputra', 'Wijaya', 'Lestari', 'Siregar', 'Nasution', 'Hidayat',
+                          'Kusuma', 'Santoso', 'Rahmawati', 'Putra', 'Harahap')
+SINTETIS_KATEGORI = ('Biologi', 'Fisika', 'Sejarah', 'Sastra', 'Matematika', 'Geografi')
+
+# Batas atas query per request untuk setiap skenario benchmark, diperiksa oleh tests/test_jumlah_query.py
+# dan `flask cek-jumlah-query`. Angkanya tidak bergantung pada ukuran data; pola N+1 akan melewati batas
+# begitu datanya cukup banyak.
+BATAS_QUERY = {
+    # Setiap halaman ber-layout termasuk satu query stempel_notifikasi untuk memvalidasi cache lonceng
+    'dashboard_siswa': 7, 'dashboard_orangtua': 9, 'monitoring_siswa': 7, 'detail_siswa': 8,
+    'profil_siswa': 4, 'jalur_belajar': 4, 'materi_detail': 6, 'pojok_baca': 8,
+    'admin_dashboard': 5, 'admin_dashboard_cari': 5,
+    # Ledger materi dan ledger per tahap masing-masing satu UPDATE; tahap yang pertama kali disentuh
+    # membuat barisnya (dua COUNT + INSERT), ditambah satu lookup ledger tahap untuk aturan alur_selesai
+    'tandai_selesai': 17,
+    # 304 hanya membaca stempel (user, stempel notifikasi, versi katalog/progres/Pojok Baca), tanpa query isi halaman
+    'jalur_belajar_304': 3, 'materi_detail_304': 4, 'pojok_baca_304': 3,
+    # Satu potongan siswa (data benchmark < EKSPOR_SISWA_PER_POTONGAN per kelas); +3 query per potongan berikutnya
+    'ekspor_progres_kelas': 6,
+}
+
+def jumlah_miring(rng, rata, maks):
+    # Pareto(alpha=1.5) bergeser ke nol: rata-rata mendekati `rata`, ekornya panjang, dibatasi `maks`.
+    return min(maks, int(rata * (rng.paretovariate(1.5) - 1) / 2))
+
+def sisipkan_user(baris):
+    # Bulk insert lalu kembalikan {username: id}
+    id_per_username = {}
+    for bagian in potong(baris):
+        hasil = db.session.execute(db.insert(User).returning(User.id, User.username), bagian)
+        id_per_username.update((username, user_id) for user_id, username in hasil)
+    return id_per_username
+
+def bangkitkan_data_sintetis(sekolah=3, guru_per_sekolah=4, siswa_per_kelas=60, tp_per_kelas=4,
+                             materi_per_tp=3, konten_per_materi=6, rata_progres=20, rata_notifikasi=6,
+                             bacaan=300, awalan='sintetis', seed=1):
+    # Mengembalikan jumlah baris yang dibuat per tabel. Semua akun memakai SINTETIS_PASSWORD.
+    rng = random.Random(seed)
+    if User.query.filter(User.username == f'{awalan}_admin').first() is not None:
+        raise ValueError(f"Data sintetis dengan awalan '{awalan}' sudah ada.")
+    create_default_badges()
+    sekarang = waktu_utc_sekarang()
+    password_hash = hash_password(SINTETIS_PASSWORD)
+    nama_acak = lambda: f'{rng.choice(SINTETIS_NAMA_DEPAN)} {rng.choice(SINTETIS_NAMA_BELAKANG)}'
+
+    # 1. Pengguna: admin, guru, siswa, dan orang tua untuk kira-kira separuh siswa
+    baris_user = [{'nama_lengkap': 'Admin Sintetis', 'nama_sekolah': '-', 'username': f'{awalan}_admin',
+                   'password_hash': password_hash, 'peran': 'admin', 'kelas': None}]
+    sekolah_list = [f'Sekolah Sintetis {awalan} {s + 1}' for s in range(sekolah)]
+    pasangan_ortu = []
+    for s, nama_sekolah in enumerate(sekolah_list):
+        for j in range(guru_per_sekolah):
+            baris_user.append({'nama_lengkap': nama_acak(), 'nama_sekolah': nama_sekolah,
+                               'username': f'{awalan}_g{s}_{j}', 'password_hash': password_hash,
+                               'peran': 'guru', 'kelas': None})
+        for kelas in SINTETIS_KELAS:
+            for n in range(siswa_per_kelas):
+                username = f'{awalan}_s{s}_{kelas}_{n}'
+                baris_user.append({'nama_lengkap': nama_acak(), 'nama_sekolah': nama_sekolah,
+                                   'username': username, 'password_hash': password_hash,
+                                   'peran': 'siswa', 'kelas': kelas})
+                if rng.random() < 0.5:
+                    username_ortu = f'{awalan}_o{s}_{kelas}_{n}'
+                    pasangan_ortu.append((username_ortu, username))
+                    baris_user.append({'nama_lengkap': nama_acak(), 'nama_sekolah': nama_sekolah,
+                                       'username': username_ortu, 'password_hash': password_hash,
+                                       'peran': 'orangtua', 'kelas': None})
+    id_user = sisipkan_user(baris_user)
+    perubahan = []
+    for username_ortu, username_siswa in pasangan_ortu:
+        perubahan.append({'id': id_user[username_ortu], 'student_id': id_user[username_siswa]})
+        perubahan.append({'id': id_user[username_siswa], 'parent_id': id_user[username_ortu]})
+    if perubahan:
+        db.session.execute(db.update(User), perubahan)
+    siswa_tertaut = {u for _, u in pasangan_ortu}
+    alokasikan_kode_pairing([i for u, i in id_user.items()
+                             if u.startswith(f'{awalan}_s') and u not in siswa_tertaut])
+    guru_per_sekolah_ids = [[id_user[f'{awalan}_g{s}_{j}'] for j in range(guru_per_sekolah)]
+                            for s in range(sekolah)]
+    semua_guru = [i for daftar in guru_per_sekolah_ids for i in daftar]
+
+    # 2. Kurikulum per kelas (katalog berlaku lintas sekolah); sekitar 10% materi masih draft
+    konten_per_kelas = {}
+    jumlah_materi = jumlah_konten = 0
+    for kelas in SINTETIS_KELAS:
+        for t in range(tp_per_kelas):
+            tp = TujuanPembelajaran(deskripsi=f'Memahami {rng.choice(SINTETIS_KATA)} kelas {kelas} bagian {t + 1}',
+                                    kelas_tujuan=int(kelas), user_id=rng.choice(semua_guru))
+            db.session.add(tp)
+            db.session.flush()
+            for m in range(materi_per_tp):
+                judul = f'{rng.choice(SINTETIS_KATA).title()} {kelas}.{t + 1}.{m + 1}'
+                materi = MateriPokok(judul=judul, deskripsi=f'Materi sintetis {judul}', tp_id=tp.id,
+                                     status='draft' if rng.random() < 0.1 else 'published')
+                db.session.add(materi)
+                db.session.flush()
+                db.session.add(Badge(nama=f"Penakluk: {judul}",
+                                     deskripsi=f"Diberikan saat berhasil menyelesaikan materi '{judul}'.",
+                                     icon_url=generate_badge_icon('#03A9F4'), materi_pokok_id=materi.id))
+                baris_konten = []
+                for k in range(konten_per_materi):
+                    alur = ('memahami', 'mengaplikasi', 'merefleksi')[k * 3 // konten_per_materi]
+                    baris_konten.append({'judul': f'{judul} - konten {k + 1}', 'tipe': rng.choice(SINTETIS_TIPE[alur]),
+                                         'alur': alur, 'sumber_url': f'https://contoh.sch.id/konten/{materi.id}/{k}',
+                                         'urutan': k, 'materi_id': materi.id})
+                konten_ids = db.session.execute(db.insert(KontenBelajar).returning(KontenBelajar.id),
+                                                baris_konten).scalars().all()
+                if materi.status == 'published':
+                    konten_per_kelas.setdefault(kelas, []).extend(sorted(konten_ids))
+                jumlah_materi += 1
+                jumlah_konten += len(konten_ids)
+
+    # 3. Progres miring: siswa menyelesaikan n konten pertama katalognya, tersebar di 90 hari terakhir
+    baris_progres = []
+    for username, user_id in id_user.items():
+        if not username.startswith(f'{awalan}_s'):
+            continue
+        urutan = konten_per_kelas.get(username.split('_')[-2], [])
+        n = jumlah_miring(rng, rata_progres, len(urutan))
+        hari = sorted(rng.randint(0, 90) for _ in range(n))[::-1]
+        for konten_id, mundur in zip(urutan[:n], hari):
+            waktu = sekarang - datetime.timedelta(days=mundur, minutes=rng.randint(0, 600))
+            baris_progres.append({'user_id': user_id, 'konten_id': konten_id, 'tanggal_selesai': waktu})
+    for bagian in potong(baris_progres, 5000):
+        db.session.execute(db.insert(ProgressSiswa), bagian)
+    db.session.commit()
+    bangun_ulang_penguasaan()
+    bangun_ulang_statistik()
+
+    # 4. Lencana yang konsisten dengan progres: Langkah Pertama dan materi yang tuntas
+    langkah_pertama = Badge.query.filter_by(nama="Langkah Pertama").first()
+    pertama_per_siswa = {}
+    for b in baris_progres:
+        if b['user_id'] not in pertama_per_siswa or b['tanggal_selesai'] < pertama_per_siswa[b['user_id']]:
+            pertama_per_siswa[b['user_id']] = b['tanggal_selesai']
+    baris_lencana = [{'user_id': u, 'badge_id': langkah_pertama.id, 'tanggal_dapat': w}
+                     for u, w in pertama_per_siswa.items()]
+    tuntas = db.session.query(PenguasaanMateri.user_id, Badge.id).join(
+        Badge, Badge.materi_pokok_id == PenguasaanMateri.materi_id
+    ).filter(
+        PenguasaanMateri.user_id >= min(id_user.values()),  # id baru selalu di atas id yang sudah ada
+        PenguasaanMateri.total_konten > 0,
+        PenguasaanMateri.konten_selesai >= PenguasaanMateri.total_konten
+    ).all()
+    baris_lencana.extend({'user_id': u, 'badge_id': b, 'tanggal_dapat': sekarang} for u, b in tuntas)
+    for bagian in potong(baris_lencana, 5000):
+        db.session.execute(db.insert(UserBadge), bagian)
+
+    # 5. Notifikasi langsung (jumlahnya miring, yang lama sudah dibaca) dan beberapa siaran per sekolah
+    baris_notifikasi = []
+    for username, user_id in id_user.items():
+        if not username.startswith(f'{awalan}_s'):
+            continue
+        s = int(username.split('_')[-3][1:])
+        n = jumlah_miring(rng, rata_notifikasi, 500)
+        for i in range(n):
+            baris_notifikasi.append({
+                'pengirim_id': rng.choice(guru_per_sekolah_ids[s]), 'penerima_id': user_id,
+                'konten': f'Jangan lupa pelajari {rng.choice(SINTETIS_KATA)} minggu ini.',
+                'sudah_dibaca': i < n * 0.7,
+                'timestamp': sekarang - datetime.timedelta(hours=(n - i) * 12),
+            })
+    baris_notifikasi.sort(key=lambda b: b['timestamp'])
+    for bagian in potong(baris_notifikasi, 5000):
+        db.session.execute(db.insert(Notifikasi), bagian)
+    baris_siaran = []
+    for s, nama_sekolah in enumerate(sekolah_list):
+        for i in range(5):
+            baris_siaran.append({'pengirim_id': rng.choice(guru_per_sekolah_ids[s]), 'nama_sekolah': nama_sekolah,
+                                 'kelas': rng.choice(SINTETIS_KELAS + (None,)),
+                                 'konten': f'Pengumuman sintetis {i + 1}',
+                                 'timestamp': sekarang - datetime.timedelta(days=5 - i)})
+    if baris_siaran:
+        db.session.execute(db.insert(NotifikasiSiaran), baris_siaran)
+    db.session.commit()
+    migrasi_status_baca()
+
+    # 6. Pojok Baca
+    baris_bacaan = []
+    for i in range(bacaan):
+        kata = rng.sample(SINTETIS_KATA, 3)
+        baris_bacaan.append({'judul': f'Mengenal {kata[0]} dan {kata[1]}',
+                             'deskripsi': f'Bacaan ringan tentang {" ".join(kata)}.',
+                             'kategori': rng.choice(SINTETIS_KATEGORI), 'url_sampul': None,
+                             'url_konten': f'https://contoh.sch.id/bacaan/{i}'})
+    for bagian in potong(baris_bacaan, 5000):
+        db.session.execute(db.insert(PojokBaca), bagian)
+    naikkan_versi_katalog()
+    db.session.commit()
+    bangun_ulang_fts_pojok_baca()
+    bangun_ulang_fts_user()
+
+    return {
+        'user': len(id_user), 'tujuan_pembelajaran': len(SINTETIS_KELAS) * tp_per_kelas,
+        'materi_pokok': jumlah_materi, 'konten_belajar': jumlah_konten, 'progress_siswa': len(baris_progres),
+        'user_badge': len(baris_lencana), 'notifikasi': len(baris_notifikasi),
+        'notifikasi_siaran': len(baris_siaran), 'pojok_baca': bacaan,
+    }
+
+def ringkas_latensi(latensi):
+    # Persentil dalam milidetik dari daftar durasi (detik)
+    urut = sorted(latensi)
+    persentil = lambda p: round(urut[min(len(urut) - 1, int(len(urut) * p))] * 1000, 2)
+    return {'p50_ms': persentil(0.50), 'p95_ms': persentil(0.95), 'p99_ms': persentil(0.99),
+            'rata_ms': round(sum(urut) / len(urut) * 1000, 2)}
+
+def subjek_benchmark():
+    # Pilih pengguna yang mewakili beban terberat: siswa paling aktif, orang tuanya (atau orang tua siswa
+    # teraktif yang tertaut), guru di sekolahnya, siswa yang masih punya banyak konten tersisa, dan admin.
+    siswa = User.query.join(StatistikSiswa).filter(User.peran == 'siswa').order_by(
+        StatistikSiswa.total_konten_selesai.desc()
+    ).first() or User.query.filter_by(peran='siswa').first()
+    if siswa is None:
+        raise ValueError('Database belum berisi siswa; jalankan `flask bangkitkan-data` terlebih dahulu.')
+    ortu = User.query.join(StatistikSiswa, StatistikSiswa.user_id == User.student_id).filter(
+        User.peran == 'orangtua'
+    ).order_by(StatistikSiswa.total_konten_selesai.desc()).first()
+    guru = User.query.filter_by(peran='guru', nama_sekolah=siswa.nama_sekolah).first()
+    admin = User.query.filter_by(peran='admin').first()
+    katalog = ambil_katalog(siswa.kelas)
+    selesai = {k for (k,) in db.session.query(ProgressSiswa.konten_id).filter_by(user_id=siswa.id)}
+    materi = next((m for m in katalog.materis if any(k.id not in selesai for k in m.kontens)),
+                  katalog.materis[0] if katalog.materis else None)
+    pemula = User.query.outerjoin(StatistikSiswa).filter(
+        User.peran == 'siswa', User.kelas == siswa.kelas, StatistikSiswa.user_id.is_(None)
+    ).first() or siswa
+    selesai_pemula = {k for (k,) in db.session.query(ProgressSiswa.konten_id).filter_by(user_id=pemula.id)}
+    konten_tersisa = [k.id for m in katalog.materis for k in m.kontens if k.id not in selesai_pemula]
+    kata = PojokBaca.query.with_entities(PojokBaca.judul).first()
+    return {'siswa': siswa, 'ortu': ortu, 'guru': guru, 'admin': admin, 'pemula': pemula, 'materi': materi,
+            'konten_tersisa': konten_tersisa,
+            'kata_bacaan': re.findall(r'\w+', kata[0])[-1][:4] if kata else 'a',
+            'kata_pengguna': siswa.nama_lengkap.split()[0][:3]}
+
+def skenario_benchmark(subjek):
+    # (nama, pengguna, metode, pembuat url per iterasi); skenario tanpa subjek dilewati. Metode 'GET-304'
+    # mengirim If-None-Match dari respons sebelumnya, seperti browser yang membuka ulang halaman.
+    konten_tersisa = iter(subjek['konten_tersisa'])
+    konten_cadangan = subjek['konten_tersisa'][:1] or [0]
+    skenario = [
+        ('dashboard_siswa', subjek['siswa'], 'GET', lambda: '/dashboard'),
+        ('dashboard_orangtua', subjek['ortu'], 'GET', lambda: '/dashboard'),
+        ('monitoring_siswa', subjek['guru'], 'GET', lambda: '/monitoring-siswa'),
+        ('detail_siswa', subjek['guru'], 'GET', lambda: f"/monitoring-siswa/{subjek['siswa'].id}"),
+        ('profil_siswa', subjek['siswa'], 'GET', lambda: '/profil'),
+        ('jalur_belajar', subjek['siswa'], 'GET', lambda: '/jalur-belajar'),
+        ('materi_detail', subjek['siswa'], 'GET',
+         lambda: f"/materi/{subjek['materi'].id}" if subjek['materi'] else '/jalur-belajar'),
+        # Setiap iterasi menandai konten berbeda; setelah habis, permintaan berikutnya menjadi no-op
+        ('tandai_selesai', subjek['pemula'], 'POST',
+         lambda: f"/konten/{next(konten_tersisa, konten_cadangan[0])}/selesai"),
+        ('pojok_baca', subjek['siswa'], 'GET', lambda: f"/pojok-baca?q={subjek['kata_bacaan']}"),
+        ('jalur_belajar_304', subjek['siswa'], 'GET-304', lambda: '/jalur-belajar'),
+        ('materi_detail_304', subjek['siswa'], 'GET-304',
+         lambda: f"/materi/{subjek['materi'].id}" if subjek['materi'] else '/jalur-belajar'),
+        ('pojok_baca_304', subjek['siswa'], 'GET-304', lambda: f"/pojok-baca?q={subjek['kata_bacaan']}"),
+        ('ekspor_progres_kelas', subjek['guru'], 'GET', lambda: f"/monitoring-siswa/ekspor?kelas={subjek['siswa'].kelas}"),
+        ('admin_dashboard', subjek['admin'], 'GET', lambda: '/admin/dashboard'),
+        ('admin_dashboard_cari', subjek['admin'], 'GET', lambda: f"/admin/dashboard?q={subjek['kata_pengguna']}"),
+    ]
+    return [s for s in skenario if s[1] is not None]
+
+def klien_sebagai(pengguna):
+    # Test client yang sudah login (sesi diisi langsung, tanpa hash password); None = tamu
+    klien = app.test_client()
+    if pengguna is not None:
+        with klien.session_transaction() as sesi:
+            sesi['user_id'] = pengguna.id
+            sesi['user_name'] = pengguna.nama_lengkap
+            sesi['user_role'] = pengguna.peran
+    return klien
+
+def di_thread_terpisah(fungsi):
+    # Request dijalankan di thread lain: tanpa app context CLI yang aktif, setiap request mendapat
+    # app context dan sesi database sendiri seperti di server sungguhan.
+    with ThreadPoolExecutor(max_workers=1) as pelaksana:
+        return pelaksana.submit(fungsi).result()
+
+def jalankan_benchmark(ulang=50, ulang_memori=3):
+    # Mengembalikan hasil per skenario: latensi (tanpa request pertama/"dingin"), jumlah query per request,
+    # dan memori puncak Python (tracemalloc, diukur terpisah karena memperlambat request).
+    subjek = subjek_benchmark()
+    db.session.remove()
+    jumlah_query = [0]
+
+    def hitung_query(*args):
+        jumlah_query[0] += 1
+
+    mesin_list = list(db.engines.values())
+    for mesin in mesin_list:
+        event.listen(mesin, 'before_cursor_execute', hitung_query)
+    def ukur_semua():
+        hasil = {}
+        for nama, pengguna, metode, buat_url in skenario_benchmark(subjek):
+            klien = klien_sebagai(pengguna)
+            etag = [None]
+
+            def panggil():
+                header = {'If-None-Match': etag[0]} if metode == 'GET-304' and etag[0] else {}
+                jumlah_query[0] = 0
+                mulai = time.perf_counter()
+                respons = klien.open(buat_url(), method=metode.removesuffix('-304'), headers=header)
+                # Respons streaming (ekspor) baru menjalankan query-nya saat body dibaca
+                respons.get_data()
+                durasi = time.perf_counter() - mulai
+                etag[0] = respons.headers.get('ETag', etag[0])
+                respons.close()
+                return durasi, jumlah_query[0], respons.status_code
+
+            pertama, _, _ = panggil()
+            latensi, kueri, status = [], [], set()
+            for _ in range(ulang):
+                durasi, n, kode = panggil()
+                latensi.append(durasi)
+                kueri.append(n)
+                status.add(kode)
+            puncak = 0
+            tracemalloc.start()
+            try:
+                for _ in range(ulang_memori):
+                    tracemalloc.reset_peak()
+                    panggil()
+                    puncak = max(puncak, tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+            hasil[nama] = dict(ringkas_latensi(latensi), pertama_ms=round(pertama * 1000, 2),
+                               query_rata=round(sum(kueri) / len(kueri), 1), query_maks=max(kueri),
+                               memori_puncak_kb=round(puncak / 1024), status=sorted(status))
+        return hasil
+
     try:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
-        filename = f'rumi_backup_{timestamp}.db'
-        return send_file(
-            os.path.join(base_dir, 'rumi.db'),
-            as_attachment=True,
-            download_name=filename
-        )
-    except Exception as e:
-        flash(f"Gagal membuat backup: {str(e)}", "danger")
-        return redirect(url_for('admin_dashboard'))
+        hasil = di_thread_terpisah(ukur_semua)
+    finally:
+        for mesin in mesin_list:
+            event.remove(mesin, 'before_cursor_execute', hitung_query)
+    return hasil
+
+def ukuran_data():
+    # Jumlah baris tabel utama, disimpan bersama hasil benchmark agar run bisa dibandingkan
+    return {model.__tablename__: db.session.query(func.count()).select_from(model).scalar()
+            for model in (User, TujuanPembelajaran, MateriPokok, KontenBelajar, ProgressSiswa,
+                          UserBadge, Notifikasi, NotifikasiSiaran, PojokBaca)}
+
+# --- PEMERIKSAAN RENCANA QUERY ---
+# SQL yang benar-benar dijalankan rute utama direkam lewat test client, lalu setiap SELECT diperiksa dengan
+# EXPLAIN QUERY PLAN: tidak boleh ada full scan pada tabel besar. Karena yang diperiksa adalah query rute
+# itu sendiri, perubahan rute langsung ikut diperiksa. Dijalankan oleh tests/test_rencana_query.py dan
+# `flask cek-rencana-query` (database yang sudah berisi data, mis. dari `flask bangkitkan-data`).
+TABEL_BESAR = {'user', 'notifikasi', 'notifikasi_siaran', 'progress_siswa', 'tujuan_pembelajaran',
+               'materi_pokok', 'konten_belajar', 'penguasaan_materi', 'penguasaan_alur', 'user_badge'}
+
+def skenario_rencana_query(subjek):
+    # Skenario benchmark ditambah rute lain yang membaca tabel besar
+    return skenario_benchmark(subjek) + [
+        ('notifikasi', subjek['siswa'], 'GET', lambda: '/notifikasi'),
+        ('pembaruan', subjek['siswa'], 'GET', lambda: '/pembaruan'),
+        ('pembaruan_cek', subjek['siswa'], 'GET', lambda: '/pembaruan/cek?sejak=0.0.0'),
+        ('progres_delta', subjek['siswa'], 'GET',
+         lambda: f"/progres/delta?materi={subjek['materi'].id if subjek['materi'] else 0}"),
+        ('register_student', None, 'GET', lambda: '/register/student'),
+    ]
+
+def rekam_sql_rute(skenario):
+    # {nama skenario: [(statement, parameter)]} berisi SELECT yang dijalankan satu request per skenario
+    rekaman = {}
+    aktif = [None]
+
+    def catat(koneksi, kursor, statement, parameter, konteks, executemany):
+        if aktif[0] is not None and not executemany and _POLA_PERINTAH_BACA.match(statement):
+            rekaman[aktif[0]].append((statement, parameter))
+
+    def jalankan():
+        for nama, pengguna, metode, buat_url in skenario:
+            rekaman.setdefault(nama, [])
+            aktif[0] = nama
+            respons = klien_sebagai(pengguna).open(buat_url(), method=metode.removesuffix('-304'))
+            respons.get_data()
+            respons.close()
+            aktif[0] = None
+
+    mesin_list = list(db.engines.values())
+    for mesin in mesin_list:
+        event.listen(mesin, 'before_cursor_execute', catat)
+    try:
+        di_thread_terpisah(jalankan)
+    finally:
+        for mesin in mesin_list:
+            event.remove(mesin, 'before_cursor_execute', catat)
+    return rekaman
+
+def full_scan(statement, rencana):
+    # Langkah SCAN tabel besar tanpa indeks (SCAN ... USING [COVERING] INDEX tetap boleh). Query tanpa WHERE
+    # yang dibatasi LIMIT dan tidak perlu diurutkan di B-tree sementara (mis. .first(), atau ORDER BY id
+    # dengan LIMIT) berhenti setelah beberapa baris, jadi bukan full scan.
+    if (re.search(r'\bLIMIT\b', statement) and not re.search(r'\bWHERE\b', statement)
+            and not any('TEMP B-TREE' in langkah for langkah in rencana)):
+        return []
+    hasil = []
+    for langkah in rencana:
+        cocok = re.match(r'SCAN (\w+)', langkah)
+        if cocok and cocok.group(1) in TABEL_BESAR and 'USING' not in langkah:
+            hasil.append(langkah)
+    return hasil
+
+def periksa_rencana_query(mesin, sql_per_rute):
+    # {nama: [(statement, rencana, daftar full scan)]}; statement yang sama dalam satu rute diperiksa sekali
+    hasil = {}
+    with mesin.connect() as koneksi:
+        for nama, daftar in sql_per_rute.items():
+            hasil[nama] = []
+            for statement, parameter in dict(daftar).items():
+                rencana = [baris[3] for baris in koneksi.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameter)]
+                hasil[nama].append((statement, rencana, full_scan(statement, rencana)))
+    return hasil
 
+# --- UJI BEBAN TULIS ---
+# `flask uji-beban-tulis` menjalankan beberapa proses (meniru worker gunicorn) terhadap database sementara
+# berisi data sintetis kecil. Setiap proses dibuat dengan spawn lalu mengimpor app dengan variabel RUMI_*
+# milik konfigurasi yang diuji, sehingga yang diukur adalah engine aplikasi sendiri: pasang_pragma,
+# SesiRute beserta bind 'baca', BEGIN IMMEDIATE, antrean tulis, dan catat_penyelesaian.
+UJI_BEBAN_DATA = dict(sekolah=1, guru_per_sekolah=1, siswa_per_kelas=100, rata_progres=5, rata_notifikasi=1,
+                      bacaan=0, awalan='uji')
+
+def _siapkan_uji_beban():
+    with app.app_context(), redirect_stdout(io.StringIO()):
+        jalankan_migrasi(cetak=lambda *_: None)
+        bangkitkan_data_sintetis(**UJI_BEBAN_DATA)
+
+def _pekerja_uji_beban(jumlah_operasi, nomor, membaca, mulai_bersama):
+    # Penulis menjalankan pola tandai_selesai (baca katalog dan stempel progres, lalu catat_penyelesaian
+    # untuk konten acak), pembaca membaca ledger seperti dashboard. Satu app context per operasi.
+    # Pengukuran dimulai bersamaan setelah semua proses selesai impor dan memanaskan cache katalog.
+    rng = random.Random(nomor)
+    try:
+        with app.app_context():
+            siswa = db.session.query(User.id, User.kelas).filter_by(peran='siswa').all()
+            for kelas in {k for _, k in siswa}:
+                ambil_katalog(kelas)
+    except BaseException:
+        mulai_bersama.abort()
+        raise
+    mulai_bersama.wait()
+    latensi, gagal = [], 0
+    for _ in range(jumlah_operasi):
+        user_id, kelas = rng.choice(siswa)
+        mulai = time.perf_counter()
+        with app.app_context():
+            try:
+                katalog = ambil_katalog(kelas)
+                stempel_progres(user_id)
+                if membaca:
+                    ambil_penguasaan(user_id)
+                else:
+                    konten_ids = [k.id for m in katalog.materis for k in m.kontens]
+                    catat_penyelesaian(user_id, [(rng.choice(konten_ids), waktu_utc_sekarang())])
+            except OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                db.session.rollback()
+                gagal += 1
+        latensi.append(time.perf_counter() - mulai)
+    return membaca, latensi, gagal
+
+def uji_beban_tulis(jumlah_penulis, jumlah_pembaca, jumlah_operasi, lingkungan):
+    # lingkungan: variabel RUMI_SQLITE_* untuk konfigurasi yang diuji. Mengembalikan ringkasan (jumlah
+    # operasi tulis, gagal terkunci, p50/p99 ms, durasi).
+    konteks_proses = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as folder:
+        # Proses spawn mewarisi os.environ saat dibuat; nilai lama dipulihkan setelah uji selesai
+        env = dict(lingkungan, RUMI_DATABASE=os.path.join(folder, 'uji.db'), RUMI_HASH_SLOT_DIR=folder,
+                   RUMI_HASH_METODE='pbkdf2:sha256:1', RUMI_ASET='0')
+        lama = {nama: os.environ.get(nama) for nama in env}
+        os.environ.update(env)
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=konteks_proses) as pool:
+                pool.submit(_siapkan_uji_beban).result()
+            jumlah_proses = jumlah_penulis + jumlah_pembaca
+            with konteks_proses.Manager() as manajer, \
+                    ProcessPoolExecutor(max_workers=jumlah_proses, mp_context=konteks_proses) as pool:
+                mulai_bersama = manajer.Barrier(jumlah_proses + 1)
+                tugas = [pool.submit(_pekerja_uji_beban, jumlah_operasi, n, n >= jumlah_penulis, mulai_bersama)
+                         for n in range(jumlah_proses)]
+                try:
+                    mulai_bersama.wait()
+                except threading.BrokenBarrierError:
+                    pass  # galat asli pekerja dimunculkan oleh t.result() di bawah
+                mulai = time.perf_counter()
+                hasil = [t.result() for t in tugas]
+                durasi = time.perf_counter() - mulai
+        finally:
+            for nama, nilai in lama.items():
+                if nilai is None:
+                    os.environ.pop(nama, None)
+                else:
+                    os.environ[nama] = nilai
+    latensi = sorted(l for membaca, daftar, _ in hasil if not membaca for l in daftar)
+    gagal = sum(g for membaca, _, g in hasil if not membaca)
+    persentil = lambda p: latensi[min(len(latensi) - 1, int(len(latensi) * p))] * 1000
+    return {'operasi': len(latensi), 'gagal': gagal, 'p50': persentil(0.50), 'p99': persentil(0.99), 'durasi': durasi}
+
+# --- PERINTAH CLI ---
+@app.cli.command('bangun-ulang-penguasaan')
+def bangun_ulang_penguasaan_command():
+    """Mengisi ulang ledger penguasaan materi dan statistik siswa dari ProgressSiswa."""
+    db.create_all()
+    bangun_ulang_penguasaan()
+    bangun_ulang_statistik()
+    print(f"Ledger penguasaan dibangun ulang: {PenguasaanMateri.query.count()} baris.")
+    print(f"Statistik siswa dibangun ulang: {StatistikSiswa.query.count()} baris.")
+
+@app.cli.command('migrasi-status-baca')
+def migrasi_status_baca_command():
+    """Membuat watermark status baca notifikasi dari flag sudah_dibaca lama."""
+    db.create_all()
+    migrasi_status_baca()
+    print(f"Watermark status baca dibuat untuk {PenandaBaca.query.count()} pengguna.")
+
+@app.cli.command('bangun-ulang-indeks-bacaan')
+def bangun_ulang_indeks_bacaan_command():
+    """Membangun ulang indeks pencarian FTS5 Pojok Baca."""
+    db.create_all()
+    bangun_ulang_fts_pojok_baca()
+    print(f"Indeks Pojok Baca dibangun ulang untuk {PojokBaca.query.count()} bacaan.")
+
+@app.cli.command('bangun-ulang-indeks-pengguna')
+def bangun_ulang_indeks_pengguna_command():
+    """Membangun ulang indeks pencarian FTS5 pengguna (dan trigger sinkronisasinya)."""
+    db.create_all()
+    bangun_ulang_fts_user()
+    print(f"Indeks pengguna dibangun ulang untuk {User.query.count()} akun.")
+
+@app.cli.command('impor-pengguna')
+@click.argument('berkas', type=click.Path(exists=True, dir_okay=False))
+@click.option('--pratinjau', is_flag=True, help='Hanya validasi, tanpa menyimpan.')
+def impor_pengguna_command(berkas, pratinjau):
+    """Mengimpor daftar pengguna (siswa, guru, orangtua) dari berkas CSV atau XLSX."""
+    db.create_all()
+    with open(berkas, 'rb') as aliran:
+        daftar = baca_berkas_impor(aliran, berkas)
+    mulai = time.monotonic()
+    hasil, jumlah_dibuat = impor_pengguna(daftar, simpan=not pratinjau)
+    for b in hasil:
+        if b.galat:
+            print(f"Baris {b.nomor} ({b.data.get('username') or '-'}): {'; '.join(b.galat)}")
+    jumlah_galat = sum(1 for b in hasil if b.galat)
+    if pratinjau:
+        print(f"Pratinjau: {len(hasil) - jumlah_galat} baris valid, {jumlah_galat} baris bergalat.")
+    else:
+        print(f"{jumlah_dibuat} pengguna diimpor, {jumlah_galat} baris dilewati ({time.monotonic() - mulai:.1f} detik).")
+
+@app.cli.command('migrasi-kode-pairing')
+def migrasi_kode_pairing_command():
+    """Memindahkan kode pairing dari kolom lama user.kode_pairing ke tabel kode_pairing."""
+    db.create_all()
+    print(f"{migrasi_kode_pairing()} kode pairing dipindahkan.")
+
+@app.cli.command('bersihkan-kode-pairing')
+def bersihkan_kode_pairing_command():
+    """Menghapus kode pairing yang sudah kedaluwarsa."""
+    print(f"{bersihkan_kode_pairing()} kode pairing kedaluwarsa dihapus.")
+
+@app.cli.command('bangun-aset')
+@click.option('--bersihkan', is_flag=True, help='Hapus berkas berhash lama yang tidak lagi ada di manifes.')
+def bangun_aset_command(bersihkan):
+    """Memperkecil CSS/JS, menulis nama berhash dan versi .gz ke static/dist (restart worker sesudahnya)."""
+    manifes = bangun_aset(app.static_folder)
+    for nama, hasil in sorted(manifes.items()):
+        asli = sum(os.path.getsize(os.path.join(app.static_folder, s)) for s in ASET_BUNDEL[nama])
+        path_hasil = os.path.join(app.static_folder, hasil)
+        print(f"{nama} -> {hasil} ({asli} -> {os.path.getsize(path_hasil)} byte, gzip {os.path.getsize(path_hasil + '.gz')} byte)")
+    if bersihkan:
+        print(f"{len(bersihkan_aset_lama(app.static_folder, manifes))} berkas lama dihapus.")
+
+@app.cli.command('backup-buat')
+def backup_buat_command():
+    """Membuat snapshot database terkompresi di BACKUP_DIR."""
+    entri = buat_snapshot(path_database())
+    print(f"Snapshot {entri['berkas']} dibuat ({entri['ukuran_asli']} -> {entri['ukuran']} byte).")
+
+@app.cli.command('backup-verifikasi')
+@click.argument('nama_berkas')
+def backup_verifikasi_command(nama_berkas):
+    """Memeriksa checksum dan integritas sebuah snapshot."""
+    try:
+        verifikasi_snapshot(nama_berkas)
+    except GagalBackup as e:
+        raise click.ClickException(str(e))
+    print(f"Snapshot {nama_berkas} valid.")
+
+@app.cli.command('backup-pulihkan')
+@click.argument('nama_berkas')
+@click.confirmation_option(prompt='Database aktif akan ditimpa. Hentikan aplikasi terlebih dahulu. Lanjutkan?')
+def backup_pulihkan_command(nama_berkas):
+    """Memulihkan database dari snapshot setelah snapshot diverifikasi."""
+    try:
+        verifikasi_snapshot(nama_berkas, simpan_ke=path_database())
+    except GagalBackup as e:
+        raise click.ClickException(str(e))
+    print(f"Database dipulihkan dari {nama_berkas}.")
+
+@app.cli.command('uji-beban-tulis')
+@click.option('--penulis', default=8, help='Jumlah proses penulis (meniru worker gunicorn).')
+@click.option('--pembaca', default=4, help='Jumlah proses pembaca bersamaan.')
+@click.option('--operasi', default=200, help='Jumlah transaksi per proses.')
+def uji_beban_tulis_command(penulis, pembaca, operasi):
+    """Membandingkan error 'database is locked' dan latensi tulis: SQLite bawaan vs lapisan engine RUMI."""
+    konfigurasi = (
+        ('sebelum: bawaan, BEGIN deferred', {'RUMI_SQLITE_PROFIL': 'bawaan', 'RUMI_SQLITE_POOL_BACA': '0',
+                                             'RUMI_SQLITE_SERIAL_TULIS': '0'}),
+        (f'sesudah: {SQLITE_PROFIL}, BEGIN IMMEDIATE', {'RUMI_SQLITE_PROFIL': SQLITE_PROFIL, 'RUMI_SQLITE_POOL_BACA': '1',
+                                                      'RUMI_SQLITE_SERIAL_TULIS': '1' if SQLITE_SERIAL_TULIS else '0'}),
+    )
+    print(f"{'konfigurasi':<32}{'tulis':>7}{'terkunci':>10}{'p50 ms':>9}{'p99 ms':>9}{'durasi s':>10}")
+    for label, lingkungan in konfigurasi:
+        h = uji_beban_tulis(penulis, pembaca, operasi, lingkungan)
+        print(f"{label:<32}{h['operasi']:>7}{h['gagal']:>10}{h['p50']:>9.1f}{h['p99']:>9.1f}{h['durasi']:>10.1f}")
+
+@app.cli.command('migrasi')
+def migrasi_command():
+    """Membuat tabel yang belum ada lalu menjalankan langkah migrasi skema yang tertunda."""
+    versi_awal, versi_akhir = jalankan_migrasi()
+    if versi_awal == versi_akhir:
+        print(f"Skema sudah terbaru (versi {versi_akhir}).")
+    else:
+        print(f"Skema dimigrasikan dari versi {versi_awal} ke {versi_akhir}.")
+
+@app.cli.command('cek-rencana-query')
+def cek_rencana_query_command():
+    """Menjalankan EXPLAIN QUERY PLAN untuk SQL rute utama; gagal bila ada yang menjadi full scan."""
+    try:
+        subjek = subjek_benchmark()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    hasil = periksa_rencana_query(db.engine, rekam_sql_rute(skenario_rencana_query(subjek)))
+    mundur = 0
+    for nama, daftar in hasil.items():
+        gagal = [(statement, rencana) for statement, rencana, scan in daftar if scan]
+        print(f"[{'GAGAL' if gagal else 'OK'}] {nama} ({len(daftar)} query)")
+        for statement, rencana in gagal:
+            print(f"    {' '.join(statement.split())}")
+            for langkah in rencana:
+                print(f"        {langkah}")
+        mundur += bool(gagal)
+    if mundur:
+        raise click.ClickException(f"{mundur} rute menjalankan query dengan full scan.")
+
+
+@app.cli.command('bangkitkan-data')
+@click.option('--sekolah', default=3, help='Jumlah sekolah.')
+@click.option('--guru', 'guru_per_sekolah', default=4, help='Jumlah guru per sekolah.')
+@click.option('--siswa-per-kelas', default=60, help='Jumlah siswa per kelas (7, 8, 9) per sekolah.')
+@click.option('--tp-per-kelas', default=4, help='Jumlah tujuan pembelajaran per kelas.')
+@click.option('--materi-per-tp', default=3, help='Jumlah materi pokok per TP.')
+@click.option('--konten-per-materi', default=6, help='Jumlah konten belajar per materi.')
+@click.option('--rata-progres', default=20, help='Rata-rata konten selesai per siswa (distribusi berekor panjang).')
+@click.option('--rata-notifikasi', default=6, help='Rata-rata notifikasi langsung per siswa.')
+@click.option('--bacaan', default=300, help='Jumlah bacaan Pojok Baca.')
+@click.option('--awalan', default='sintetis', help='Awalan username agar beberapa set data bisa hidup berdampingan.')
+@click.option('--seed', default=1, help='Seed acak agar data dapat dibuat ulang persis sama.')
+def bangkitkan_data_command(**opsi):
+    """Mengisi database dengan data sintetis berskala besar untuk pengujian kinerja."""
+    jalankan_migrasi(cetak=lambda *_: None)
+    mulai = time.perf_counter()
+    try:
+        jumlah = bangkitkan_data_sintetis(**opsi)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for tabel, n in jumlah.items():
+        print(f"{tabel:<22}{n:>10}")
+    print(f"Selesai dalam {time.perf_counter() - mulai:.1f} detik. Password semua akun: {SINTETIS_PASSWORD}")
+
+@app.cli.command('benchmark-rute')
+@click.option('--ulang', default=50, type=click.IntRange(1), help='Jumlah request terukur per rute (setelah satu request pemanasan).')
+@click.option('--ulang-memori', default=3, help='Jumlah request tambahan per rute untuk mengukur memori puncak.')
+@click.option('--keluaran', type=click.Path(dir_okay=False), help='Simpan hasil sebagai JSON.')
+@click.option('--banding', type=click.Path(exists=True, dir_okay=False), help='Hasil JSON sebelumnya sebagai pembanding.')
+def benchmark_rute_command(ulang, ulang_memori, keluaran, banding):
+    """Mengukur latensi p50/p95/p99, jumlah query dan memori puncak rute utama lewat test client."""
+    try:
+        hasil = jalankan_benchmark(ulang, ulang_memori)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    laporan = {
+        'waktu': waktu_utc_sekarang().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0], 'sqlite': sqlite3.sqlite_version,
+        'profil_sqlite': SQLITE_PROFIL, 'ulang': ulang, 'data': ukuran_data(), 'rute': hasil,
+    }
+    lama = {}
+    if banding:
+        with open(banding) as f:
+            lama = json.load(f).get('rute', {})
+    print(f"{'rute':<22}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'query':>7}{'mem KB':>8}  status")
+    for nama, h in hasil.items():
+        baris = (f"{nama:<22}{h['p50_ms']:>9.1f}{h['p95_ms']:>9.1f}{h['p99_ms']:>9.1f}"
+                 f"{h['query_maks']:>7}{h['memori_puncak_kb']:>8}  {','.join(map(str, h['status']))}")
+        if nama in lama:
+            baris += (f"  (p95 {h['p95_ms'] - lama[nama]['p95_ms']:+.1f} ms,"
+                      f" query {h['query_maks'] - lama[nama]['query_maks']:+d})")
+        print(baris)
+    if keluaran:
+        with open(keluaran, 'w') as f:
+            json.dump(laporan, f, indent=2)
+        print(f"Hasil disimpan ke {keluaran}.")
+
+@app.cli.command('cek-jumlah-query')
+@click.option('--ulang', default=3, type=click.IntRange(1), help='Jumlah request terukur per rute.')
+def cek_jumlah_query_command(ulang):
+    """Memastikan jumlah query tiap rute utama tidak melewati BATAS_QUERY (mendeteksi N+1)."""
+    try:
+        hasil = jalankan_benchmark(ulang, 0)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    lewat = 0
+    for nama, h in hasil.items():
+        batas = BATAS_QUERY.get(nama)
+        gagal = batas is not None and h['query_maks'] > batas
+        print(f"[{'GAGAL' if gagal else 'OK'}] {nama:<22}{h['query_maks']:>4} query (batas {batas if batas is not None else '-'})")
+        lewat += gagal
+    if lewat:
+        raise click.ClickException(f"{lewat} rute melewati batas jumlah query.")
 
    # if __name__ == '__main__':
     # Blok ini akan membuat tabel dan badge awal setiap kali aplikasi dijalankan.
@@ -19,6 +19,191 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Antrean Progres: penyelesaian konten disimpan di localStorage lalu dikirim per batch,
+    // sehingga klik tetap tercatat walau koneksi putus-sambung. Hanya halaman siswa yang mengirimnya:
+    // /progres/sinkron khusus siswa, peran lain hanya akan mendapat redirect.
+    const halamanSiswa = document.body.dataset.peran === 'siswa';
+    const ANTREAN_KEY = 'rumi-antrean-progres';
+    const UKURAN_BATCH = 50;
+    let sedangMengirim = null;
+
+    function bacaAntrean() {
+        try {
+            return JSON.parse(localStorage.getItem(ANTREAN_KEY)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function simpanAntrean(antrean) {
+        try {
+            localStorage.setItem(ANTREAN_KEY, JSON.stringify(antrean));
+        } catch (e) {
+            console.error('Gagal menyimpan antrean progres:', e);
+        }
+    }
+
+    function antreProgres(kontenId) {
+        const antrean = bacaAntrean();
+        antrean.push({ konten_id: parseInt(kontenId, 10), waktu: new Date().toISOString() });
+        simpanAntrean(antrean);
+    }
+
+    function kirimAntrean() {
+        if (!halamanSiswa) {
+            return Promise.resolve(null);
+        }
+        if (sedangMengirim) {
+            return sedangMengirim;
+        }
+        const batch = bacaAntrean().slice(0, UKURAN_BATCH);
+        if (batch.length === 0) {
+            return Promise.resolve(null);
+        }
+        sedangMengirim = fetch('/progres/sinkron', {
+            method: 'POST',
+            // X-Rumi-Delta: lencana baru ditampilkan dari respons ini, bukan lewat flash di halaman berikutnya
+            headers: { 'Content-Type': 'application/json', 'X-Rumi-Delta': '1' },
+            body: JSON.stringify({ penyelesaian: batch })
+        })
+        .then(response => response.ok ? response.json() : Promise.reject(response.status))
+        .then(data => {
+            // Buang item yang sudah terkirim; item baru yang masuk selama pengiriman tetap di antrean
+            simpanAntrean(bacaAntrean().slice(batch.length));
+            sedangMengirim = null;
+            terapkanDelta(data);
+            if (bacaAntrean().length > 0) {
+                return kirimAntrean().then(() => data);
+            }
+            return data;
+        })
+        .catch(error => {
+            sedangMengirim = null;
+            console.error('Sinkron progres tertunda:', error);
+            return null;
+        });
+        return sedangMengirim;
+    }
+
+    // Delta Progres: respons sinkron berisi status terbaru materi yang disentuh, jadi centang, kunci tahap,
+    // persentase dan rekomendasi diperbarui di tempat tanpa memuat ulang halaman.
+    function buatIkon(kelas) {
+        const ikon = document.createElement('i');
+        ikon.className = kelas;
+        return ikon;
+    }
+
+    function tampilkanPesan(teks, kategori) {
+        let wadah = document.getElementById('pesanDelta');
+        if (!wadah) {
+            wadah = document.createElement('div');
+            wadah.id = 'pesanDelta';
+            wadah.style.cssText = 'position: fixed; top: 1rem; right: 1rem; z-index: 1050; width: auto; max-width: 400px;';
+            document.body.appendChild(wadah);
+        }
+        const alert = document.createElement('div');
+        alert.className = `alert alert-${kategori} alert-dismissible fade show`;
+        alert.setAttribute('role', 'alert');
+        alert.textContent = teks;
+        const tutup = document.createElement('button');
+        tutup.type = 'button';
+        tutup.className = 'btn-close';
+        tutup.setAttribute('data-bs-dismiss', 'alert');
+        tutup.setAttribute('aria-label', 'Close');
+        alert.appendChild(tutup);
+        wadah.appendChild(alert);
+        setTimeout(function() {
+            new bootstrap.Alert(alert).close();
+        }, 5000);
+    }
+
+    function tampilkanRekomendasi(halaman, berikutnya) {
+        halaman.querySelectorAll('.badge-berikutnya').forEach(badge => badge.remove());
+        const wadah = halaman.querySelector('#rekomendasiBerikutnya');
+        if (wadah) {
+            wadah.replaceChildren();
+        }
+        if (!berikutnya) {
+            return;
+        }
+        if (berikutnya.konten_id) {
+            const judul = halaman.querySelector(`.view-content-btn[data-konten-id="${berikutnya.konten_id}"] strong`);
+            if (judul) {
+                const badge = document.createElement('span');
+                badge.className = 'badge bg-primary ms-2 badge-berikutnya';
+                badge.textContent = 'Berikutnya';
+                judul.after(badge);
+            }
+        } else if (wadah) {
+            const alert = document.createElement('div');
+            alert.className = 'alert alert-success';
+            alert.textContent = 'Materi ini sudah tuntas. Lanjut ke: ';
+            const tautan = document.createElement('a');
+            tautan.className = 'alert-link';
+            tautan.href = berikutnya.url;
+            tautan.textContent = berikutnya.judul;
+            alert.appendChild(tautan);
+            wadah.appendChild(alert);
+        }
+    }
+
+    function terapkanProgresMateri(progres) {
+        document.querySelectorAll(`[data-materi-progres="${progres.materi_id}"]`).forEach(bar => {
+            bar.style.width = `${progres.persen}%`;
+            bar.setAttribute('aria-valuenow', progres.persen);
+            bar.textContent = `${progres.persen}%`;
+        });
+        const halaman = document.querySelector(`[data-materi-id="${progres.materi_id}"]`);
+        if (!halaman || !progres.tahap) {
+            return;
+        }
+        progres.konten_ids_selesai.forEach(kontenId => {
+            const item = halaman.querySelector(`.view-content-btn[data-konten-id="${kontenId}"]`);
+            if (item && !item.querySelector(':scope > .fa-check-circle')) {
+                item.appendChild(buatIkon('fas fa-check-circle fa-2x text-success'));
+            }
+        });
+        Object.entries(progres.tahap).forEach(([alur, status]) => {
+            const tombol = halaman.querySelector(`[data-alur="${alur}"]`);
+            if (!tombol) {
+                return;
+            }
+            tombol.disabled = !status.terbuka;
+            tombol.querySelectorAll('.fa-lock, .fa-check-circle').forEach(ikon => ikon.remove());
+            if (!status.terbuka) {
+                tombol.appendChild(buatIkon('fas fa-lock ms-2'));
+            } else if (status.selesai) {
+                tombol.appendChild(buatIkon('fas fa-check-circle text-success ms-2'));
+            }
+        });
+        tampilkanRekomendasi(halaman, progres.berikutnya);
+    }
+
+    function terapkanDelta(data) {
+        if (!data) {
+            return;
+        }
+        (data.progres || []).forEach(terapkanProgresMateri);
+        (data.lencana_baru || []).forEach(lencana => {
+            tampilkanPesan(`${lencana.emoji} Selamat! Anda mendapatkan lencana baru: "${lencana.nama}"`, 'success');
+        });
+    }
+
+    if (halamanSiswa) {
+        window.addEventListener('online', kirimAntrean);
+        setInterval(kirimAntrean, 30000);
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'hidden' && bacaAntrean().length > 0 && navigator.sendBeacon) {
+                const batch = bacaAntrean().slice(0, UKURAN_BATCH);
+                const blob = new Blob([JSON.stringify({ penyelesaian: batch })], { type: 'application/json' });
+                if (navigator.sendBeacon('/progres/sinkron', blob)) {
+                    simpanAntrean(bacaAntrean().slice(batch.length));
+                }
+            }
+        });
+        kirimAntrean();
+    }
+
     // Fitur Modal Konten & Pelaporan Progres
     const contentModal = document.getElementById('contentModal');
     if (contentModal) {
@@ -31,27 +216,21 @@ document.addEventListener('DOMContentLoaded', function() {
                 const contentTitle = button.getAttribute('data-title');
                 const kontenId = button.getAttribute('data-konten-id');
 
-                fetch(`/konten/${kontenId}/selesai`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' }
-                })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.status === 'ok') {
-                        const modalTitle = contentModal.querySelector('.modal-title');
-                        const contentFrame = contentModal.querySelector('#contentFrame');
-                        modalTitle.textContent = contentTitle;
-                        contentFrame.src = contentUrl;
-                        
-                        const modal = new bootstrap.Modal(contentModal);
-                        modal.show();
-
-                        contentModal.addEventListener('hidden.bs.modal', function () {
-                            location.reload();
-                        }, { once: true });
-                    }
-                })
-                .catch(error => console.error('Error:', error));
+                antreProgres(kontenId);
+                kirimAntrean();
+
+                const modalTitle = contentModal.querySelector('.modal-title');
+                const contentFrame = contentModal.querySelector('#contentFrame');
+                modalTitle.textContent = contentTitle;
+                contentFrame.src = contentUrl;
+                
+                const modal = new bootstrap.Modal(contentModal);
+                modal.show();
+
+                // Sisa antrean dikirim saat modal ditutup; halaman diperbarui dari respons delta
+                contentModal.addEventListener('hidden.bs.modal', function () {
+                    kirimAntrean();
+                }, { once: true });
             }
         });
 
@@ -123,24 +302,194 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
-    // Fitur Tandai Notifikasi Dibaca
+    // Fitur Dropdown Notifikasi: isi dimuat saat lonceng dibuka, lalu ditandai sudah dibaca
     const notificationDropdown = document.getElementById('notificationDropdown');
-    if (notificationDropdown) {
+    const notificationList = document.getElementById('notificationList');
+
+    function renderNotifikasi(daftar) {
+        notificationList.innerHTML = '';
+        if (daftar.length === 0) {
+            const li = document.createElement('li');
+            li.innerHTML = '<span class="dropdown-item">Tidak ada notifikasi</span>';
+            notificationList.appendChild(li);
+            return;
+        }
+        daftar.forEach(notif => {
+            const li = document.createElement('li');
+            const item = document.createElement('div');
+            item.className = 'dropdown-item' + (notif.sudah_dibaca ? ' text-muted' : '');
+            item.style.whiteSpace = 'normal';
+            item.style.width = '350px';
+            const isi = document.createElement('p');
+            isi.className = 'mb-1 small' + (notif.sudah_dibaca ? '' : ' fw-bold');
+            isi.textContent = notif.konten;
+            const info = document.createElement('small');
+            const label = notif.kanal === 'siaran' ? 'Pengumuman dari' : 'Dari';
+            info.textContent = `${label}: ${notif.pengirim} \u2022 ${notif.waktu}`;
+            item.appendChild(isi);
+            item.appendChild(info);
+            li.appendChild(item);
+            notificationList.appendChild(li);
+        });
+    }
+
+    if (notificationDropdown && notificationList) {
         notificationDropdown.addEventListener('click', function() {
             const unreadBadge = this.querySelector('.badge');
-            if (unreadBadge) {
-                // Kirim request ke server untuk menandai sudah dibaca
-                fetch('/notifikasi/baca', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' }
-                }).then(response => response.json())
-                  .then(data => {
-                      if (data.status === 'ok') {
-                          // Hilangkan badge angka setelah diklik
-                          unreadBadge.remove();
-                      }
-                  });
+            fetch('/notifikasi')
+                .then(response => response.json())
+                .then(data => {
+                    renderNotifikasi(data.notifikasi);
+                    if (data.belum_dibaca > 0 || unreadBadge) {
+                        // Kirim request ke server untuk menandai sudah dibaca
+                        return fetch('/notifikasi/baca', {
+                            method: 'POST',
+                            headers: { 'Content-Type': 'application/json' }
+                        }).then(response => response.json())
+                          .then(data => {
+                              if (data.status === 'ok' && unreadBadge) {
+                                  // Hilangkan badge angka setelah diklik
+                                  unreadBadge.remove();
+                              }
+                          });
+                    }
+                })
+                .catch(error => console.error('Error:', error));
+        });
+    }
+
+    // Kanal Push: lonceng dan progres diperbarui lewat server-sent events, tanpa memuat ulang halaman
+    function perbaruiLonceng(jumlah) {
+        if (!notificationDropdown) {
+            return;
+        }
+        let unreadBadge = notificationDropdown.querySelector('.badge');
+        if (jumlah > 0) {
+            if (!unreadBadge) {
+                unreadBadge = document.createElement('span');
+                unreadBadge.className = 'badge rounded-pill bg-danger';
+                unreadBadge.style.fontSize = '0.6em';
+                notificationDropdown.appendChild(unreadBadge);
+            }
+            unreadBadge.textContent = jumlah;
+        } else if (unreadBadge) {
+            unreadBadge.remove();
+        }
+    }
+
+    // Kanal hanya dibuka bila server menahan koneksi (data-push, worker gthread/gevent); tanpa itu
+    // EventSource hanya menjadi polling tiap PUSH_RETRY_MS. Koneksi ditutup selama tab tersembunyi.
+    let aliran = null;
+    let stempelTerakhir = '';
+
+    function bukaAliran() {
+        if (aliran) {
+            return;
+        }
+        aliran = new EventSource('/pembaruan?sejak=' + encodeURIComponent(stempelTerakhir));
+        aliran.addEventListener('stempel', function(event) {
+            stempelTerakhir = JSON.parse(event.data).stempel;
+        });
+        aliran.addEventListener('notifikasi', function(event) {
+            perbaruiLonceng(JSON.parse(event.data).belum_dibaca);
+        });
+        aliran.addEventListener('progres', function(event) {
+            document.dispatchEvent(new CustomEvent('rumi:progres', { detail: JSON.parse(event.data) }));
+        });
+    }
+
+    function tutupAliran() {
+        if (aliran) {
+            aliran.close();
+            aliran = null;
+        }
+    }
+
+    if ('push' in document.body.dataset && notificationDropdown && window.EventSource) {
+        bukaAliran();
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'hidden') {
+                tutupAliran();
+            } else {
+                bukaAliran();
+            }
+        });
+    }
+
+    // Tanpa kanal push (worker sync): tanya /pembaruan/cek setiap data-pembaruan-cek detik. Request ini
+    // langsung dijawab dengan perubahan sejak stempel terakhir, jadi tidak menahan worker. Pengecekan
+    // pertama hanya mengambil stempel; selama tab tersembunyi pengecekan dilewati.
+    function cekPembaruan() {
+        if (document.visibilityState === 'hidden') {
+            return;
+        }
+        fetch('/pembaruan/cek?sejak=' + encodeURIComponent(stempelTerakhir))
+            .then(response => (response.ok && !response.redirected) ? response.json() : null)
+            .then(data => {
+                if (!data) {
+                    return;
+                }
+                stempelTerakhir = data.stempel;
+                if (data.notifikasi) {
+                    perbaruiLonceng(data.notifikasi.belum_dibaca);
+                }
+                if (data.progres) {
+                    document.dispatchEvent(new CustomEvent('rumi:progres', { detail: data.progres }));
+                }
+            })
+            .catch(error => console.error('Error:', error));
+    }
+
+    const jedaCekPembaruan = parseInt(document.body.dataset.pembaruanCek || '0', 10);
+    if (!('push' in document.body.dataset) && notificationDropdown && jedaCekPembaruan > 0) {
+        cekPembaruan();
+        setInterval(cekPembaruan, jedaCekPembaruan * 1000);
+    }
+
+    // Progres berubah di tempat lain (tab atau perangkat lain): ambil status terbaru materi yang tampil
+    // di halaman ini lalu terapkan seperti respons delta tandai_selesai.
+    document.addEventListener('rumi:progres', function() {
+        if (!halamanSiswa) {
+            return;
+        }
+        const materiIds = new Set();
+        document.querySelectorAll('[data-materi-id], [data-materi-progres]').forEach(el => {
+            materiIds.add(el.dataset.materiId || el.dataset.materiProgres);
+        });
+        if (materiIds.size === 0) {
+            return;
+        }
+        fetch('/progres/delta?materi=' + [...materiIds].join(','))
+            .then(response => response.ok ? response.json() : null)
+            .then(terapkanDelta)
+            .catch(error => console.error('Gagal memuat progres terbaru:', error));
+    });
+
+    // Saran pencarian Pojok Baca saat mengetik
+    const pojokBacaSearch = document.getElementById('pojokBacaSearch');
+    const saranBacaan = document.getElementById('saranBacaan');
+    if (pojokBacaSearch && saranBacaan) {
+        let timerSaran = null;
+        pojokBacaSearch.addEventListener('input', function() {
+            clearTimeout(timerSaran);
+            const kataKunci = pojokBacaSearch.value.trim();
+            if (kataKunci.length < 2) {
+                saranBacaan.innerHTML = '';
+                return;
             }
+            timerSaran = setTimeout(function() {
+                fetch('/pojok-baca/saran?q=' + encodeURIComponent(kataKunci))
+                    .then(response => response.json())
+                    .then(data => {
+                        saranBacaan.innerHTML = '';
+                        data.saran.forEach(judul => {
+                            const opsi = document.createElement('option');
+                            opsi.value = judul;
+                            saranBacaan.appendChild(opsi);
+                        });
+                    })
+                    .catch(() => {});
+            }, 250);
         });
     }
-});
\ No newline at end of file
+});
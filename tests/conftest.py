@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+# Database, hash dan aset diatur lewat environment sebelum app diimpor: app.py membaca konfigurasinya saat impor.
+_folder_uji = tempfile.mkdtemp(prefix='rumi-uji-')
+os.environ['RUMI_DATABASE'] = os.path.join(_folder_uji, 'uji.db')
+os.environ.setdefault('RUMI_HASH_METODE', 'pbkdf2:sha256:1')
+os.environ.setdefault('RUMI_ASET', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as rumi  # noqa: E402
+
+# Data sintetis kecil: cukup banyak siswa per kelas agar pola N+1 melewati BATAS_QUERY.
+UKURAN_DATA_UJI = dict(sekolah=1, guru_per_sekolah=2, siswa_per_kelas=12, tp_per_kelas=2, materi_per_tp=2,
+                       konten_per_materi=6, rata_progres=8, rata_notifikasi=4, bacaan=40)
+
+
+@pytest.fixture(scope='session')
+def app():
+    rumi.app.config['TESTING'] = True
+    with rumi.app.app_context():
+        rumi.jalankan_migrasi(cetak=lambda *_: None)
+        rumi.bangkitkan_data_sintetis(**UKURAN_DATA_UJI)
+        rumi.db.session.remove()
+    return rumi.app
+
+
+@pytest.fixture(scope='session')
+def subjek(app):
+    with app.app_context():
+        hasil = rumi.subjek_benchmark()
+        rumi.db.session.remove()
+    return hasil
+
+
+@pytest.fixture
+def klien_untuk(app):
+    # Test client yang sudah login sebagai pengguna tertentu
+    return rumi.klien_sebagai
+
+
+@pytest.fixture
+def siswa_baru(app, subjek):
+    # Siswa tanpa progres di kelas dan sekolah yang sama dengan subjek benchmark.
+    nomor = [0]
+
+    def buat():
+        nomor[0] += 1
+        with app.app_context():
+            siswa = rumi.User(nama_lengkap=f'Siswa Uji {nomor[0]}', nama_sekolah=subjek['siswa'].nama_sekolah,
+                              username=f'uji_{os.urandom(4).hex()}', peran='siswa', kelas=subjek['siswa'].kelas)
+            rumi.db.session.add(siswa)
+            rumi.db.session.commit()
+            rumi.db.session.refresh(siswa)
+            rumi.db.session.expunge(siswa)
+            rumi.db.session.remove()
+        return siswa
+    return buat
+
+
+@pytest.fixture
+def rekam_sql(app):
+    # with rekam_sql() as sql: ... -> sql berisi (statement, parameter) setiap query di semua engine (tulis dan baca).
+    @contextmanager
+    def rekam():
+        sql = []
+
+        def catat(koneksi, kursor, statement, parameter, konteks, executemany):
+            sql.append((statement, parameter))
+
+        with app.app_context():
+            mesin_list = list(rumi.db.engines.values())
+        for mesin in mesin_list:
+            event.listen(mesin, 'before_cursor_execute', catat)
+        try:
+            yield sql
+        finally:
+            for mesin in mesin_list:
+                event.remove(mesin, 'before_cursor_execute', catat)
+    return rekam
@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import app as rumi
+
+# Program kecil yang mencetak hasil setiap bentuk sintaks yang rawan bagi pemerkecil: hasil node untuk
+# sumber asli dan hasil perkecil_js harus sama persis.
+JS_RAWAN = r"""
+// komentar baris
+const url = "http://contoh.id/a//b"; /* komentar blok */
+const pola = '/* bukan komentar */';
+const a = 10, b = 2, c = 5;
+const bagi = a / b / c;
+const bagiKurung = (a + b) / (c - 1);
+const regex = /[/]+\/\//g;
+const regexKelas = "x//y/z".split(/[/]/).length;
+const nama = 'Rumi';
+const templat = `halo ${nama} // tetap ${a / b}`;
+const tambah = a + +b - -c;
+let d = a
+let e = b
+d++
+e--
+const obj = {k: /a\/b/.test('a/b'), l: [1, 2].map(x => x / 2)};
+let i = 4, j = 9
+const postfix = i++ / 2, garis = '  a  /  b  ';
+const postfixKurang = j-- / 3 / 1, garis2 = "  c  /  d  ";
+function cocok(s) { return /\/\/  x/.test(s) }
+function tipe() { return typeof /a  b/ }
+console.log(JSON.stringify([url, pola, bagi, bagiKurung, "a//b///c".replace(regex, '|'), regexKelas,
+                            templat, tambah, d, e, obj, i, j, postfix, garis, postfixKurang, garis2,
+                            cocok('//  x'), cocok('/ x'), tipe()]));
+"""
+
+
+def test_js_string_komentar_regex_dan_pembagian():
+    hasil = rumi.perkecil_js(JS_RAWAN)
+    assert '// komentar' not in hasil and 'komentar blok' not in hasil
+    assert '"http://contoh.id/a//b"' in hasil
+    assert "'/* bukan komentar */'" in hasil
+    assert '/[/]+\\/\\//g' in hasil
+    assert '`halo ${nama} // tetap ${a / b}`' in hasil
+    # Spasi di sekitar '/' pembagian dibiarkan agar tidak pernah menyatu menjadi '//' atau '/*'
+    assert 'bagi=a / b / c;' in hasil
+    # `a + +b` tidak boleh menjadi `a++b`, dan baris baru dipertahankan untuk automatic semicolon insertion
+    assert 'a + +b - -c' in hasil
+    assert 'let d=a\nlet e=b\nd++\ne--' in hasil
+    # '/' setelah ++/-- postfix adalah pembagian; setelah `return`/`typeof` membuka literal regex
+    assert "postfix=i++ / 2,garis='  a  /  b  ';" in hasil
+    assert 'postfixKurang=j-- / 3 / 1,garis2="  c  /  d  ";' in hasil
+    assert 'return /\\/\\/  x/.test(s)' in hasil
+    assert 'return typeof /a  b/' in hasil
+    assert len(hasil) < len(JS_RAWAN)
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node tidak tersedia')
+def test_js_hasil_perkecil_berperilaku_sama_di_node(tmp_path):
+    def jalankan(sumber):
+        berkas = tmp_path / 'uji.js'
+        berkas.write_text(sumber)
+        return subprocess.run(['node', str(berkas)], capture_output=True, text=True, check=True).stdout
+
+    assert jalankan(rumi.perkecil_js(JS_RAWAN)) == jalankan(JS_RAWAN)
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node tidak tersedia')
+def test_main_js_hasil_perkecil_lolos_node_check(tmp_path):
+    with open(os.path.join(rumi.app.static_folder, 'js', 'main.js'), encoding='utf-8') as f:
+        sumber = f.read()
+    berkas = tmp_path / 'main.min.js'
+    berkas.write_text(rumi.perkecil_js(sumber))
+    proses = subprocess.run(['node', '--check', str(berkas)], capture_output=True, text=True)
+    assert proses.returncode == 0, proses.stderr
+
+
+def test_css_komentar_dibuang_string_dipertahankan():
+    sumber = """
+    /* judul */
+    .kartu > h2 ,  .kartu p {
+        color: red ;
+        margin: 0 auto;
+    }
+    .menu :hover { color: blue; }
+    .ikon::before { content: "/* bukan komentar */"; }
+    .latar { background: url('gambar/a b.png'); }
+    """
+    hasil = rumi.perkecil_css(sumber)
+    # Spasi sebelum ':' dipertahankan karena bermakna di selektor (`.menu :hover` berbeda dari `.menu:hover`)
+    assert hasil == ('.kartu>h2,.kartu p{color:red;margin:0 auto}.menu :hover{color:blue}'
+                     '.ikon::before{content:"/* bukan komentar */"}'
+                     ".latar{background:url('gambar/a b.png')}\n")
+
+
+@pytest.fixture
+def folder_statis(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'css' / 'style.css').write_text('/* x */ body { color : red ; }\n')
+    (tmp_path / 'js' / 'main.js').write_text('// x\nconst a = 1 ;\n')
+    return tmp_path
+
+
+def test_bangun_aset_menulis_manifes_dan_gz(folder_statis):
+    manifes = rumi.bangun_aset(str(folder_statis))
+    assert set(manifes) == {'css/style.css', 'js/main.js'}
+    for nama, hasil in manifes.items():
+        path_hasil = folder_statis / hasil
+        assert hasil.startswith('dist/') and path_hasil.exists()
+        assert gzip.decompress((path_hasil.parent / (path_hasil.name + '.gz')).read_bytes()) == path_hasil.read_bytes()
+    assert json.loads((folder_statis / 'dist' / 'manifest.json').read_text()) == manifes
+    assert rumi.muat_manifes_aset(str(folder_statis)) == manifes
+    # Isi sama menghasilkan nama sama; isi baru menghasilkan nama baru dan berkas lama bisa dibersihkan
+    assert rumi.bangun_aset(str(folder_statis)) == manifes
+    (folder_statis / 'js' / 'main.js').write_text('const b = 2;\n')
+    baru = rumi.bangun_aset(str(folder_statis))
+    assert baru['js/main.js'] != manifes['js/main.js']
+    dihapus = rumi.bersihkan_aset_lama(str(folder_statis), baru)
+    assert sorted(dihapus) == sorted([os.path.basename(manifes['js/main.js']), os.path.basename(manifes['js/main.js']) + '.gz'])
+
+
+def test_muat_manifes_tanpa_build(folder_statis):
+    assert rumi.muat_manifes_aset(str(folder_statis)) == {}
+    manifes = rumi.bangun_aset(str(folder_statis))
+    os.remove(folder_statis / manifes['css/style.css'])
+    assert rumi.muat_manifes_aset(str(folder_statis)) == {'js/main.js': manifes['js/main.js']}
+
+
+def test_aset_berhash_dari_manifes_disajikan_immutable(app, tmp_path, monkeypatch):
+    folder = tmp_path / 'static'
+    shutil.copytree(app.static_folder, folder, ignore=shutil.ignore_patterns(rumi.ASET_FOLDER_HASIL))
+    rumi.bangun_aset(str(folder))
+    manifes = rumi.muat_manifes_aset(str(folder))
+    monkeypatch.setattr(app, 'static_folder', str(folder))
+    monkeypatch.setattr(rumi, 'ASET_MANIFES', manifes)
+    monkeypatch.setattr(rumi, 'ASET_BERHASH', frozenset(manifes.values()))
+
+    klien = app.test_client()
+    assert f"/static/{manifes['js/main.js']}" in klien.get('/login').get_data(as_text=True)
+    respons = klien.get(f"/static/{manifes['css/style.css']}", headers={'Accept-Encoding': 'gzip'})
+    assert respons.status_code == 200 and respons.headers['Content-Encoding'] == 'gzip'
+    assert respons.mimetype == 'text/css' and 'immutable' in respons.headers['Cache-Control']
+    respons.close()
+    respons = klien.get('/static/css/style.css')
+    assert respons.status_code == 200 and 'immutable' not in respons.headers.get('Cache-Control', '')
+    respons.close()
@@ -0,0 +1,101 @@
+import re
+
+import pytest
+from flask import before_render_template, template_rendered
+
+import app as rumi
+
+# Tabel yang boleh dibaca saat menjawab 304: pengguna (login), versi katalog, statistik siswa
+# (stempel progres), notifikasi untuk angka lonceng, dan stempel Pojok Baca.
+TABEL_STEMPEL = {model.__tablename__ for model in (rumi.User, rumi.VersiKatalog, rumi.StatistikSiswa, rumi.Notifikasi,
+                                                   rumi.NotifikasiSiaran, rumi.PenandaBaca, rumi.PojokBaca)}
+
+
+def tabel_dibaca(statement):
+    return set(re.findall(r'\b(?:FROM|JOIN)\s+"?(\w+)', statement))
+
+
+@pytest.fixture
+def url_halaman(app, subjek):
+    with app.app_context():
+        materi_id = rumi.ambil_katalog(subjek['siswa'].kelas).materis[0].id
+    return {
+        'jalur_belajar_304': '/jalur-belajar',
+        'materi_detail_304': f'/materi/{materi_id}',
+        'pojok_baca_304': f"/pojok-baca?q={subjek['kata_bacaan']}",
+    }
+
+
+@pytest.mark.parametrize('nama', ['jalur_belajar_304', 'materi_detail_304', 'pojok_baca_304'])
+def test_304_tanpa_render_dan_hanya_membaca_stempel(app, subjek, klien_untuk, rekam_sql, url_halaman, nama):
+    klien = klien_untuk(subjek['siswa'])
+    pertama = klien.get(url_halaman[nama])
+    assert pertama.status_code == 200
+    etag = pertama.headers['ETag']
+
+    dirender = []
+
+    def catat_render(pengirim, template, context, **extra):
+        dirender.append(template.name)
+
+    with template_rendered.connected_to(catat_render, app), before_render_template.connected_to(catat_render, app), \
+            rekam_sql() as sql:
+        kedua = klien.get(url_halaman[nama], headers={'If-None-Match': etag})
+
+    assert kedua.status_code == 304
+    assert kedua.data == b''
+    assert kedua.headers['ETag'] == etag
+    assert dirender == []
+    assert len(sql) <= rumi.BATAS_QUERY[nama]
+    dibaca = set().union(*(tabel_dibaca(s) for s, _ in sql))
+    assert dibaca <= TABEL_STEMPEL, dibaca - TABEL_STEMPEL
+
+
+def test_etag_berubah_setelah_progres_bertambah(app, klien_untuk, siswa_baru):
+    siswa = siswa_baru()
+    klien = klien_untuk(siswa)
+    with app.app_context():
+        materi = rumi.ambil_katalog(siswa.kelas).materis[0]
+        konten_id = materi.kontens[0].id
+    url = f'/materi/{materi.id}'
+    etag = klien.get(url).headers['ETag']
+    assert klien.post(f'/konten/{konten_id}/selesai', headers={'X-Rumi-Delta': '1'}).status_code == 200
+    respons = klien.get(url, headers={'If-None-Match': etag})
+    assert respons.status_code == 200
+    assert respons.headers['ETag'] != etag
+
+
+def angka_lonceng(html):
+    cocok = re.search(r'class="badge rounded-pill bg-danger"\s+style="[^"]*">\s*(\d+)', html)
+    return int(cocok.group(1)) if cocok else 0
+
+
+def test_notifikasi_baru_dari_worker_lain_mengubah_etag(app, subjek, klien_untuk, siswa_baru):
+    siswa = siswa_baru()
+    klien = klien_untuk(siswa)
+    pertama = klien.get('/jalur-belajar')
+    etag, belum_dibaca = pertama.headers['ETag'], angka_lonceng(pertama.get_data(as_text=True))
+
+    # Ditulis langsung ke database seperti oleh worker lain: cache ringkasan worker ini tidak dibersihkan
+    with app.app_context():
+        rumi.db.session.add(rumi.Notifikasi(pengirim_id=subjek['guru'].id, penerima_id=siswa.id, konten='Pesan baru'))
+        rumi.db.session.commit()
+    kedua = klien.get('/jalur-belajar', headers={'If-None-Match': etag})
+    assert kedua.status_code == 200 and kedua.headers['ETag'] != etag
+    assert angka_lonceng(kedua.get_data(as_text=True)) == belum_dibaca + 1
+
+    # Tanda dibaca juga mengubah stempel, jadi lonceng di halaman berikutnya ikut kosong
+    assert klien.post('/notifikasi/baca').get_json() == {'status': 'ok'}
+    ketiga = klien.get('/jalur-belajar', headers={'If-None-Match': kedua.headers['ETag']})
+    assert ketiga.status_code == 200 and angka_lonceng(ketiga.get_data(as_text=True)) == 0
+
+
+def test_cache_ringkasan_notifikasi_berbatas_lru(app, siswa_baru, monkeypatch):
+    monkeypatch.setattr(rumi, 'NOTIFIKASI_CACHE_MAKS_ENTRI', 2)
+    a, b, c = siswa_baru(), siswa_baru(), siswa_baru()
+    with app.app_context():
+        for user_id in (a.id, b.id):
+            rumi.hitung_ringkasan_notifikasi(user_id)
+        rumi.ringkasan_notifikasi(a.id)
+        rumi.hitung_ringkasan_notifikasi(c.id)
+    assert list(rumi._ringkasan_notifikasi) == [a.id, c.id]
@@ -0,0 +1,23 @@
+import app as rumi
+
+
+def test_layout_menandai_peran_untuk_antrean_progres(subjek, klien_untuk):
+    # main.js hanya mengirim antrean progres (/progres/sinkron) bila body bertanda peran siswa.
+    assert b'data-peran="siswa"' in klien_untuk(subjek['siswa']).get('/dashboard').data
+    for peran in ('guru', 'ortu', 'admin'):
+        halaman = klien_untuk(subjek[peran]).get('/dashboard', follow_redirects=True).data
+        assert b'data-peran="siswa"' not in halaman
+        assert b'data-peran="' in halaman
+
+
+
+def test_admin_dashboard_tanpa_ddl(subjek, klien_untuk, rekam_sql, monkeypatch):
+    # Indeks FTS dibuat oleh migrasi; request GET tidak boleh memeriksa atau membuatnya, juga di proses baru.
+    monkeypatch.setattr(rumi, '_fts_user_siap', False)
+    klien = klien_untuk(subjek['admin'])
+    with rekam_sql() as sql:
+        assert klien.get('/admin/dashboard').status_code == 200
+        respons = klien.get(f"/admin/dashboard?q={subjek['kata_pengguna']}")
+    assert respons.status_code == 200
+    assert subjek['siswa'].nama_lengkap.encode() in respons.data
+    assert not [s for s, _ in sql if s.lstrip().upper().startswith('CREATE') or 'sqlite_master' in s]
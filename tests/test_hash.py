@@ -0,0 +1,162 @@
+import fcntl
+import os
+import time
+
+import pytest
+
+import app as rumi
+
+
+@pytest.fixture
+def semua_slot_terpakai(monkeypatch):
+    # Kunci setiap slot lewat berkas terbuka sendiri, seperti worker gunicorn lain yang sedang hashing.
+    monkeypatch.setattr(rumi, 'HASH_TUNGGU_DETIK', 0.2)
+    os.makedirs(rumi.HASH_SLOT_DIR, exist_ok=True)
+    berkas = [open(os.path.join(rumi.HASH_SLOT_DIR, f'slot-{i}.kunci'), 'a') for i in range(rumi.HASH_KONKURENSI)]
+    for b in berkas:
+        fcntl.flock(b, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    yield
+    for b in berkas:
+        b.close()
+
+
+def test_hash_ditolak_cepat_bila_slot_penuh(semua_slot_terpakai):
+    mulai = time.monotonic()
+    with pytest.raises(rumi.HashSibuk):
+        rumi.hash_password('rahasia')
+    assert time.monotonic() - mulai < 1
+
+
+def test_login_saat_slot_penuh_dialihkan_dengan_pesan(app, semua_slot_terpakai):
+    respons = app.test_client().post('/login', data={'username': 'sintetis_admin', 'password': rumi.SINTETIS_PASSWORD})
+    assert respons.status_code == 303
+
+
+def test_slot_dilepas_setelah_hash(app):
+    for _ in range(rumi.HASH_KONKURENSI + 2):
+        assert rumi.cocokkan_password(rumi.hash_password('rahasia'), 'rahasia')
+    with pytest.raises(ZeroDivisionError):
+        rumi.jalankan_hash(lambda: 1 / 0)
+    assert rumi.cocokkan_password(rumi.hash_password('rahasia'), 'rahasia')
+
+
+@pytest.fixture
+def kunci_slot():
+    # kunci_slot(i): kunci slot ke-i lewat berkas terbuka sendiri; dilepas di akhir uji
+    berkas = []
+
+    def kunci(i):
+        os.makedirs(rumi.HASH_SLOT_DIR, exist_ok=True)
+        b = open(os.path.join(rumi.HASH_SLOT_DIR, f'slot-{i}.kunci'), 'a')
+        fcntl.flock(b, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        berkas.append(b)
+    yield kunci
+    for b in berkas:
+        b.close()
+
+
+def test_impor_massal_memakai_slot_hash_dan_menyisakan_slot_login(monkeypatch, kunci_slot):
+    ukuran_pool = []
+
+    class PoolTercatat(rumi.ProcessPoolExecutor):
+        def __init__(self, max_workers):
+            ukuran_pool.append(max_workers)
+            super().__init__(max_workers)
+
+    monkeypatch.setattr(rumi, 'ProcessPoolExecutor', PoolTercatat)
+    monkeypatch.setattr(rumi, 'HASH_KONKURENSI', 3)
+    monkeypatch.setattr(rumi, 'IMPOR_PROSES_HASH', 8)
+    monkeypatch.setattr(rumi, 'IMPOR_AMBANG_PARALEL', 2)
+    monkeypatch.setattr(rumi, 'IMPOR_TUNGGU_SLOT_DETIK', 0.2)
+
+    hasil = rumi.hash_password_massal(['satu', 'dua', 'tiga'])
+    assert [rumi.check_password_hash(h, p) for h, p in zip(hasil, ['satu', 'dua', 'tiga'])] == [True] * 3
+    assert ukuran_pool == [2]
+
+    # Dua slot pertama (jatah impor) dipakai worker lain: impor menunggu lalu gagal, login tetap mendapat slot terakhir
+    kunci_slot(0)
+    kunci_slot(1)
+    with pytest.raises(rumi.HashSibuk):
+        rumi.hash_password_massal(['satu', 'dua', 'tiga'])
+    assert rumi.cocokkan_password(rumi.hash_password('rahasia'), 'rahasia')
+
+
+@pytest.fixture
+def akun(app):
+    # akun(password, metode=None) -> username baru dengan password tersebut (metode hash opsional)
+    def buat(password, metode=None):
+        username = f'login_{os.urandom(4).hex()}'
+        with app.app_context():
+            rumi.db.session.add(rumi.User(
+                nama_lengkap='Uji Login', nama_sekolah='-', username=username, peran='guru',
+                password_hash=rumi.generate_password_hash(password, method=metode or rumi.HASH_METODE)))
+            rumi.db.session.commit()
+            rumi.db.session.remove()
+        return username
+    return buat
+
+
+def coba_login(klien, username, password):
+    klien.post('/login', data={'username': username, 'password': password})
+    with klien.session_transaction() as sesi:
+        berhasil = 'user_id' in sesi
+        pesan = [teks for _, teks in sesi.pop('_flashes', [])]
+        sesi.clear()
+    return berhasil, pesan
+
+
+def test_login_diblokir_setelah_gagal_berulang(app, akun):
+    username = akun('benar')
+    klien = app.test_client()
+    for _ in range(rumi.LOGIN_MAKS_GAGAL_USERNAME):
+        assert coba_login(klien, username, 'salah') == (False, ['Username atau password salah.'])
+    berhasil, pesan = coba_login(klien, username, 'benar')
+    assert not berhasil and pesan[0].startswith('Terlalu banyak percobaan login gagal')
+    # Blokir per username: akun lain dari IP yang sama tetap bisa login
+    assert coba_login(klien, akun('benar'), 'benar')[0]
+
+
+def test_login_berhasil_mereset_hitungan_gagal(app, akun):
+    username = akun('benar')
+    klien = app.test_client()
+    for _ in range(2):
+        for _ in range(rumi.LOGIN_MAKS_GAGAL_USERNAME - 1):
+            assert not coba_login(klien, username, 'salah')[0]
+        assert coba_login(klien, username, 'benar')[0]
+
+
+def test_login_diblokir_per_ip(app, akun, monkeypatch):
+    monkeypatch.setattr(rumi, 'LOGIN_MAKS_GAGAL_IP', 3)
+    klien = app.test_client()
+    klien.environ_base['REMOTE_ADDR'] = '10.9.8.7'
+    for _ in range(3):
+        assert not coba_login(klien, akun('benar'), 'salah')[0]
+    berhasil, pesan = coba_login(klien, akun('benar'), 'benar')
+    assert not berhasil and pesan[0].startswith('Terlalu banyak percobaan login gagal')
+    klien.environ_base['REMOTE_ADDR'] = '10.9.8.8'
+    assert coba_login(klien, akun('benar'), 'benar')[0]
+
+
+def test_hash_diperbarui_saat_login_bila_metode_berubah(app, akun):
+    username = akun('benar', metode='pbkdf2:sha256:2')
+
+    def hash_tersimpan():
+        with app.app_context():
+            nilai = rumi.User.query.filter_by(username=username).one().password_hash
+            rumi.db.session.remove()
+        return nilai
+
+    lama = hash_tersimpan()
+    assert rumi.perlu_hash_ulang(lama)
+    klien = app.test_client()
+    assert coba_login(klien, username, 'benar')[0]
+    baru = hash_tersimpan()
+    assert baru != lama and not rumi.perlu_hash_ulang(baru)
+    assert baru.startswith(rumi.awalan_hash_aktif() + '$')
+    assert rumi.check_password_hash(baru, 'benar')
+    # Hash yang sudah memakai metode aktif tidak ditulis ulang
+    assert coba_login(klien, username, 'benar')[0]
+    assert hash_tersimpan() == baru
+    # Login gagal tidak menyentuh hash
+    assert not coba_login(klien, username, 'salah')[0]
+    assert hash_tersimpan() == baru
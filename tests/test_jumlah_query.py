@@ -0,0 +1,23 @@
+import pytest
+
+import app as rumi
+
+
+@pytest.fixture(scope='module')
+def hasil_benchmark(app, subjek):
+    with app.app_context():
+        return rumi.jalankan_benchmark(ulang=2, ulang_memori=0)
+
+
+@pytest.mark.parametrize('nama', sorted(rumi.BATAS_QUERY))
+def test_jumlah_query_rute_dalam_batas(hasil_benchmark, nama):
+    # Data uji memuat lebih banyak siswa, materi dan notifikasi per halaman daripada batasnya,
+    # sehingga pola N+1 baru langsung melewati BATAS_QUERY.
+    assert nama in hasil_benchmark, f'skenario {nama} tidak dijalankan'
+    hasil = hasil_benchmark[nama]
+    assert max(hasil['status']) < 400, hasil['status']
+    assert hasil['query_maks'] <= rumi.BATAS_QUERY[nama]
+
+
+def test_setiap_skenario_punya_batas(hasil_benchmark):
+    assert set(hasil_benchmark) <= set(rumi.BATAS_QUERY)
@@ -0,0 +1,98 @@
+import datetime
+
+import app as rumi
+
+
+def konten_katalog(kelas, jumlah):
+    return [k.id for m in rumi.ambil_katalog(kelas).materis for k in m.kontens][:jumlah]
+
+
+def test_lencana_streak_diberikan_pada_hari_ketiga(app, siswa_baru):
+    siswa = siswa_baru()
+    hari_ini = rumi.waktu_utc_sekarang()
+    with app.app_context():
+        konten = konten_katalog(siswa.kelas, 3)
+        dapat = []
+        for mundur, konten_id in zip((2, 1, 0), konten):
+            hasil = rumi.catat_penyelesaian(siswa.id, [(konten_id, hari_ini - datetime.timedelta(days=mundur))])
+            dapat.append([nama for _, nama, _ in hasil['lencana_baru']])
+        assert dapat[0] == ['Langkah Pertama']
+        assert 'Semangat Tiga Hari' not in dapat[1]
+        assert 'Semangat Tiga Hari' in dapat[2]
+        assert rumi.db.session.get(rumi.StatistikSiswa, siswa.id).streak_hari == 3
+        rumi.db.session.remove()
+
+
+def test_evaluasi_lencana_hanya_membaca_ringkasan(app, siswa_baru, rekam_sql):
+    # Aturan dicek terhadap StatistikSiswa dan ledger PenguasaanMateri, tidak menghitung ulang ProgressSiswa.
+    siswa = siswa_baru()
+    with app.app_context():
+        konten = konten_katalog(siswa.kelas, 2)
+        rumi.catat_penyelesaian(siswa.id, [(konten[0], rumi.waktu_utc_sekarang())])
+        statistik = rumi.perbarui_statistik(siswa.id, [rumi.waktu_utc_sekarang()])
+        rumi.ambil_indeks_lencana()
+        with rekam_sql() as sql:
+            rumi.evaluasi_lencana(siswa.id, [konten[1]], statistik)
+        rumi.db.session.rollback()
+        rumi.db.session.remove()
+    assert sql
+    assert not [s for s, _ in sql if 'progress_siswa' in s]
+
+
+def test_lencana_alur_selesai_dari_ledger_per_tahap(app, siswa_baru, rekam_sql):
+    siswa = siswa_baru()
+    with app.app_context():
+        materi = next(m for m in rumi.ambil_katalog(siswa.kelas).materis if len(m.konten_per_alur.get('merefleksi', ())) > 1)
+        refleksi = [k.id for k in materi.konten_per_alur['merefleksi']]
+        lain = next(k.id for k in materi.kontens if k.id not in refleksi)
+        sekarang = rumi.waktu_utc_sekarang()
+
+        dapat = [nama for _, nama, _ in rumi.catat_penyelesaian(siswa.id, [(lain, sekarang)])['lencana_baru']]
+        for konten_id in refleksi[:-1]:
+            dapat += [nama for _, nama, _ in rumi.catat_penyelesaian(siswa.id, [(konten_id, sekarang)])['lencana_baru']]
+        assert 'Perenung Sejati' not in dapat
+        ledger = rumi.PenguasaanAlur.query.filter_by(user_id=siswa.id, materi_id=materi.id, alur='merefleksi').one()
+        assert (ledger.konten_selesai, ledger.total_konten) == (len(refleksi) - 1, len(refleksi))
+
+        with rekam_sql() as sql:
+            hasil = rumi.catat_penyelesaian(siswa.id, [(refleksi[-1], sekarang)])
+        assert 'Perenung Sejati' in [nama for _, nama, _ in hasil['lencana_baru']]
+        # Aturan tahap membaca satu baris ledger, bukan menghitung ProgressSiswa per konten tahap
+        assert len([s for s, _ in sql if 'FROM penguasaan_alur' in s and s.lstrip().startswith('SELECT')]) == 1
+        assert not [s for s, _ in sql if 'count(progress_siswa.id)' in s]
+        rumi.db.session.remove()
+
+
+def hitung_ulang_alur(user_id, materi_id):
+    # Nilai ledger per tahap yang benar, dihitung langsung dari ProgressSiswa dan KontenBelajar
+    hasil = {}
+    for konten in rumi.KontenBelajar.query.filter_by(materi_id=materi_id):
+        selesai, total = hasil.get(konten.alur, (0, 0))
+        sudah = rumi.ProgressSiswa.query.filter_by(user_id=user_id, konten_id=konten.id).count()
+        hasil[konten.alur] = (selesai + sudah, total + 1)
+    return hasil
+
+
+def test_ledger_alur_mengikuti_perpindahan_tahap(app, siswa_baru, klien_untuk):
+    siswa = siswa_baru()
+    with app.app_context():
+        materi = next(m for m in rumi.ambil_katalog(siswa.kelas).materis
+                      if m.konten_per_alur.get('memahami') and m.konten_per_alur.get('merefleksi'))
+        konten = materi.konten_per_alur['memahami'][0]
+        sekarang = rumi.waktu_utc_sekarang()
+        rumi.catat_penyelesaian(siswa.id, [(konten.id, sekarang), (materi.konten_per_alur['merefleksi'][0].id, sekarang)])
+        guru = rumi.db.session.get(rumi.User, rumi.db.session.get(rumi.MateriPokok, materi.id).tp.user_id)
+        rumi.db.session.remove()
+
+    klien = klien_untuk(guru)
+    for alur in ('merefleksi', 'memahami'):
+        respons = klien.post(f'/studio/konten/{konten.id}/edit', data={
+            'judul': konten.judul, 'alur': alur, 'tipe': konten.tipe, 'sumber_url': konten.sumber_url})
+        assert respons.status_code == 302
+        with app.app_context():
+            ledger = {p.alur: (p.konten_selesai, p.total_konten)
+                      for p in rumi.PenguasaanAlur.query.filter_by(user_id=siswa.id, materi_id=materi.id)}
+            benar = hitung_ulang_alur(siswa.id, materi.id)
+            rumi.db.session.remove()
+        assert ledger == {a: benar[a] for a in ledger}
+        assert set(ledger) == {'memahami', 'merefleksi'}
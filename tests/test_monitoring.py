@@ -0,0 +1,46 @@
+import base64
+import json
+import re
+
+import pytest
+
+import app as rumi
+
+
+def kursor_mentah(nilai):
+    return base64.urlsafe_b64encode(json.dumps(nilai).encode()).decode()
+
+
+@pytest.mark.parametrize('nilai', [
+    [{'a': 1}, 2, 3], ['7', 'Ani', '5'], ['7', None, 5], ['7', 'Ani', True], ['7', 'Ani'], {'kelas': '7'},
+])
+def test_decode_kursor_menolak_tipe_kolom_yang_salah(nilai):
+    assert rumi.decode_kursor(kursor_mentah(nilai), rumi.KURSOR_MONITORING) is None
+
+
+def test_decode_kursor_menerima_kunci_yang_sah():
+    assert rumi.decode_kursor(kursor_mentah(['7', 'Ani', 5]), rumi.KURSOR_MONITORING) == ['7', 'Ani', 5]
+    assert rumi.decode_kursor(kursor_mentah([None, 'Ani', 5]), rumi.KURSOR_MONITORING) == [None, 'Ani', 5]
+    assert rumi.decode_kursor('bukan-base64!', rumi.KURSOR_MONITORING) is None
+
+
+def test_kursor_rusak_dianggap_halaman_pertama(subjek, klien_untuk):
+    klien = klien_untuk(subjek['guru'])
+    pertama = klien.get('/monitoring-siswa')
+    assert pertama.status_code == 200
+    for nilai in ([{'a': 1}, 2, 3], [1, 2, 3], ['7', 'x', 'y']):
+        respons = klien.get('/monitoring-siswa?setelah=' + kursor_mentah(nilai))
+        assert respons.status_code == 200
+        assert respons.data == pertama.data
+    respons = klien_untuk(subjek['admin']).get('/admin/dashboard?setelah=' + kursor_mentah([{'a': 1}]))
+    assert respons.status_code == 200
+
+
+def test_kursor_berikutnya_melanjutkan_halaman(subjek, klien_untuk, monkeypatch):
+    monkeypatch.setattr(rumi, 'MONITORING_PER_HALAMAN', 5)
+    klien = klien_untuk(subjek['guru'])
+    halaman_1 = klien.get('/monitoring-siswa').data.decode()
+    kursor = re.search(r'setelah=([^"&]+)', halaman_1).group(1)
+    halaman_2 = klien.get('/monitoring-siswa?setelah=' + kursor).data.decode()
+    assert halaman_2 != halaman_1
+    assert 'setelah=' in halaman_2
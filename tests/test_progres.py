@@ -0,0 +1,87 @@
+import app as rumi
+
+
+def test_delta_progres_untuk_materi_di_halaman(app, subjek, klien_untuk):
+    with app.app_context():
+        materi_ids = [m.id for m in rumi.ambil_katalog(subjek['siswa'].kelas).materis][:2]
+    respons = klien_untuk(subjek['siswa']).get('/progres/delta?materi=' + ','.join(map(str, materi_ids + [999999])) + ',x')
+    assert respons.status_code == 200
+    data = respons.get_json()
+    assert [p['materi_id'] for p in data['progres']] == materi_ids
+    assert data['diterima'] == [] and data['lencana_baru'] == []
+    assert set(data['progres'][0]['tahap']) == set(rumi.URUTAN_ALUR)
+
+
+def test_delta_progres_khusus_siswa(subjek, klien_untuk):
+    assert klien_untuk(subjek['guru']).get('/progres/delta?materi=1').status_code == 302
+
+
+def test_kanal_push_hanya_dibuka_bila_koneksi_ditahan(subjek, klien_untuk, monkeypatch):
+    klien = klien_untuk(subjek['siswa'])
+    html = klien.get('/dashboard').data
+    assert b'data-push' not in html
+    assert f'data-pembaruan-cek="{rumi.PEMBARUAN_CEK_DETIK}"'.encode() in html
+    monkeypatch.setattr(rumi, 'PUSH_TAHAN_DETIK', 60)
+    html = klien.get('/dashboard').data
+    assert b'data-push' in html and b'data-pembaruan-cek' not in html
+
+
+def test_cek_pembaruan_langsung_menjawab_perubahan(app, subjek, klien_untuk, siswa_baru):
+    siswa = siswa_baru()
+    klien = klien_untuk(siswa)
+    respons = klien.get('/pembaruan/cek')
+    # Jawaban JSON biasa dengan panjang tetap, bukan aliran yang ditahan
+    assert respons.status_code == 200 and respons.mimetype == 'application/json'
+    assert int(respons.headers['Content-Length']) == len(respons.data)
+    awal = respons.get_json()
+    assert set(awal) == {'stempel'}
+    assert klien.get(f"/pembaruan/cek?sejak={awal['stempel']}").get_json() == awal
+
+    with app.app_context():
+        rumi.db.session.add(rumi.Notifikasi(pengirim_id=subjek['guru'].id, penerima_id=siswa.id, konten='Halo'))
+        materi = rumi.ambil_katalog(siswa.kelas).materis[0]
+        rumi.db.session.commit()
+    assert klien.post(f'/konten/{materi.kontens[0].id}/selesai', headers={'X-Rumi-Delta': '1'}).status_code == 200
+    data = klien.get(f"/pembaruan/cek?sejak={awal['stempel']}").get_json()
+    assert data['stempel'] != awal['stempel']
+    assert data['notifikasi']['belum_dibaca'] >= 1
+    assert data['progres'] == {'total_konten_selesai': 1}
+
+
+def test_hapus_konten_dan_materi_mengurangi_ringkasan_siswa(app, subjek, klien_untuk, siswa_baru):
+    siswa = siswa_baru()
+    guru = klien_untuk(subjek['guru'])
+    assert guru.post('/studio/tp/baru', data={'deskripsi': 'TP hapus', 'kelas_tujuan': siswa.kelas}).status_code == 302
+    with app.app_context():
+        tp_id = rumi.db.session.query(rumi.func.max(rumi.TujuanPembelajaran.id)).scalar()
+    assert guru.post(f'/studio/tp/{tp_id}/materi/baru', data={'judul': 'Materi hapus', 'deskripsi': '-'}).status_code == 302
+    with app.app_context():
+        materi_id = rumi.MateriPokok.query.filter_by(tp_id=tp_id).one().id
+    for alur in ('memahami', 'memahami', 'merefleksi'):
+        assert guru.post(f'/studio/materi/{materi_id}/kelola', data={
+            'judul': f'K {alur}', 'tipe': 'Video', 'alur': alur, 'sumber_url': 'http://x'}).status_code == 302
+
+    with app.app_context():
+        konten_ids = [k.id for k in rumi.KontenBelajar.query.filter_by(materi_id=materi_id).order_by(rumi.KontenBelajar.id)]
+        lain = next(k.id for m in rumi.ambil_katalog(siswa.kelas).materis for k in m.kontens)
+        sekarang = rumi.waktu_utc_sekarang()
+        rumi.catat_penyelesaian(siswa.id, [(k, sekarang) for k in konten_ids + [lain]])
+        assert rumi.stempel_progres(siswa.id)[0] == 4
+        rumi.db.session.remove()
+
+    def ringkasan():
+        with app.app_context():
+            hasil = (rumi.db.session.get(rumi.StatistikSiswa, siswa.id).total_konten_selesai,
+                     {(p.konten_selesai, p.total_konten) for p in rumi.PenguasaanMateri.query.filter_by(
+                         user_id=siswa.id, materi_id=materi_id)},
+                     {p.alur: (p.konten_selesai, p.total_konten) for p in rumi.PenguasaanAlur.query.filter_by(
+                         user_id=siswa.id, materi_id=materi_id)})
+            rumi.db.session.remove()
+        return hasil
+
+    assert guru.post(f'/studio/konten/{konten_ids[0]}/hapus').status_code == 302
+    assert ringkasan() == (3, {(2, 2)}, {'memahami': (1, 1), 'merefleksi': (1, 1)})
+    assert guru.post(f'/studio/materi/{materi_id}/hapus').status_code == 302
+    assert ringkasan() == (1, set(), {})
+    assert guru.post(f'/studio/tp/{tp_id}/hapus').status_code == 302
+    assert ringkasan()[0] == 1
@@ -0,0 +1,23 @@
+import app as rumi
+
+
+def test_query_rute_utama_tidak_full_scan(app, subjek):
+    with app.app_context():
+        sql = rumi.rekam_sql_rute(rumi.skenario_rencana_query(subjek))
+        hasil = rumi.periksa_rencana_query(rumi.db.engine, sql)
+    assert all(sql.values()), [nama for nama, daftar in sql.items() if not daftar]
+    gagal = {nama: [(' '.join(statement.split()), rencana) for statement, rencana, scan in daftar if scan]
+             for nama, daftar in hasil.items()}
+    assert not any(gagal.values()), {nama: g for nama, g in gagal.items() if g}
+
+
+def test_full_scan_hanya_tabel_besar_tanpa_indeks():
+    sql = 'SELECT * FROM progress_siswa WHERE tanggal_selesai > ?'
+    assert rumi.full_scan(sql, ['SCAN progress_siswa']) == ['SCAN progress_siswa']
+    assert rumi.full_scan(sql + ' LIMIT ?', ['SCAN progress_siswa']) == ['SCAN progress_siswa']
+    assert rumi.full_scan(sql, ['SCAN progress_siswa USING INDEX ix_progress_user_tanggal']) == []
+    assert rumi.full_scan('SELECT * FROM badge', ['SCAN badge']) == []
+    # Tanpa WHERE dan tanpa pengurutan sementara, LIMIT menghentikan scan lebih awal
+    assert rumi.full_scan('SELECT * FROM user ORDER BY user.id DESC LIMIT ?', ['SCAN user']) == []
+    assert rumi.full_scan('SELECT * FROM user ORDER BY user.nama_lengkap LIMIT ?',
+                          ['SCAN user', 'USE TEMP B-TREE FOR ORDER BY']) == ['SCAN user']
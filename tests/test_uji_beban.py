@@ -0,0 +1,39 @@
+import os
+
+import app as rumi
+
+
+def test_uji_beban_tulis_memakai_engine_aplikasi():
+    env_lama = os.environ['RUMI_DATABASE']
+    hasil = rumi.uji_beban_tulis(2, 1, 15, {'RUMI_SQLITE_PROFIL': 'wal', 'RUMI_SQLITE_POOL_BACA': '1',
+                                            'RUMI_SQLITE_SERIAL_TULIS': '0'})
+    assert hasil['operasi'] == 30
+    assert hasil['gagal'] == 0
+    assert 0 < hasil['p50'] <= hasil['p99']
+    assert os.environ['RUMI_DATABASE'] == env_lama
+
+
+def test_serial_tulis_menjawab_503_bila_kunci_tidak_didapat(app, klien_untuk, siswa_baru, monkeypatch):
+    monkeypatch.setattr(rumi, 'SQLITE_SERIAL_TULIS', True)
+    monkeypatch.setattr(rumi, 'SQLITE_BUSY_MS', 50)
+    siswa = siswa_baru()
+    with app.app_context():
+        konten_id = rumi.ambil_katalog(siswa.kelas).materis[0].kontens[0].id
+    klien = klien_untuk(siswa)
+
+    assert rumi._kunci_tulis.acquire(timeout=1)
+    try:
+        respons = klien.post(f'/konten/{konten_id}/selesai')
+    finally:
+        rumi._kunci_tulis.release()
+    assert respons.status_code == 503
+    assert respons.headers['Retry-After'] == '1'
+    with app.app_context():
+        assert rumi.ProgressSiswa.query.filter_by(user_id=siswa.id).count() == 0
+
+    # Setelah kunci bebas tulisan berjalan, dan kuncinya dilepas lagi di akhir transaksi
+    assert klien.post(f'/konten/{konten_id}/selesai').status_code == 200
+    assert rumi._kunci_tulis.acquire(blocking=False)
+    rumi._kunci_tulis.release()
+    with app.app_context():
+        assert rumi.ProgressSiswa.query.filter_by(user_id=siswa.id).count() == 1
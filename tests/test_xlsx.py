@@ -0,0 +1,81 @@
+import csv
+import io
+import os
+
+import pytest
+
+import app as rumi
+
+openpyxl = rumi.openpyxl
+perlu_openpyxl = pytest.mark.skipif(openpyxl is None, reason='openpyxl tidak terpasang')
+
+
+@perlu_openpyxl
+def test_ekspor_xlsx_sama_dengan_csv(subjek, klien_untuk):
+    klien = klien_untuk(subjek['guru'])
+    kelas = subjek['siswa'].kelas
+    csv_teks = klien.get(f'/monitoring-siswa/ekspor?kelas={kelas}&format=csv').get_data(as_text=True)
+    respons = klien.get(f'/monitoring-siswa/ekspor?kelas={kelas}&format=xlsx')
+    assert respons.status_code == 200
+    assert respons.headers['Content-Disposition'].endswith('.xlsx')
+
+    lembar = openpyxl.load_workbook(io.BytesIO(respons.data), read_only=True)['Progres']
+    baris_xlsx = [['' if sel is None else str(sel) for sel in baris] for baris in lembar.iter_rows(values_only=True)]
+    baris_csv = list(csv.reader(io.StringIO(csv_teks.lstrip('\ufeff'))))
+    assert len(baris_xlsx) > 1
+    assert baris_xlsx == baris_csv
+    assert 'format=xlsx' in klien.get(f'/monitoring-siswa?kelas={kelas}').get_data(as_text=True)
+
+
+@perlu_openpyxl
+def test_baca_berkas_impor_xlsx():
+    buku = openpyxl.Workbook()
+    lembar = buku.active
+    lembar.append(['Nama_Lengkap', 'Username', 'Password', 'Peran', 'Nama_Sekolah', 'Kelas'])
+    lembar.append(['Siti Aminah', 'siti_xlsx', 'rahasia123', 'siswa', 'SD Uji', 4.0])
+    lembar.append([None, None, None, None, None, None])
+    berkas = io.BytesIO()
+    buku.save(berkas)
+    berkas.seek(0)
+
+    daftar = rumi.baca_berkas_impor(berkas, 'daftar.XLSX')
+    assert daftar == [{'nama_lengkap': 'Siti Aminah', 'username': 'siti_xlsx', 'password': 'rahasia123',
+                       'peran': 'siswa', 'nama_sekolah': 'SD Uji', 'kelas': '4'}]
+
+
+def test_amankan_sel_memberi_awalan_pada_calon_rumus():
+    for awalan in ('=', '+', '-', '@', '\t', '\r'):
+        assert rumi.amankan_sel(awalan + 'SUM(A1:A9)') == "'" + awalan + 'SUM(A1:A9)'
+    assert rumi.amankan_sel('Siti = juara') == 'Siti = juara'
+    assert rumi.amankan_sel(42) == 42
+    assert rumi.amankan_sel('') == ''
+
+
+@pytest.fixture
+def siswa_jahat(app, subjek):
+    # Siswa mendaftar sendiri dengan nama dan username yang berupa rumus spreadsheet
+    nama = '=HYPERLINK("http://contoh.invalid","klik")'
+    username = f'@jahat_{os.urandom(3).hex()}'
+    respons = app.test_client().post('/register/student', data={
+        'nama': nama, 'sekolah': subjek['guru'].nama_sekolah, 'kelas': subjek['siswa'].kelas,
+        'username': username, 'password': 'rahasia123'})
+    assert respons.status_code == 302
+    return nama, username
+
+
+def test_ekspor_csv_tidak_membawa_rumus(subjek, klien_untuk, siswa_jahat):
+    nama, username = siswa_jahat
+    teks = klien_untuk(subjek['guru']).get(
+        f"/monitoring-siswa/ekspor?kelas={subjek['siswa'].kelas}&format=csv").get_data(as_text=True)
+    baris = next(b for b in csv.reader(io.StringIO(teks.lstrip('\ufeff'))) if username in b[2])
+    assert baris[1:3] == ["'" + nama, "'" + username]
+
+
+@perlu_openpyxl
+def test_ekspor_xlsx_tidak_membawa_rumus(subjek, klien_untuk, siswa_jahat):
+    nama, username = siswa_jahat
+    respons = klien_untuk(subjek['guru']).get(f"/monitoring-siswa/ekspor?kelas={subjek['siswa'].kelas}&format=xlsx")
+    lembar = openpyxl.load_workbook(io.BytesIO(respons.data))['Progres']
+    baris = next(b for b in lembar.iter_rows() if username in str(b[2].value))
+    assert [sel.value for sel in baris[1:3]] == ["'" + nama, "'" + username]
+    assert all(sel.data_type != 'f' for b in lembar.iter_rows() for sel in b)